@@ -0,0 +1,4 @@
+from backup_juggler.juggler_cli import app
+
+if __name__ == '__main__':
+    app(prog_name='bj')
@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from pathlib import Path
+
+COPY_ORDERS = ['scan', 'inode', 'extent', 'largest', 'smallest']
+HASH_ALGORITHMS = ['blake2b', 'sha256']
+COMPRESSION_CODECS = ['gzip', 'bz2', 'lzma']
+
+
+@dataclass(frozen=True)
+class BackupOptions:
+    """
+    Settings shared by every backup of a `bj do-backups` run.
+
+    Attributes:
+        incremental: Copy only the files that are new or changed at the destination.
+        checksum: In incremental mode, compare file contents instead of modification times.
+        workers: The number of files of a backup copied at the same time.
+        copy_order: The order the files of each backup are copied in, one of
+            `COPY_ORDERS`. Not used in streaming mode.
+        streaming: Copy the files while the source is scanned, through bounded queues,
+            instead of scanning the whole source first.
+        includes: The glob patterns of the files to copy. Empty means every file.
+        excludes: The glob patterns of the files and directories not to copy, to which
+            the patterns of the `.bjignore` file of each source are added (see
+            `filter_manager.PathFilter`).
+        device_workers: The maximum number of files copied at the same time to a single
+            destination device, across all the backups. `None` means no limit.
+        hash_algorithm: The `hashlib` algorithm used to checksum the files while they are
+            copied and to write the manifest of each backup. `None` disables hashing.
+        resumable: Write files to temporary paths renamed into place when complete, and
+            journal the progress of large files so interrupted copies can resume.
+        snapshot: Write every run to a new timestamped snapshot directory, hardlinking
+            the files unchanged since the previous snapshot.
+        keep_snapshots: The number of snapshots kept per source in snapshot mode; older
+            ones are pruned. `None` keeps them all.
+        dedup: Store every distinct file content once, in a content-addressed store at
+            each destination, and link the backed up files to it.
+        sparse: Copy only the data regions of sparse files and recreate their holes at
+            the destination.
+        use_mmap: Hash and copy files of at least `files_manager.MMAP_MIN_SIZE` bytes
+            from memory mappings when they are copied in userspace.
+        delta: Update existing copies of files of at least
+            `delta_manager.DELTA_MIN_SIZE` bytes in place, writing only the blocks that
+            changed. Not used in resumable or snapshot mode.
+        pack_threshold: The size up to which files are packed into tar segments
+            instead of being copied one by one (see `pack_manager.PackStore`). `None`
+            disables packing.
+        compression: The codec files are compressed with, one of
+            `COMPRESSION_CODECS`. `None` copies them as is.
+        compression_workers: The number of processes compressing blocks, shared by
+            all the backups. `None` uses one per CPU.
+        bytes_per_second: The maximum number of bytes copied per second by each backup.
+        files_per_second: The maximum number of files copied per second by each backup.
+        global_bytes_per_second: The maximum number of bytes copied per second by all
+            the backups together.
+        global_files_per_second: The maximum number of files copied per second by all
+            the backups together.
+        control_file: A JSON file watched while the backups run, whose limits replace
+            the ones above (see `throttle_manager.ControlFileWatcher`).
+        progress: How the progress is shown: `bar`, `json` lines, `quiet`, or `auto`
+            for a bar only when writing to a terminal.
+        metrics_json: A JSON file the timings of every backup are written to.
+        metrics_textfile: A Prometheus textfile the timings of every backup are
+            written to.
+    """
+
+    incremental: bool = False
+    checksum: bool = False
+    workers: int = 1
+    copy_order: str = 'scan'
+    streaming: bool = False
+    includes: tuple[str, ...] = ()
+    excludes: tuple[str, ...] = ()
+    device_workers: int | None = None
+    hash_algorithm: str | None = None
+    resumable: bool = False
+    snapshot: bool = False
+    keep_snapshots: int | None = None
+    dedup: bool = False
+    sparse: bool = False
+    use_mmap: bool = False
+    delta: bool = False
+    pack_threshold: int | None = None
+    compression: str | None = None
+    compression_workers: int | None = None
+    bytes_per_second: int | None = None
+    files_per_second: float | None = None
+    global_bytes_per_second: int | None = None
+    global_files_per_second: float | None = None
+    control_file: Path | None = None
+    progress: str = 'auto'
+    metrics_json: Path | None = None
+    metrics_textfile: Path | None = None
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from backup_juggler.backup_options import HASH_ALGORITHMS
+from backup_juggler.compression_manager import (
+    COMPRESSED_SUFFIX,
+    compressed_digest,
+    is_compressed_file,
+    raw_size,
+)
+from backup_juggler.pack_manager import PACK_DIRECTORY, PackStore
+
+MANIFEST_SUFFIX = '.bj-manifest.json'
+
+
+def manifest_path(backup_dir: str | Path) -> Path:
+    """
+    Get the path of the manifest of a backup directory.
+
+    Args:
+        backup_dir: The directory a source was copied into (`destination/<source.stem>`).
+
+    Returns:
+        The manifest path, next to the backup directory.
+    """
+
+    return Path(f'{os.fspath(backup_dir)}{MANIFEST_SUFFIX}')
+
+
+def file_digest(path: str | Path, algorithm: str) -> str:
+    """
+    Hash the contents of a file.
+
+    Args:
+        path: The path of the file.
+        algorithm: The name of the `hashlib` algorithm.
+
+    Returns:
+        The hexadecimal digest of the file.
+    """
+
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, algorithm).hexdigest()
+
+
+class Manifest:
+    """
+    Checksums of the files of a backup directory.
+
+    Attributes:
+        _path: The path of the manifest file.
+        _algorithm: The name of the `hashlib` algorithm of the digests.
+        _files: The recorded files, by relative path, with their digest, size,
+            modification time and last verification time.
+        _lock: The lock protecting `_files` when copying with several workers.
+
+    Methods:
+        - algorithm: Get the hash algorithm.
+        - files: Get the recorded files.
+        - record: Record the digest of a copied or verified file.
+        - save: Write the manifest to disk.
+
+    Notes:
+        - The manifest is stored as JSON next to the backup directory (see `manifest_path`),
+          so it is never copied nor scanned as part of the backup itself.
+        - Opening an existing manifest with a different algorithm discards its digests.
+    """
+
+    def __init__(self, path: Path, algorithm: str = None) -> None:
+        """
+        Initialize a `Manifest` instance, loading the existing manifest file if any.
+
+        Args:
+            path: The path of the manifest file.
+            algorithm: The name of the `hashlib` algorithm. Defaults to the algorithm
+                of the existing manifest.
+
+        Raises:
+            FileNotFoundError: If no algorithm is given and the manifest does not exist.
+        """
+
+        self._path: Path = path
+        self._lock: threading.Lock = threading.Lock()
+        try:
+            with open(path) as file:
+                content = json.load(file)
+        except FileNotFoundError:
+            if algorithm is None:
+                raise FileNotFoundError(f'{path.name} does not exist.')
+            content = {'algorithm': algorithm, 'files': {}}
+        self._algorithm: str = algorithm or content['algorithm']
+        self._files: dict[str, dict] = (
+            content['files'] if content['algorithm'] == self._algorithm else {}
+        )
+
+    @property
+    def algorithm(self) -> str:
+        """
+        Get the hash algorithm.
+
+        Returns:
+            _algorithm: The name of the `hashlib` algorithm.
+        """
+
+        return self._algorithm
+
+    @property
+    def files(self) -> dict[str, dict]:
+        """
+        Get the recorded files.
+
+        Returns:
+            _files: The recorded files, by relative path.
+        """
+
+        return self._files
+
+    def record(
+        self,
+        relative_path: str,
+        digest: str,
+        size: int,
+        mtime_ns: int,
+    ) -> None:
+        """
+        Record the digest of a copied or verified file.
+
+        Args:
+            relative_path: The path of the file relative to the backup directory.
+            digest: The hexadecimal digest of the file.
+            size: The size of the file in bytes.
+            mtime_ns: The modification time of the file in nanoseconds.
+        """
+
+        with self._lock:
+            self._files[relative_path] = {
+                'digest': digest,
+                'size': size,
+                'mtime_ns': mtime_ns,
+                'verified_ns': time.time_ns(),
+            }
+
+    def save(self) -> None:
+        """
+        Write the manifest to disk, replacing the previous one atomically.
+        """
+
+        temporary_path = self._path.with_name(f'.{self._path.name}.tmp')
+        with self._lock, open(temporary_path, 'w') as file:
+            json.dump(
+                {'algorithm': self._algorithm, 'files': self._files}, file
+            )
+        os.replace(temporary_path, self._path)
+
+
+class VerifyReport(NamedTuple):
+    """
+    The result of verifying a backup directory against its manifest.
+
+    Attributes:
+        verified: The number of files whose contents were hashed and matched.
+        skipped: The number of files skipped because they did not change since their
+            last verification.
+        mismatched: The relative paths of the files whose digest did not match.
+        missing: The relative paths of the recorded files that no longer exist.
+    """
+
+    verified: int
+    skipped: int
+    mismatched: list[str]
+    missing: list[str]
+
+
+def verify_backup(
+    backup_dir: Path, workers: int = None, changed_only: bool = False
+) -> VerifyReport:
+    """
+    Check the files of a backup directory against its manifest.
+
+    Args:
+        backup_dir: The directory a source was copied into.
+        workers: The number of files hashed at the same time. Defaults to the
+            `ThreadPoolExecutor` default.
+        changed_only: If `True`, files whose size and modification time still match
+            the manifest are not read again.
+
+    Returns:
+        The `VerifyReport` of the backup directory.
+
+    Raises:
+        FileNotFoundError: If the backup directory has no manifest.
+
+    Files are hashed in parallel; `hashlib` releases the GIL while hashing, so the
+    threads scale with the available disk bandwidth. The verification time of every
+    matching file is recorded in the manifest.
+
+    Files stored compressed, with the `.bjz` suffix added to their name and in the
+    `.bjz` format, are checked against the digest and size of the data they hold, and packed files are read from their segment.
+    """
+
+    manifest = Manifest(manifest_path(backup_dir))
+    packs = None
+    if os.path.isdir(os.path.join(backup_dir, PACK_DIRECTORY)):
+        packs = PackStore(backup_dir)
+
+    def check_packed(relative_path: str, record: dict) -> str:
+        packed = packs.files.get(relative_path) if packs else None
+        if packed is None:
+            return 'missing'
+        if (
+            changed_only
+            and packed['size'] == record['size']
+            and packed['mtime_ns'] == record['mtime_ns']
+        ):
+            return 'skipped'
+        digest = hashlib.new(
+            manifest.algorithm, packs.read(relative_path)
+        ).hexdigest()
+        if digest != record['digest']:
+            return 'mismatched'
+        manifest.record(
+            relative_path, digest, packed['size'], packed['mtime_ns']
+        )
+        return 'verified'
+
+    def check(relative_path: str, record: dict) -> str:
+        path = os.path.join(backup_dir, relative_path)
+        compressed = False
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            path += COMPRESSED_SUFFIX
+            compressed = True
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return check_packed(relative_path, record)
+            if not is_compressed_file(path):
+                return 'missing'
+        size = raw_size(path) if compressed else stat.st_size
+        if (
+            changed_only
+            and size == record['size']
+            and stat.st_mtime_ns == record['mtime_ns']
+        ):
+            return 'skipped'
+        digest = (
+            compressed_digest(path, manifest.algorithm)
+            if compressed
+            else file_digest(path, manifest.algorithm)
+        )
+        if digest != record['digest']:
+            return 'mismatched'
+        manifest.record(relative_path, digest, size, stat.st_mtime_ns)
+        return 'verified'
+
+    records = list(manifest.files.items())
+    with ThreadPoolExecutor(workers) as executor:
+        statuses = list(executor.map(lambda item: check(*item), records))
+    manifest.save()
+
+    results: dict[str, list[str]] = {
+        'verified': [],
+        'skipped': [],
+        'mismatched': [],
+        'missing': [],
+    }
+    for (relative_path, _), status in zip(records, statuses):
+        results[status].append(relative_path)
+    return VerifyReport(
+        len(results['verified']),
+        len(results['skipped']),
+        sorted(results['mismatched']),
+        sorted(results['missing']),
+    )
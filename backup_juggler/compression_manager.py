@@ -0,0 +1,557 @@
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import shutil
+import struct
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable
+
+from backup_juggler.backup_options import COMPRESSION_CODECS
+from backup_juggler.pack_manager import PACK_DIRECTORY
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+COMPRESSED_SUFFIX = '.bjz'
+BLOCK_SIZE = 4 * 1024 * 1024
+INCOMPRESSIBLE_RATIO = 0.95
+INCOMPRESSIBLE_SUFFIXES = {
+    '.7z',
+    '.avi',
+    '.bz2',
+    '.flac',
+    '.gif',
+    '.gz',
+    '.heic',
+    '.jpeg',
+    '.jpg',
+    '.mkv',
+    '.mov',
+    '.mp3',
+    '.mp4',
+    '.ogg',
+    '.png',
+    '.rar',
+    '.webm',
+    '.webp',
+    '.xz',
+    '.zip',
+    '.zst',
+}
+
+_CODEC_IDS = {name: index for index, name in enumerate(COMPRESSION_CODECS)}
+_CODECS = {
+    'gzip': (gzip.compress, gzip.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+_HEADER = struct.Struct('<4sB3xI')
+_FRAME = struct.Struct('<BI')
+_OFFSET = struct.Struct('<Q')
+_TRAILER = struct.Struct('<QQ4s')
+_MAGIC = b'BJZ1'
+_TRAILER_MAGIC = b'BJZT'
+_STORED, _COMPRESSED = 0, 1
+
+_pool_lock = threading.Lock()
+_pool: 'ProcessPoolExecutor | None' = None
+
+
+def is_incompressible(path: str) -> bool:
+    """
+    Check if a file is known not to compress, from its extension.
+
+    Args:
+        path: The path of the file.
+
+    Returns:
+        `True` for already compressed formats such as media files and archives.
+    """
+
+    return os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_SUFFIXES
+
+
+def compression_pool(workers: int = None) -> 'ProcessPoolExecutor':
+    """
+    Get the process pool compressing and decompressing blocks.
+
+    Args:
+        workers: The number of processes, used when the pool is created. Defaults
+            to the number of CPUs.
+
+    Returns:
+        The pool shared by every backup of the process.
+
+    The processes are started with `spawn`, which is safe while other threads run. The
+    pool is imported and created on first use, so the CLI starts without it.
+    """
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+
+def shutdown_pool() -> None:
+    """
+    Stop the processes of the compression pool, if it was started.
+    """
+
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def _compress_block(codec: str, block: bytes) -> bytes | None:
+    """
+    Compress a block, run in the worker processes.
+
+    Args:
+        codec: One of the `COMPRESSION_CODECS`.
+        block: The raw block.
+
+    Returns:
+        The compressed block, or `None` if it is not at least `INCOMPRESSIBLE_RATIO`
+        times smaller than the raw block.
+    """
+
+    compressed = _CODECS[codec][0](block)
+    if len(compressed) >= len(block) * INCOMPRESSIBLE_RATIO:
+        return None
+    return compressed
+
+
+def _decompress_block(codec: str, flags: int, stored: bytes) -> bytes:
+    """
+    Decompress a block, run in the worker processes.
+
+    Args:
+        codec: One of the `COMPRESSION_CODECS`.
+        flags: Whether the block was stored compressed or raw.
+        stored: The block as stored in the file.
+
+    Returns:
+        The raw block.
+    """
+
+    if flags == _STORED:
+        return stored
+    return _CODECS[codec][1](stored)
+
+
+class _Submitter:
+    """
+    Run block functions in a pool, or inline when there is no pool.
+    """
+
+    def __init__(self, executor: Executor | None) -> None:
+        self._executor = executor
+
+    def submit(self, function: Callable, *args: Any) -> Future:
+        if self._executor is not None:
+            return self._executor.submit(function, *args)
+        future: Future = Future()
+        future.set_result(function(*args))
+        return future
+
+
+def compress_stream(
+    src: BinaryIO,
+    outputs: list[BinaryIO],
+    codec: str,
+    progress: Callable[[int], None],
+    hasher: Any = None,
+    executor: Executor = None,
+    window: int = None,
+) -> int:
+    """
+    Compress a file into the framed `.bjz` format.
+
+    Args:
+        src: The source file, opened for reading.
+        outputs: The files the compressed stream is written to, opened for writing.
+        codec: One of the `COMPRESSION_CODECS`.
+        progress: Called with the number of raw bytes written after every block.
+        hasher: The `hashlib` object updated with the raw bytes, or `None`.
+        executor: The pool compressing the blocks. Defaults to `None`, which
+            compresses them in the calling thread.
+        window: The maximum number of blocks being compressed at the same time.
+            Defaults to twice the number of processes of the pool.
+
+    Returns:
+        The size of the raw data.
+
+    The file is cut in blocks of `BLOCK_SIZE` bytes compressed independently, so they can
+    be compressed and decompressed in parallel. Blocks that do not compress well are
+    stored raw, and when the first block of a file does not compress, the rest of the
+    file is stored raw without trying.
+
+    Notes:
+        - The file starts with a header (magic, codec, block size), followed by the blocks,
+          each one preceded by its flags and stored size. It ends with the offset of every
+          block and a trailer (number of blocks, raw size, magic), so a reader can seek to
+          any block directly.
+    """
+
+    submitter = _Submitter(executor)
+    window = window or 2 * (getattr(executor, '_max_workers', 1) or 1)
+    header = _HEADER.pack(_MAGIC, _CODEC_IDS[codec], BLOCK_SIZE)
+    for output in outputs:
+        output.write(header)
+    position = len(header)
+    offsets = []
+    raw_size = 0
+    pending: deque[tuple[bytes, Future | None]] = deque()
+
+    def write_next() -> None:
+        nonlocal position
+        block, future = pending.popleft()
+        compressed = future.result() if future is not None else None
+        stored, flags = (
+            (block, _STORED)
+            if compressed is None
+            else (compressed, _COMPRESSED)
+        )
+        frame = _FRAME.pack(flags, len(stored))
+        for output in outputs:
+            output.write(frame)
+            output.write(stored)
+        offsets.append(position)
+        position += len(frame) + len(stored)
+        progress(len(block))
+
+    compress = True
+    while block := src.read(BLOCK_SIZE):
+        if hasher is not None:
+            hasher.update(block)
+        raw_size += len(block)
+        future = None
+        if compress:
+            future = submitter.submit(_compress_block, codec, block)
+            if not offsets and not pending:
+                compress = future.result() is not None
+        pending.append((block, future))
+        while len(pending) >= window:
+            write_next()
+    while pending:
+        write_next()
+
+    table = b''.join(_OFFSET.pack(offset) for offset in offsets)
+    trailer = _TRAILER.pack(len(offsets), raw_size, _TRAILER_MAGIC)
+    for output in outputs:
+        output.write(table)
+        output.write(trailer)
+    return raw_size
+
+
+def _read_layout(file: BinaryIO) -> tuple[str, int, list[int], int]:
+    """
+    Read the header and the block table of a `.bjz` file.
+
+    Args:
+        file: The compressed file, opened for reading.
+
+    Returns:
+        The codec, the block size, the offset of every block and the raw size.
+
+    Raises:
+        ValueError: If the file is not in the `.bjz` format.
+    """
+
+    name = os.path.basename(getattr(file, 'name', ''))
+    size = file.seek(0, os.SEEK_END)
+    if size < _HEADER.size + _TRAILER.size:
+        raise ValueError(f'{name} is not a .bjz file.')
+    file.seek(0)
+    magic, codec_id, block_size = _HEADER.unpack(file.read(_HEADER.size))
+    file.seek(-_TRAILER.size, os.SEEK_END)
+    count, raw_size, trailer_magic = _TRAILER.unpack(file.read(_TRAILER.size))
+    if (
+        magic != _MAGIC
+        or trailer_magic != _TRAILER_MAGIC
+        or codec_id >= len(COMPRESSION_CODECS)
+        or _HEADER.size + count * _OFFSET.size + _TRAILER.size > size
+    ):
+        raise ValueError(f'{name} is not a .bjz file.')
+    file.seek(-_TRAILER.size - count * _OFFSET.size, os.SEEK_END)
+    table = file.read(count * _OFFSET.size)
+    offsets = [offset for (offset,) in _OFFSET.iter_unpack(table)]
+    return COMPRESSION_CODECS[codec_id], block_size, offsets, raw_size
+
+
+def _read_frame(file: BinaryIO, offset: int) -> tuple[int, bytes]:
+    """
+    Read a block of a `.bjz` file as stored.
+
+    Args:
+        file: The compressed file, opened for reading.
+        offset: The offset of the block, from the block table.
+
+    Returns:
+        The flags and the stored bytes of the block.
+    """
+
+    file.seek(offset)
+    flags, length = _FRAME.unpack(file.read(_FRAME.size))
+    return flags, file.read(length)
+
+
+def is_compressed_file(path: str | Path) -> bool:
+    """
+    Check if a file is in the `.bjz` format, whatever its name.
+
+    Args:
+        path: The path of the file.
+
+    Returns:
+        `True` if the file has the header, trailer and block table of a `.bjz` file,
+        so a plain file that happens to be named `*.bjz` is not taken for one.
+    """
+
+    try:
+        with open(path, 'rb') as file:
+            _read_layout(file)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def raw_size(path: str | Path) -> int:
+    """
+    Get the size of the data compressed in a `.bjz` file.
+
+    Args:
+        path: The path of the compressed file.
+
+    Returns:
+        The size of the raw data in bytes, read from the trailer.
+    """
+
+    with open(path, 'rb') as file:
+        return _read_layout(file)[3]
+
+
+class CompressedReader(io.RawIOBase):
+    """
+    Seekable reader of the raw data of a `.bjz` file.
+
+    Attributes:
+        _file: The compressed file.
+        _codec: The codec of the file.
+        _block_size: The raw size of every block but the last.
+        _offsets: The offset of every block in the compressed file.
+        _size: The size of the raw data.
+        _position: The current position in the raw data.
+        _cached: The index and raw bytes of the last decompressed block.
+
+    Methods:
+        - readinto: Read raw bytes into a buffer.
+        - seek: Move to a position of the raw data, decompressing only its block.
+        - close: Close the compressed file.
+
+    Notes:
+        - Wrap the reader in `io.BufferedReader` to use it with `hashlib.file_digest`.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        """
+        Initialize a `CompressedReader` instance.
+
+        Args:
+            path: The path of the compressed file.
+        """
+
+        super().__init__()
+        self._file: BinaryIO = open(path, 'rb')
+        try:
+            (
+                self._codec,
+                self._block_size,
+                self._offsets,
+                self._size,
+            ) = _read_layout(self._file)
+        except Exception:
+            self._file.close()
+            raise
+        self._position: int = 0
+        self._cached: tuple[int, bytes] = (-1, b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        """
+        Move to a position of the raw data.
+
+        Args:
+            offset: The position, relative to `whence`.
+            whence: `os.SEEK_SET`, `os.SEEK_CUR` or `os.SEEK_END`.
+
+        Returns:
+            The new position.
+        """
+
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._position}.get(
+            whence, self._size
+        )
+        self._position = max(0, base + offset)
+        return self._position
+
+    def readinto(self, buffer: Any) -> int:
+        """
+        Read raw bytes into a buffer.
+
+        Args:
+            buffer: The writable buffer.
+
+        Returns:
+            The number of bytes read, less than the size of the buffer only at the end
+            of the data.
+        """
+
+        view = memoryview(buffer).cast('B')
+        count = 0
+        while count < len(view) and self._position < self._size:
+            index, start = divmod(self._position, self._block_size)
+            if self._cached[0] != index:
+                self._cached = (
+                    index,
+                    _decompress_block(
+                        self._codec,
+                        *_read_frame(self._file, self._offsets[index]),
+                    ),
+                )
+            block = self._cached[1]
+            length = min(len(view) - count, len(block) - start)
+            view[count : count + length] = block[start : start + length]
+            self._position += length
+            count += length
+        return count
+
+    def close(self) -> None:
+        """
+        Close the compressed file.
+        """
+
+        self._file.close()
+        super().close()
+
+
+def compressed_digest(path: str | Path, algorithm: str) -> str:
+    """
+    Hash the raw data of a `.bjz` file.
+
+    Args:
+        path: The path of the compressed file.
+        algorithm: The name of the `hashlib` algorithm.
+
+    Returns:
+        The hexadecimal digest of the raw data, equal to the digest of the source file.
+    """
+
+    with io.BufferedReader(CompressedReader(path), BLOCK_SIZE) as reader:
+        return hashlib.file_digest(reader, algorithm).hexdigest()
+
+
+def decompress_file(
+    src_path: str | Path, dst_path: str | Path, executor: Executor = None
+) -> int:
+    """
+    Restore the raw data of a `.bjz` file.
+
+    Args:
+        src_path: The path of the compressed file.
+        dst_path: The path of the restored file.
+        executor: The pool decompressing the blocks. Defaults to `None`, which
+            decompresses them in the calling thread.
+
+    Returns:
+        The size of the restored file.
+    """
+
+    submitter = _Submitter(executor)
+    window = 2 * (getattr(executor, '_max_workers', 1) or 1)
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        codec, _, offsets, size = _read_layout(src)
+        pending: deque[Future] = deque()
+        for offset in offsets:
+            pending.append(
+                submitter.submit(
+                    _decompress_block, codec, *_read_frame(src, offset)
+                )
+            )
+            if len(pending) >= window:
+                dst.write(pending.popleft().result())
+        while pending:
+            dst.write(pending.popleft().result())
+    return size
+
+
+def restore_backup(
+    backup_dir: Path, target_dir: Path, workers: int = None
+) -> int:
+    """
+    Restore a backup directory, decompressing its `.bjz` files.
+
+    Args:
+        backup_dir: The directory a source was copied into.
+        target_dir: The directory the files are restored into.
+        workers: The number of processes decompressing blocks. Defaults to the number
+            of CPUs.
+
+    Returns:
+        The number of restored files.
+
+    Compressed files, named `*.bjz` and in the `.bjz` format, are restored under their
+    original name and every other file is copied as is. The modification time and mode of the backed up files are applied to
+    the restored ones. The packed files are left to `pack_manager.restore_packed`.
+    """
+
+    executor = compression_pool(workers)
+    restored = 0
+    for directory, subdirectories, names in os.walk(backup_dir):
+        if (
+            directory == os.fspath(backup_dir)
+            and PACK_DIRECTORY in subdirectories
+        ):
+            subdirectories.remove(PACK_DIRECTORY)
+        relative_dir = os.path.relpath(directory, backup_dir)
+        os.makedirs(os.path.join(target_dir, relative_dir), exist_ok=True)
+        for name in names:
+            src_path = os.path.join(directory, name)
+            if name.endswith(COMPRESSED_SUFFIX) and is_compressed_file(
+                src_path
+            ):
+                dst_path = os.path.join(
+                    target_dir,
+                    relative_dir,
+                    name.removesuffix(COMPRESSED_SUFFIX),
+                )
+                decompress_file(src_path, dst_path, executor)
+                shutil.copystat(src_path, dst_path)
+            else:
+                shutil.copy2(
+                    src_path, os.path.join(target_dir, relative_dir, name)
+                )
+            restored += 1
+    return restored
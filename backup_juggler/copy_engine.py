@@ -0,0 +1,247 @@
+import errno
+import os
+import struct
+from typing import Callable, Iterator
+
+try:
+    import fcntl
+except ImportError:   # pragma: no cover - not available on Windows
+    fcntl = None
+
+FICLONE = 0x40049409
+FS_IOC_FIEMAP = 0xC020660B
+KERNEL_CHUNK_SIZE = 8 * 1024 * 1024
+
+_FALLBACK_ERRNOS = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSUP,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EPERM,
+    errno.ETXTBSY,
+    errno.EXDEV,
+}
+_FIEMAP = struct.Struct('=QQLLLL')
+_FIEMAP_EXTENT = struct.Struct('=QQQ2QL3L')
+_unavailable: set[str] = set()
+
+
+class _NothingCopied(Exception):
+    """
+    Raised when a kernel copy strategy copies nothing before the end of the source.
+    """
+
+
+def kernel_copy(
+    src_fd: int,
+    dst_fd: int,
+    progress: Callable[[int], None],
+    chunk_size: int = KERNEL_CHUNK_SIZE,
+    offset: int = 0,
+    length: int = None,
+) -> tuple[int, bool]:
+    """
+    Copy a file without moving its bytes through the Python process.
+
+    Args:
+        src_fd: The file descriptor of the source file.
+        dst_fd: The file descriptor of the destination file.
+        progress: Called with the number of bytes copied after every step.
+        chunk_size: The maximum number of bytes copied per system call.
+        offset: The position where the copy starts, in both files.
+        length: The maximum number of bytes to copy. Defaults to `None`, which
+            copies up to the end of the source.
+
+    Returns:
+        The number of bytes copied and whether the requested range was done,
+        either because `length` bytes were copied or because the end of the
+        source was reached. When it was not done, the caller must copy the rest
+        itself, starting at `offset` plus the returned number of bytes.
+
+    The strategies are tried in order: a reflink clone (`FICLONE`), which shares
+    the extents of the source and costs no I/O at all, then `os.copy_file_range`
+    and `os.sendfile`, which both copy inside the kernel. A strategy that reports
+    it is not supported is skipped, and `ENOSYS` marks it as unavailable for the
+    rest of the process. Cloning is only attempted for whole files.
+
+    Some filesystems (procfs, FUSE) make these calls return 0 before the end of
+    the source without copying anything, which is not taken as the end of the file:
+    a strategy returning 0 at the start of the range is skipped, and one returning
+    0 later hands the rest of the range over to the caller.
+    """
+
+    if offset == 0 and length is None and _clone(src_fd, dst_fd):
+        copied = os.fstat(dst_fd).st_size
+        progress(copied)
+        return copied, True
+
+    copied = 0
+    for name, step in (
+        ('copy_file_range', _copy_file_range_step),
+        ('sendfile', _sendfile_step),
+    ):
+        if name in _unavailable or not hasattr(os, name):
+            continue
+        try:
+            while length is None or copied < length:
+                count = chunk_size
+                if length is not None:
+                    count = min(count, length - copied)
+                sent = step(src_fd, dst_fd, offset + copied, count)
+                if not sent:
+                    if os.fstat(src_fd).st_size <= offset + copied:
+                        break
+                    if copied:
+                        return copied, False
+                    raise _NothingCopied
+                copied += sent
+                progress(sent)
+            return copied, True
+        except _NothingCopied:
+            continue
+        except OSError as error:
+            if error.errno not in _FALLBACK_ERRNOS:
+                raise
+            if error.errno == errno.ENOSYS:
+                _unavailable.add(name)
+    return copied, False
+
+
+def clone_file(src_fd: int, dst_fd: int) -> bool:
+    """
+    Make the destination a reflink clone of the whole source, if the filesystem can.
+
+    Args:
+        src_fd: The file descriptor of the source file.
+        dst_fd: The file descriptor of the destination file.
+
+    Returns:
+        `True` if the filesystem cloned the file, `False` otherwise.
+    """
+
+    return _clone(src_fd, dst_fd)
+
+
+def is_sparse(fd: int) -> bool:
+    """
+    Check if a file has fewer bytes allocated on disk than its size.
+
+    Args:
+        fd: The file descriptor of the file.
+
+    Returns:
+        `True` if the file has holes, as far as the filesystem reports it.
+    """
+
+    stat = os.fstat(fd)
+    blocks = getattr(stat, 'st_blocks', None)
+    return blocks is not None and blocks * 512 < stat.st_size
+
+
+def data_extents(fd: int, start: int, end: int) -> Iterator[tuple[int, int]]:
+    """
+    Find the regions of a file holding data, skipping its holes.
+
+    Args:
+        fd: The file descriptor of the file.
+        start: The position where the search starts.
+        end: The position where the search stops.
+
+    Yields:
+        The start and stop positions of every data region between `start` and `end`.
+
+    The regions are found with `SEEK_DATA` and `SEEK_HOLE`. When the platform or
+    the filesystem does not support them, the whole range is yielded as data.
+    """
+
+    if not hasattr(os, 'SEEK_DATA'):
+        yield start, end
+        return
+    position = start
+    while position < end:
+        try:
+            data = os.lseek(fd, position, os.SEEK_DATA)
+        except OSError as error:
+            if error.errno == errno.ENXIO:
+                return
+            if error.errno not in _FALLBACK_ERRNOS:
+                raise
+            yield position, end
+            return
+        if data >= end:
+            return
+        hole = min(os.lseek(fd, data, os.SEEK_HOLE), end)
+        yield data, hole
+        position = hole
+
+
+def physical_offset(fd: int) -> int | None:
+    """
+    Find where the first extent of a file is stored on its device.
+
+    Args:
+        fd: The file descriptor of the file.
+
+    Returns:
+        The physical position of the first extent of the file, as reported by the
+        `FS_IOC_FIEMAP` ioctl, or `None` when the file has no extent or the platform
+        or the filesystem does not support it.
+    """
+
+    if fcntl is None or 'fiemap' in _unavailable:
+        return None
+    request = bytearray(_FIEMAP.size + _FIEMAP_EXTENT.size)
+    _FIEMAP.pack_into(request, 0, 0, 2**64 - 1, 0, 0, 1, 0)
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request, True)
+    except OSError as error:
+        if error.errno not in _FALLBACK_ERRNOS:
+            raise
+        if error.errno != errno.EBADF:
+            _unavailable.add('fiemap')
+        return None
+    if not _FIEMAP.unpack_from(request)[3]:
+        return None
+    return _FIEMAP_EXTENT.unpack_from(request, _FIEMAP.size)[1]
+
+
+def _clone(src_fd: int, dst_fd: int) -> bool:
+    """
+    Clone the source extents into the destination with the `FICLONE` ioctl.
+
+    Args:
+        src_fd: The file descriptor of the source file.
+        dst_fd: The file descriptor of the destination file.
+
+    Returns:
+        `True` if the filesystem cloned the file, `False` otherwise.
+    """
+
+    if fcntl is None or 'ficlone' in _unavailable:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as error:
+        if error.errno not in _FALLBACK_ERRNOS:
+            raise
+        if error.errno == errno.ENOSYS:
+            _unavailable.add('ficlone')
+        return False
+    return True
+
+
+def _copy_file_range_step(
+    src_fd: int, dst_fd: int, offset: int, count: int
+) -> int:
+    """Copy up to `count` bytes at `offset` with `os.copy_file_range`."""
+
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+
+def _sendfile_step(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    """Copy up to `count` bytes at `offset` with `os.sendfile`."""
+
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    return os.sendfile(dst_fd, src_fd, offset, count)
@@ -0,0 +1,225 @@
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from backup_juggler.copy_engine import clone_file
+from backup_juggler.scan_manager import Entry
+
+STORE_DIRECTORY = '.bj-store'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS known_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class BlobStore:
+    """
+    Content-addressed store of the files backed up to a destination directory.
+
+    Attributes:
+        _root: The directory of the store, `.bj-store` inside the destination.
+        _algorithm: The name of the `hashlib` algorithm naming the blobs.
+        _known: The digest of every source file seen before, by absolute path, with
+            the size and modification time it had then.
+        _recorded: The entries of `_known` added or changed since the store was opened.
+        _lock: The lock protecting `_known` and `_recorded`.
+
+    Methods:
+        - algorithm: Get the hash algorithm.
+        - blob_path: Get the path of the blob of a digest.
+        - known_digest: Get the digest of a source file that did not change.
+        - record: Remember the digest of a source file.
+        - temporary_path: Get a new path to write a blob to.
+        - add: Move a written file into the store.
+        - link: Make a destination file share the blob of a digest.
+        - save: Write the new known digests to disk.
+        - _connect: Open the database of the known digests.
+
+    Notes:
+        - Every blob is stored once, as `objects/<first 2 digits>/<other digits>`, and
+          backed up files are reflinks to it when the filesystem supports them, or
+          hardlinks otherwise.
+        - Hardlinked files share their inode with the blob, so they all have the
+          modification time and mode of the first file stored with that content.
+        - The known digests are kept per algorithm, in `known-<algorithm>.sqlite3`, and
+          are only used when the size and modification time of the source file did not
+          change.
+    """
+
+    def __init__(self, destination: Path, algorithm: str) -> None:
+        """
+        Initialize a `BlobStore` instance, loading the known digests.
+
+        Args:
+            destination: The destination directory holding the store.
+            algorithm: The name of the `hashlib` algorithm naming the blobs.
+        """
+
+        self._root: Path = destination / STORE_DIRECTORY
+        self._algorithm: str = algorithm
+        (self._root / 'tmp').mkdir(parents=True, exist_ok=True)
+        self._known: dict[str, tuple[int, int, str]] = {}
+        self._recorded: dict[str, tuple[int, int, str]] = {}
+        self._lock: threading.Lock = threading.Lock()
+        with self._connect() as connection:
+            for path, size, mtime_ns, digest in connection.execute(
+                'SELECT path, size, mtime_ns, digest FROM known_files'
+            ):
+                self._known[path] = (size, mtime_ns, digest)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open the database of the known digests, creating it if needed, and commit
+        when done.
+
+        Yields:
+            The open connection to the database.
+        """
+
+        connection = sqlite3.connect(
+            self._root / f'known-{self._algorithm}.sqlite3', timeout=30
+        )
+        try:
+            connection.executescript(_SCHEMA)
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @property
+    def algorithm(self) -> str:
+        """
+        Get the hash algorithm.
+
+        Returns:
+            _algorithm: The name of the `hashlib` algorithm naming the blobs.
+        """
+
+        return self._algorithm
+
+    def blob_path(self, digest: str) -> Path:
+        """
+        Get the path of the blob of a digest.
+
+        Args:
+            digest: The hexadecimal digest of the contents.
+
+        Returns:
+            The path of the blob, which may not exist.
+        """
+
+        return self._root / 'objects' / digest[:2] / digest[2:]
+
+    def known_digest(self, src_file: str, entry: Entry) -> str | None:
+        """
+        Get the digest of a source file that did not change since it was stored.
+
+        Args:
+            src_file: The path of the source file.
+            entry: The scanned `Entry` of the source file.
+
+        Returns:
+            The digest, if the file was seen with the same size and modification time
+            and its blob is still in the store, otherwise `None`.
+        """
+
+        with self._lock:
+            known = self._known.get(os.path.abspath(src_file))
+        if known is None or known[:2] != (entry.size, entry.mtime_ns):
+            return None
+        return known[2] if self.blob_path(known[2]).exists() else None
+
+    def record(self, src_file: str, entry: Entry, digest: str) -> None:
+        """
+        Remember the digest of a source file.
+
+        Args:
+            src_file: The path of the source file.
+            entry: The scanned `Entry` of the source file.
+            digest: The hexadecimal digest of its contents.
+        """
+
+        key = os.path.abspath(src_file)
+        with self._lock:
+            self._known[key] = (entry.size, entry.mtime_ns, digest)
+            self._recorded[key] = self._known[key]
+
+    def temporary_path(self) -> str:
+        """
+        Get a new path to write a blob to before adding it.
+
+        Returns:
+            A unique path inside the store, on the same filesystem as the blobs.
+        """
+
+        return os.fspath(self._root / 'tmp' / uuid.uuid4().hex)
+
+    def add(self, temporary_path: str, digest: str, entry: Entry) -> None:
+        """
+        Move a written file into the store, unless its contents are already there.
+
+        Args:
+            temporary_path: The path the file was written to.
+            digest: The hexadecimal digest of its contents.
+            entry: The scanned `Entry` of the source file, whose times and mode are
+                given to a new blob.
+        """
+
+        blob = self.blob_path(digest)
+        if blob.exists():
+            os.remove(temporary_path)
+            return
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.utime(temporary_path, ns=(entry.atime_ns, entry.mtime_ns))
+        os.chmod(temporary_path, entry.mode)
+        os.replace(temporary_path, blob)
+
+    def link(self, digest: str, dst_file: str) -> bool:
+        """
+        Make a destination file share the blob of a digest.
+
+        Args:
+            digest: The hexadecimal digest of the contents.
+            dst_file: The path of the destination file, replaced if it exists.
+
+        Returns:
+            `True` if the file is a reflink, with an inode and metadata of its own,
+            `False` if it is a hardlink to the blob.
+        """
+
+        blob = self.blob_path(digest)
+        temporary_path = self.temporary_path()
+        with open(blob, 'rb') as src, open(temporary_path, 'wb') as dst:
+            cloned = clone_file(src.fileno(), dst.fileno())
+        if not cloned:
+            os.remove(temporary_path)
+            os.link(blob, temporary_path)
+        os.replace(temporary_path, dst_file)
+        return cloned
+
+    def save(self) -> None:
+        """
+        Write the digests recorded since the store was opened to disk.
+        """
+
+        with self._lock:
+            recorded = [
+                (path, *known) for path, known in self._recorded.items()
+            ]
+            self._recorded.clear()
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO known_files '
+                '(path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)',
+                recorded,
+            )
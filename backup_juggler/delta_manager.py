@@ -0,0 +1,177 @@
+import hashlib
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, BinaryIO, Callable
+
+DELTA_BLOCK_SIZE = 1024 * 1024
+DELTA_MIN_SIZE = 64 * 1024 * 1024
+SIGNATURES_SUFFIX = '.bj-signatures'
+
+_HEADER = struct.Struct('<4sIQQ')
+_BLOCK = struct.Struct('<I16s')
+_MAGIC = b'BJS1'
+
+Signature = list[tuple[int, bytes]]
+
+
+def signature_path(backup_dir: str | Path, relative_path: str) -> Path:
+    """
+    Get the path of the cached block signature of a backed up file.
+
+    Args:
+        backup_dir: The directory a source was copied into.
+        relative_path: The path of the file relative to the backup directory.
+
+    Returns:
+        The path of the signature, in a directory next to the backup directory, so it is
+        never copied nor restored as part of the backup.
+    """
+
+    return Path(f'{os.fspath(backup_dir)}{SIGNATURES_SUFFIX}', relative_path)
+
+
+def block_signature(block: bytes) -> tuple[int, bytes]:
+    """
+    Compute the signature of a block.
+
+    Args:
+        block: The contents of the block.
+
+    Returns:
+        The weak Adler-32 checksum of the block and its strong 128-bit BLAKE2 digest.
+    """
+
+    return (
+        zlib.adler32(block),
+        hashlib.blake2b(block, digest_size=16).digest(),
+    )
+
+
+def compute_signature(file: BinaryIO) -> Signature:
+    """
+    Compute the block signature of a file by reading it.
+
+    Args:
+        file: The file, opened for reading.
+
+    Returns:
+        The signature of every block of `DELTA_BLOCK_SIZE` bytes of the file.
+    """
+
+    file.seek(0)
+    signature = []
+    while block := file.read(DELTA_BLOCK_SIZE):
+        signature.append(block_signature(block))
+    return signature
+
+
+def load_signature(path: Path, stat: os.stat_result) -> Signature | None:
+    """
+    Load the cached block signature of a file.
+
+    Args:
+        path: The path of the signature (see `signature_path`).
+        stat: The current `stat` result of the file.
+
+    Returns:
+        The signature, or `None` if there is none, or if the file changed since the
+        signature was written.
+    """
+
+    try:
+        with open(path, 'rb') as file:
+            content = file.read()
+    except FileNotFoundError:
+        return None
+    if len(content) < _HEADER.size:
+        return None
+    magic, block_size, size, mtime_ns = _HEADER.unpack_from(content)
+    if (
+        magic != _MAGIC
+        or block_size != DELTA_BLOCK_SIZE
+        or (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns)
+    ):
+        return None
+    return list(_BLOCK.iter_unpack(content[_HEADER.size :]))
+
+
+def save_signature(
+    path: Path, signature: Signature, stat: os.stat_result
+) -> None:
+    """
+    Write the block signature of a file, replacing the previous one atomically.
+
+    Args:
+        path: The path of the signature (see `signature_path`).
+        signature: The signature of the file.
+        stat: The `stat` result of the file, used to detect later changes.
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f'.{path.name}.tmp')
+    with open(temporary_path, 'wb') as file:
+        file.write(
+            _HEADER.pack(
+                _MAGIC, DELTA_BLOCK_SIZE, stat.st_size, stat.st_mtime_ns
+            )
+        )
+        file.write(b''.join(_BLOCK.pack(*block) for block in signature))
+    os.replace(temporary_path, path)
+
+
+def apply_delta(
+    src: BinaryIO,
+    outputs: list[BinaryIO],
+    signatures: list[Signature],
+    progress: Callable[[int], None],
+    hasher: Any = None,
+) -> tuple[list[Signature], int]:
+    """
+    Update files in place with the blocks of the source that differ from them.
+
+    Args:
+        src: The source file, opened for reading.
+        outputs: The destination files, opened for reading and writing.
+        signatures: The block signature of every destination file.
+        progress: Called with the number of bytes of every block read from the source.
+        hasher: The `hashlib` object updated with the source contents, or `None`.
+
+    Returns:
+        The new signature of every destination file, and the number of bytes written.
+
+    The source is read once, block by block. The cheap weak checksum of each block is
+    compared first, and the strong digest only when the weak ones match, so unchanged
+    blocks cost one checksum and no write, and changed blocks are written at their
+    offset. The destinations are then truncated to the size of the source.
+    """
+
+    new_signatures: list[Signature] = [[] for _ in outputs]
+    written = 0
+    index = 0
+    while block := src.read(DELTA_BLOCK_SIZE):
+        if hasher is not None:
+            hasher.update(block)
+        weak = zlib.adler32(block)
+        strong = None
+        for output, signature, new_signature in zip(
+            outputs, signatures, new_signatures
+        ):
+            old = signature[index] if index < len(signature) else None
+            if old is not None and old[0] == weak:
+                strong = strong or block_signature(block)[1]
+                if old[1] == strong:
+                    new_signature.append(old)
+                    continue
+            output.seek(index * DELTA_BLOCK_SIZE)
+            output.write(block)
+            written += len(block)
+            strong = strong or block_signature(block)[1]
+            new_signature.append((weak, strong))
+        progress(len(block))
+        index += 1
+    size = src.tell()
+    for output in outputs:
+        output.truncate(size)
+    return new_signatures, written
@@ -1,15 +1,227 @@
+import errno
+import hashlib
+import io
+import mmap
 import os
+import shutil
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from functools import partial
 from pathlib import Path
+from queue import Queue
+from stat import S_IWUSR
+from typing import Any, BinaryIO
 
 from rich.console import Console
 from rich.panel import Panel
 
+from backup_juggler.backup_options import BackupOptions
+from backup_juggler.checksum_manager import (
+    Manifest,
+    VerifyReport,
+    file_digest,
+    manifest_path,
+    verify_backup,
+)
+from backup_juggler.compression_manager import (
+    COMPRESSED_SUFFIX,
+    CompressedReader,
+    compress_stream,
+    compression_pool,
+    is_incompressible,
+    raw_size,
+    restore_backup,
+    shutdown_pool,
+)
+from backup_juggler.copy_engine import (
+    clone_file,
+    data_extents,
+    is_sparse,
+    kernel_copy,
+)
+from backup_juggler.dedup_manager import BlobStore
+from backup_juggler.delta_manager import (
+    DELTA_MIN_SIZE,
+    apply_delta,
+    compute_signature,
+    load_signature,
+    save_signature,
+    signature_path,
+)
+from backup_juggler.filter_manager import PathFilter
+from backup_juggler.index_manager import ScanIndex
+from backup_juggler.journal_manager import (
+    JOURNAL_INTERVAL,
+    RESUME_MIN_SIZE,
+    Journal,
+    partial_path,
+)
+from backup_juggler.metrics_manager import (
+    BackupMetrics,
+    write_json,
+    write_prometheus,
+)
+from backup_juggler.order_manager import order_entries
+from backup_juggler.pack_manager import PackStore, restore_packed
 from backup_juggler.paths_manager import Paths
-from backup_juggler.progress_viewer import ProgressViewer
+from backup_juggler.progress_viewer import ProgressReporter, ProgressViewer
+from backup_juggler.scan_manager import Entry
+from backup_juggler.scheduler_manager import JobScheduler
+from backup_juggler.snapshot_manager import (
+    list_snapshots,
+    prune_snapshots,
+    remove_stale_snapshots,
+    snapshot_name,
+)
+from backup_juggler.throttle_manager import (
+    ControlFileWatcher,
+    Throttle,
+    global_throttle,
+)
 
 console = Console()
 
+CHUNK_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE = 128 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+MMAP_MIN_SIZE = 1024 * 1024 * 1024
+MMAP_WINDOW = 64 * 1024 * 1024
+ZEROS = bytes(CHUNK_SIZE)
+TEE_BUFFER_CHUNKS = 8
+STREAM_QUEUE_SIZE = 1024
+
+_buffers = threading.local()
+_device_slots_lock = threading.Lock()
+_device_slots_by_device: dict[int, threading.BoundedSemaphore] = {}
+
+
+def chunk_size_for(size: int, block_size: int) -> int:
+    """
+    Choose the size of the chunks a file is copied in.
+
+    Args:
+        size: The number of bytes to copy.
+        block_size: The preferred I/O size of the source and destination storage.
+
+    Returns:
+        About a sixteenth of the file, between `MIN_CHUNK_SIZE` and `MAX_CHUNK_SIZE`,
+        rounded down to a multiple of the block size.
+
+    Examples:
+        >>> chunk_size_for(1024 * 1024 * 1024, 4096)
+        8388608
+    """
+
+    chunk_size = min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, size // 16))
+    block_size = max(block_size, 1)
+    return max(block_size, chunk_size // block_size * block_size)
+
+
+def _thread_buffer(size: int) -> memoryview:
+    """
+    Get the copy buffer of the current thread.
+
+    Args:
+        size: The number of bytes needed.
+
+    Returns:
+        A view of `size` bytes of a buffer allocated once per thread, and only grown
+        when a larger chunk size is needed.
+    """
+
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = _buffers.buffer = bytearray(size)
+    return memoryview(buffer)[:size]
+
+
+def _with_ancestors(directories: set[str]) -> set[str]:
+    """
+    Add the parent directories of relative directories.
+
+    Args:
+        directories: Directories relative to a root, `''` being the root itself.
+
+    Returns:
+        The directories and all their parents, without the root.
+
+    Examples:
+        >>> sorted(_with_ancestors({'a/b/c', 'd'}))
+        ['a', 'a/b', 'a/b/c', 'd']
+    """
+
+    result: set[str] = set()
+    for directory in directories:
+        while directory and directory not in result:
+            result.add(directory)
+            directory = os.path.dirname(directory)
+    return result
+
+
+def _make_directory(path: str, parents: bool = False) -> None:
+    """
+    Create a destination directory, or make it writable by its owner if it exists.
+
+    Args:
+        path: The path of the directory.
+        parents: If `True`, the missing parents of the directory are created too,
+            otherwise its parent must exist.
+
+    Directories get the mode of their source directory at the end of every backup,
+    which may be read-only. Giving them back the owner write permission before files
+    are written into them lets later runs add, replace and resume files.
+    """
+
+    try:
+        if parents:
+            os.makedirs(path)
+        else:
+            os.mkdir(path)
+    except FileExistsError:
+        mode = os.stat(path).st_mode
+        if not mode & S_IWUSR:
+            os.chmod(path, mode | S_IWUSR)
+
+
+def _unshare(dst_file: str) -> None:
+    """
+    Remove a destination file that shares its inode with other files.
+
+    Args:
+        dst_file: The path of the destination file.
+
+    Deduplicated backups hardlink their files to the blobs of the store (see
+    `dedup_manager.BlobStore.link`), and writing such a file in place would change the
+    blob and every other file linked to it, so it is removed and written anew.
+    """
+
+    try:
+        if os.stat(dst_file).st_nlink > 1:
+            os.unlink(dst_file)
+    except FileNotFoundError:
+        pass
+
+
+def _device_slots(device: int, limit: int) -> threading.BoundedSemaphore:
+    """
+    Get the semaphore limiting the concurrent copies to a device.
+
+    Args:
+        device: The `st_dev` of the device.
+        limit: The number of concurrent copies allowed, used when the semaphore
+            of the device is created.
+
+    Returns:
+        The semaphore shared by every backup writing to the device.
+    """
+
+    with _device_slots_lock:
+        if device not in _device_slots_by_device:
+            _device_slots_by_device[device] = threading.BoundedSemaphore(limit)
+        return _device_slots_by_device[device]
+
 
 class FileCopier:
     """
@@ -18,85 +230,1420 @@ class FileCopier:
     Attributes:
         _paths: The `Paths` instance.
         _viewer: The `ProgressViewer` instance.
+        _options: The `BackupOptions` instance.
+        _skipped_files: The number of unchanged files that were not copied.
+        _skipped_bytes: The total size of the unchanged files that were not copied.
+        _delta_bytes: The total size of the files updated by delta transfer.
+        _delta_written: The number of bytes actually written by delta transfer.
+        _lock: The lock protecting the counters when copying with several workers.
+        _src_root: The directory the scanned relative paths start from.
+        _dst_roots: The directories the source is copied into, one per destination.
+        _dst_slots: The semaphores limiting the concurrent copies per destination device.
+        _manifests: The checksum manifests, one per destination, when hashing is enabled.
+        _stores: The deduplication stores, one per destination, when `dedup` is enabled.
+        _packs: The segments small files are packed into, one per destination, when
+            `pack_threshold` is set.
+        _snapshots: The final path of each snapshot, by the hidden path it is written to.
+        _link_bases: The previous snapshot of each new snapshot, if there is one.
+        _base_manifests: The manifests of the previous snapshots, when hashing is enabled.
+        _directories: The directories of the copied files, relative to the source.
+        _made_dirs: The destination directories known to exist.
+        _finalizer: The queue of the files whose metadata is applied by the finalizer
+            thread, in streaming mode.
+        _throttle: The `Throttle` of the job, chained to the global one.
+        _metrics: The `BackupMetrics` of the job.
 
     Methods:
         - _copy_to: Copy files from source to destination.
+        - _copy_streaming: Copy files while the source is being scanned.
+        - _create_directories: Create the destination directories top-down, in parallel.
+        - _make_parents: Create the missing parent directories of destination files.
+        - _restore_directory_metadata: Apply the source directory times and modes.
+        - _copy_entry: Copy a scanned file to every destination that needs it.
+        - _pack_entry: Pack a small file into the segments of every destination.
+        - _is_packed_unchanged: Check if a packed file is up to date.
+        - _skip_entry: Account for a file that is not copied.
         - _copy_file: Copy a single file from source to destination.
+        - _transferred: Account for copied bytes in the throttle and the progress bar.
+        - _copy_range: Copy a range of bytes of the source file to the destination.
+        - _copy_sparse_range: Copy the data regions of a range, keeping its holes.
+        - _skip_hole: Account for a hole of the source that is not copied.
+        - _copy_data: Copy a range of bytes that holds data.
+        - _copy_buffered: Copy bytes in userspace through the buffer of the thread.
+        - _copy_mapped: Copy bytes in userspace from memory mappings of the source.
+        - _tee_file: Copy a single file from source to several destinations.
+        - _dedup_file: Link a file to the blobs of its contents, storing them if needed.
+        - _link_unchanged: Hardlink an unchanged file from the previous snapshot.
+        - _compress_file: Compress a single file to one or more destinations.
+        - _delta_file: Update destination files with the blocks that changed.
+        - _dst_path: Get the path a scanned file is written to in a destination.
+        - _compresses: Check if a scanned file is written compressed.
+        - _finish_targets: Finalize written files, or queue them for the finalizer.
+        - _finalize: Restore the metadata of written files and rename them into place.
+        - _new_hasher: Create the hash object of a file to be copied.
+        - _is_unchanged: Check if a destination file is up to date.
+        - _restore_metadata: Apply the source times and mode to the destinations.
     """
 
-    def __init__(self, paths: Paths, viewer: ProgressViewer) -> None:
+    def __init__(
+        self,
+        paths: Paths,
+        viewer: ProgressViewer,
+        options: BackupOptions = None,
+        metrics: BackupMetrics = None,
+    ) -> None:
         """
         Initialize a `FileCopier` instance.
 
         Args:
             paths: The `Paths` instance.
             viewer: The `ProgressViewer` instance.
+            options: The `BackupOptions` instance. Defaults to `BackupOptions()`.
+            metrics: The `BackupMetrics` of the job. Defaults to new metrics.
         """
 
         self._paths: Paths = paths
         self._viewer: ProgressViewer = viewer
+        self._options: BackupOptions = options or BackupOptions()
+        self._skipped_files: int = 0
+        self._skipped_bytes: int = 0
+        self._delta_bytes: int = 0
+        self._delta_written: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        source = self._paths.source
+        self._src_root: str = os.fspath(
+            source.parent if source.is_file() else source
+        )
+        self._dst_roots: list[str] = [
+            os.path.join(destination, source.stem)
+            for destination in self._paths.destinations
+        ]
+        self._snapshots: dict[str, str] = {}
+        self._link_bases: dict[str, str] = {}
+        self._base_manifests: dict[str, Manifest] = {}
+        if self._options.snapshot:
+            name = snapshot_name()
+            snapshot_roots = []
+            for snapshots_dir in self._dst_roots:
+                remove_stale_snapshots(snapshots_dir, self._options.workers)
+                snapshot = os.path.join(snapshots_dir, name)
+                dst_root = partial_path(snapshot)
+                self._snapshots[dst_root] = snapshot
+                previous = list_snapshots(snapshots_dir)
+                if previous:
+                    self._link_bases[dst_root] = os.fspath(previous[-1])
+                snapshot_roots.append(dst_root)
+            self._dst_roots = snapshot_roots
+        self._dst_slots: list[threading.BoundedSemaphore] = []
+        self._manifests: dict[str, Manifest] = {}
+        self._stores: dict[str, BlobStore] = {}
+        self._packs: dict[str, PackStore] = {}
+        self._directories: set[str] = set()
+        self._made_dirs: set[str] = set()
+        self._finalizer: Queue | None = None
+        self._throttle: Throttle = Throttle(
+            self._options.bytes_per_second,
+            self._options.files_per_second,
+            parent=global_throttle,
+        )
+        self._metrics: BackupMetrics = metrics or BackupMetrics(
+            paths.source, paths.destinations
+        )
 
     def _copy_to(self) -> None:
         """
-        Copy files from the source directory to the destination directory.
+        Copy files from the source directory to the destination directories.
 
-        Recursively copies files from the source directory to the destination directory,
+        Recursively copies files from the source directory to the destination directories,
         preserving the directory structure. If the source is a file, it will be copied directly
-        to the destination. If the source is a directory, all files within the directory (including
-        subdirectories) will be copied to corresponding paths in the destination.
+        to the destinations. If the source is a directory, all files within the directory (including
+        subdirectories) will be copied to corresponding paths in the destinations.
+
+        The files are taken from the entries scanned once by `Paths`, so no file is listed or
+        stat'ed again while copying. With more than one worker, the files are copied concurrently
+        by a thread pool, and each destination device accepts at most `device_workers` copies at
+        a time, whichever backup they belong to. When `hash_algorithm` is set, the digests
+        computed while copying are saved in a manifest next to each destination.
+
+        In snapshot mode, every run is written to a new timestamped directory, hidden until
+        it is complete. Files unchanged since the previous snapshot are hardlinked to it
+        instead of being copied, and the oldest snapshots beyond `keep_snapshots` are pruned.
+        The hidden snapshots left behind by interrupted runs are deleted when a run starts.
+
+        The files are copied in the order given by `copy_order` (see
+        `order_manager.order_entries`), once all their directories have been created (see
+        `_create_directories`), or in streaming mode, while the source is scanned (see
+        `_copy_streaming`). The times and modes of the source directories are applied at
+        the end, bottom-up (see `_restore_directory_metadata`).
+
+        The time spent in each phase is recorded in the `BackupMetrics` of the job.
         """
 
-        if self._paths.source.is_file():
-            with self._viewer._pbar:
-                src_file: Path = self._paths.source
-                dst_file: Path = (
-                    self._paths.destination / src_file.stem / src_file.name
+        for dst_root, destination in zip(
+            self._dst_roots, self._paths.destinations
+        ):
+            with self._metrics.phase('mkdir'):
+                _make_directory(dst_root, parents=True)
+            self._made_dirs.add(dst_root)
+            if self._options.hash_algorithm:
+                self._manifests[dst_root] = Manifest(
+                    manifest_path(self._snapshots.get(dst_root, dst_root)),
+                    self._options.hash_algorithm,
                 )
-                dst_file.parent.mkdir(parents=True, exist_ok=True)
-                self._copy_file(src_file, dst_file)
-        else:
-            with self._viewer._pbar:
-                for src_file in self._paths.source.rglob('*.*'):
-                    dst_file: Path = (
-                        self._paths.destination
-                        / self._paths.source.stem
-                        / src_file.relative_to(self._paths.source)
+                base = self._link_bases.get(dst_root)
+                if base is not None and manifest_path(base).exists():
+                    self._base_manifests[dst_root] = Manifest(
+                        manifest_path(base), self._options.hash_algorithm
                     )
-                    dst_file.parent.mkdir(parents=True, exist_ok=True)
-                    self._copy_file(src_file, dst_file)
+            if self._options.pack_threshold is not None:
+                self._packs[dst_root] = PackStore(dst_root)
+            if self._options.dedup:
+                self._stores[dst_root] = BlobStore(
+                    destination, self._options.hash_algorithm or 'blake2b'
+                )
+            if self._options.device_workers:
+                self._dst_slots.append(
+                    _device_slots(
+                        os.stat(dst_root).st_dev, self._options.device_workers
+                    )
+                )
+
+        if self._options.streaming:
+            self._copy_streaming()
+        else:
+            with self._metrics.phase('scan'):
+                entries = order_entries(
+                    self._paths.entries,
+                    self._options.copy_order,
+                    self._src_root,
+                )
+            self._create_directories(
+                {
+                    os.path.dirname(entry.relative_path)
+                    for entry in entries
+                    if not self._packs
+                    or entry.size > self._options.pack_threshold
+                }
+            )
+            if self._options.workers <= 1:
+                for entry in entries:
+                    self._copy_entry(entry)
+            else:
+                with ThreadPoolExecutor(self._options.workers) as executor:
+                    futures = [
+                        executor.submit(self._copy_entry, entry)
+                        for entry in entries
+                    ]
+                    for future in as_completed(futures):
+                        future.result()
+
+        for manifest in self._manifests.values():
+            manifest.save()
+        for store in self._stores.values():
+            store.save()
+        for pack in self._packs.values():
+            pack.save()
+        self._restore_directory_metadata()
+        for dst_root, snapshot in self._snapshots.items():
+            os.replace(dst_root, snapshot)
+            if self._options.keep_snapshots:
+                prune_snapshots(
+                    os.path.dirname(snapshot),
+                    self._options.keep_snapshots,
+                    self._options.workers,
+                )
+        self._metrics.finish()
+
+    def _create_directories(self, directories: set[str]) -> None:
+        """
+        Create the destination directories of the files to be copied.
+
+        Args:
+            directories: The directories of the files, relative to the source.
+
+        The directories and their parents are created once each, level by level from the
+        top, and the directories of a level are created in parallel by `workers` threads,
+        so copying the files takes no `mkdir` call. Existing directories are made writable
+        by their owner (see `_make_directory`).
+        """
+
+        self._directories |= directories
+        levels: dict[int, list[str]] = {}
+        for directory in _with_ancestors(directories):
+            levels.setdefault(directory.count('/'), []).append(directory)
+
+        with self._metrics.phase('mkdir'), ThreadPoolExecutor(
+            max(self._options.workers, 1)
+        ) as executor:
+            for depth in sorted(levels):
+                paths = [
+                    os.path.join(dst_root, directory)
+                    for dst_root in self._dst_roots
+                    for directory in levels[depth]
+                ]
+                list(executor.map(_make_directory, paths))
+                self._made_dirs.update(paths)
+
+    def _make_parents(self, dst_files: list[str]) -> None:
+        """
+        Create the parent directories of destination files, unless known to exist.
+
+        Args:
+            dst_files: The paths of the destination files.
+
+        The missing directories are created from the closest known one down, and the
+        existing ones are made writable by their owner (see `_make_directory`).
+        """
+
+        with self._metrics.phase('mkdir'):
+            for dst_file in dst_files:
+                missing = []
+                parent = os.path.dirname(dst_file)
+                while parent not in self._made_dirs and parent != (
+                    os.path.dirname(parent)
+                ):
+                    missing.append(parent)
+                    parent = os.path.dirname(parent)
+                for directory in reversed(missing):
+                    _make_directory(directory)
+                    self._made_dirs.add(directory)
+
+    def _restore_directory_metadata(self) -> None:
+        """
+        Apply the times and modes of the source directories to the destinations.
+
+        The directories are updated bottom-up, the source directory itself last, once
+        every file has been written, so neither writing into a directory nor making it
+        read-only gets in the way of the others.
+        """
 
-    def _copy_file(self, src_file: Path, dst_file: Path) -> None:
+        if not self._paths.source.is_dir():
+            return
+        directories = sorted(
+            _with_ancestors(self._directories),
+            key=lambda directory: directory.count('/'),
+            reverse=True,
+        )
+        with self._metrics.phase('metadata'):
+            for directory in [*directories, '']:
+                try:
+                    stat = os.stat(os.path.join(self._src_root, directory))
+                except FileNotFoundError:
+                    continue
+                for dst_root in self._dst_roots:
+                    dst_dir = os.path.join(dst_root, directory)
+                    try:
+                        os.chmod(dst_dir, stat.st_mode)
+                        os.utime(
+                            dst_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns)
+                        )
+                    except FileNotFoundError:
+                        continue
+
+    def _copy_streaming(self) -> None:
+        """
+        Copy files while the source is being scanned.
+
+        A scanner thread feeds the entries found by `Paths.iter_entries` to `workers` copy
+        threads, which hand the written files to a finalizer thread applying their metadata
+        (see `_finalize`). The threads are connected by queues of `STREAM_QUEUE_SIZE`
+        items, so the first files are copied as soon as they are found, and no entry of the
+        source is kept once copied. The destination directories are still remembered, to
+        create each one once and to apply their metadata at the end (see `_directories`
+        and `_made_dirs`), so the memory used grows with the number of directories of the
+        source, and with its number of files when a manifest or a pack index is written.
+
+        Raises:
+            Exception: The first error raised by any of the threads, once all of them
+                stopped.
+        """
+
+        entries: Queue = Queue(maxsize=STREAM_QUEUE_SIZE)
+        self._finalizer = Queue(maxsize=STREAM_QUEUE_SIZE)
+        errors: list[BaseException] = []
+        workers = max(self._options.workers, 1)
+
+        def scan() -> None:
+            try:
+                for entry in self._paths.iter_entries():
+                    if errors:
+                        break
+                    entries.put(entry)
+            except BaseException as error:
+                errors.append(error)
+            finally:
+                for _ in range(workers):
+                    entries.put(None)
+
+        def copy() -> None:
+            while (entry := entries.get()) is not None:
+                if errors:
+                    continue
+                try:
+                    self._copy_entry(entry)
+                except BaseException as error:
+                    errors.append(error)
+
+        def finalize() -> None:
+            while (item := self._finalizer.get()) is not None:
+                if errors:
+                    continue
+                try:
+                    self._finalize(*item)
+                except BaseException as error:
+                    errors.append(error)
+
+        finalizer = threading.Thread(target=finalize)
+        threads = [threading.Thread(target=scan)] + [
+            threading.Thread(target=copy) for _ in range(workers)
+        ]
+        finalizer.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._finalizer.put(None)
+        finalizer.join()
+        self._finalizer = None
+        if errors:
+            raise errors[0]
+
+    def _copy_entry(self, entry: Entry) -> None:
+        """
+        Copy a scanned file to every destination that needs it.
+
+        Args:
+            entry: The scanned `Entry` of the source file.
+
+        When there is more than one destination, the source file is read only once and its
+        chunks are teed to every destination (see `_tee_file`). In incremental mode,
+        destinations already holding an unchanged copy are left untouched, and a file that
+        is unchanged everywhere is skipped without being opened. In snapshot mode, files
+        unchanged since the previous snapshot are hardlinked to it the same way. Files
+        written in place are unlinked first when they share their inode (see `_unshare`),
+        while resumable copies always replace them.
+
+        When `compression` is set, files are written compressed (see `_compress_file`),
+        except the ones in already compressed formats. Files of at most `pack_threshold`
+        bytes are packed instead (see `_pack_entry`).
+        """
+
+        src_file = os.path.join(self._src_root, entry.relative_path)
+        if self._packs:
+            if entry.size <= self._options.pack_threshold:
+                self._pack_entry(src_file, entry)
+                return
+            for pack in self._packs.values():
+                pack.discard(entry.relative_path)
+        self._directories.add(os.path.dirname(entry.relative_path))
+        dst_roots = self._dst_roots
+        if self._options.incremental:
+            dst_roots = [
+                dst_root
+                for dst_root in dst_roots
+                if not self._is_unchanged(
+                    src_file,
+                    entry,
+                    self._dst_path(dst_root, entry.relative_path),
+                )
+            ]
+        if self._link_bases:
+            dst_roots = [
+                dst_root
+                for dst_root in dst_roots
+                if not self._link_unchanged(src_file, entry, dst_root)
+            ]
+        if not dst_roots:
+            self._skip_entry(entry)
+            return
+        start = time.perf_counter()
+        dst_files: list[str] = [
+            self._dst_path(dst_root, entry.relative_path)
+            for dst_root in dst_roots
+        ]
+        self._make_parents(dst_files)
+        if not self._stores and not self._options.resumable:
+            for dst_file in dst_files:
+                _unshare(dst_file)
+        self._throttle.file_started()
+        with ExitStack() as stack:
+            for slots in sorted(set(self._dst_slots), key=id):
+                stack.enter_context(slots)
+            if self._stores:
+                digest = self._dedup_file(
+                    src_file, dst_roots, dst_files, entry
+                )
+            elif self._compresses(entry.relative_path):
+                digest = self._compress_file(src_file, dst_files, entry)
+            elif (
+                self._options.delta
+                and not self._options.resumable
+                and not self._options.snapshot
+                and entry.size >= DELTA_MIN_SIZE
+            ):
+                digest = self._delta_file(
+                    src_file, dst_roots, dst_files, entry
+                )
+            elif len(dst_files) == 1:
+                digest = self._copy_file(src_file, dst_files[0], entry)
+            else:
+                digest = self._tee_file(src_file, dst_files, entry)
+        for dst_root in dst_roots:
+            if dst_root in self._manifests:
+                self._manifests[dst_root].record(
+                    entry.relative_path, digest, entry.size, entry.mtime_ns
+                )
+        self._metrics.observe_file(time.perf_counter() - start, entry.size)
+
+    def _pack_entry(self, src_file: str, entry: Entry) -> None:
+        """
+        Pack a small file into the segments of every destination that needs it.
+
+        Args:
+            src_file: The path of the source file.
+            entry: The scanned `Entry` of the source file.
+
+        The file is read in a single call and appended to the current tar segment of each
+        destination (see `pack_manager.PackStore`), so no file is created, nor directory
+        made, nor metadata applied at the destinations. In incremental mode, files packed
+        with the same size and modification time, or contents when `checksum` is enabled,
+        are skipped. A standalone copy left by a run where the file was bigger than
+        `pack_threshold` is removed, so restores and verifications only find the packed one.
+        """
+
+        dst_roots = self._dst_roots
+        if self._options.incremental:
+            dst_roots = [
+                dst_root
+                for dst_root in dst_roots
+                if not self._is_packed_unchanged(
+                    src_file, entry, self._packs[dst_root]
+                )
+            ]
+        if not dst_roots:
+            self._skip_entry(entry)
+            return
+        start = time.perf_counter()
+        self._throttle.file_started()
+        with self._metrics.phase('copy'):
+            with open(src_file, 'rb') as src:
+                data = src.read()
+            for dst_root in dst_roots:
+                self._packs[dst_root].add(entry, data)
+                dst_file = os.path.join(dst_root, entry.relative_path)
+                for stale_file in (dst_file, dst_file + COMPRESSED_SUFFIX):
+                    try:
+                        os.unlink(stale_file)
+                    except FileNotFoundError:
+                        pass
+        self._transferred(len(data))
+        if self._options.hash_algorithm:
+            digest = hashlib.new(
+                self._options.hash_algorithm, data
+            ).hexdigest()
+            for dst_root in dst_roots:
+                self._manifests[dst_root].record(
+                    entry.relative_path, digest, entry.size, entry.mtime_ns
+                )
+        self._metrics.observe_file(time.perf_counter() - start, entry.size)
+
+    def _is_packed_unchanged(
+        self, src_file: str, entry: Entry, pack: PackStore
+    ) -> bool:
+        """
+        Check if a packed file is an up to date copy of the source file.
+
+        Args:
+            src_file: The path of the source file.
+            entry: The scanned `Entry` of the source file.
+            pack: The `PackStore` of the destination.
+
+        Returns:
+            `True` if the file is packed with the same size and modification time as the
+            source, or the same size and BLAKE2 digest when `checksum` is enabled.
+        """
+
+        if not self._options.checksum:
+            return pack.is_unchanged(entry)
+        record = pack.files.get(entry.relative_path)
+        if record is None or record['size'] != entry.size:
+            return False
+        with open(src_file, 'rb') as src:
+            return (
+                hashlib.blake2b(src.read()).digest()
+                == hashlib.blake2b(pack.read(entry.relative_path)).digest()
+            )
+
+    def _skip_entry(self, entry: Entry) -> None:
+        """
+        Account for a file that is not copied because it is unchanged everywhere.
+
+        Args:
+            entry: The scanned `Entry` of the source file.
+        """
+
+        with self._lock:
+            self._skipped_files += 1
+            self._skipped_bytes += entry.size
+        self._viewer._update(entry.size)
+
+    def _copy_file(
+        self, src_file: str, dst_file: str, entry: Entry
+    ) -> str | None:
         """
         Copy a single file from the source to the destination.
 
         Args:
             src_file: The path of the source file.
             dst_file: The path of the destination file.
+            entry: The scanned `Entry` of the source file.
+
+        Returns:
+            The hexadecimal digest of the file when `hash_algorithm` is set, otherwise `None`.
+
+        Copies a single file from the source path to the destination path. The copy is first
+        done inside the kernel (see `copy_engine.kernel_copy`); only when that is not supported,
+        or when the file has to be hashed, are the file contents read in chunks and written to
+        the destination file. Progress updates are sent to the associated `ProgressViewer`
+        instance to update the progress bar.
 
-        Copies a single file from the source path to the destination path. The file contents are
-        read in chunks and written to the destination file. Progress updates are sent to the
-        associated `ProgressViewer` instance to update the progress bar.
+        In sparse mode, the holes of sparse files are recreated at the destination instead
+        of being written out as zeros (see `_copy_sparse_range`).
+
+        In resumable mode, the file is written to a temporary path and renamed into place
+        once complete. Files of at least `RESUME_MIN_SIZE` bytes are copied in segments of
+        `JOURNAL_INTERVAL` bytes, each one flushed to disk and committed to a `Journal`, so
+        an interrupted copy resumes from the last committed offset.
         """
 
-        with open(src_file, 'rb') as src, open(dst_file, 'wb') as dst:
+        hasher = self._new_hasher()
+        if not self._options.resumable:
+            with self._metrics.phase('copy'), open(
+                src_file, 'rb'
+            ) as src, open(dst_file, 'wb') as dst:
+                self._copy_range(src, dst, 0, None, hasher)
+            self._finish_targets(entry, [dst_file], [dst_file])
+            return hasher.hexdigest() if hasher is not None else None
+
+        target = partial_path(dst_file)
+        journal = Journal(dst_file) if entry.size >= RESUME_MIN_SIZE else None
+        offset = journal.resume_offset(src_file, entry) if journal else 0
+        with self._metrics.phase('copy'), open(src_file, 'rb') as src, open(
+            target, 'r+b' if offset else 'wb'
+        ) as dst:
+            if offset:
+                dst.truncate(offset)
+                if hasher is not None:
+                    while chunk := dst.read(
+                        min(CHUNK_SIZE, offset - dst.tell())
+                    ):
+                        hasher.update(chunk)
+                self._viewer._update(offset)
+            length = JOURNAL_INTERVAL if journal else None
             while True:
-                chunk = src.read(1024 * 1024)
-                if not chunk:
+                copied = self._copy_range(src, dst, offset, length, hasher)
+                offset += copied
+                if journal:
+                    os.fsync(dst.fileno())
+                    journal.commit(offset, entry)
+                if length is None or copied < length:
                     break
-                dst.write(chunk)
-                self._viewer._update(len(chunk))
-        os.utime(
-            dst_file, (src_file.stat().st_atime, src_file.stat().st_mtime)
+        self._finish_targets(entry, [target], [dst_file])
+        if journal:
+            journal.remove()
+        return hasher.hexdigest() if hasher is not None else None
+
+    def _transferred(self, size: int) -> None:
+        """
+        Account for copied bytes in the throttle and the progress bar.
+
+        Args:
+            size: The number of bytes copied.
+
+        Blocks while the job or global byte rate is exceeded, which is how the limits
+        are enforced inside every copy loop.
+        """
+
+        self._throttle.transferred(size)
+        self._viewer._update(size)
+
+    def _copy_range(
+        self,
+        src: BinaryIO,
+        dst: BinaryIO,
+        offset: int,
+        length: int | None,
+        hasher: Any,
+    ) -> int:
+        """
+        Copy a range of bytes of the source file to the same range of the destination.
+
+        Args:
+            src: The source file, opened for reading.
+            dst: The destination file, opened for writing.
+            offset: The position where the range starts, in both files.
+            length: The size of the range, or `None` to copy up to the end of the source.
+            hasher: The `hashlib` object updated with the copied bytes, or `None`.
+
+        Returns:
+            The number of bytes copied, which is less than `length` only at the end
+            of the source.
+        """
+
+        if self._options.sparse and is_sparse(src.fileno()):
+            return self._copy_sparse_range(src, dst, offset, length, hasher)
+        return self._copy_data(src, dst, offset, length, hasher)
+
+    def _copy_sparse_range(
+        self,
+        src: BinaryIO,
+        dst: BinaryIO,
+        offset: int,
+        length: int | None,
+        hasher: Any,
+    ) -> int:
+        """
+        Copy the data regions of a range of a sparse file, keeping its holes.
+
+        Args:
+            src: The source file, opened for reading.
+            dst: The destination file, opened for writing.
+            offset: The position where the range starts, in both files.
+            length: The size of the range, or `None` to copy up to the end of the source.
+            hasher: The `hashlib` object updated with the copied bytes, or `None`.
+
+        Returns:
+            The number of logical bytes of the range, holes included.
+
+        A whole file is first cloned when the filesystem supports it, which keeps the
+        holes for free. Otherwise only the regions found by `copy_engine.data_extents` are
+        copied, and the destination is extended with `ftruncate` so that it ends with the
+        same hole as the source. The holes still count as copied bytes in the progress.
+        """
+
+        if (
+            offset == 0
+            and length is None
+            and hasher is None
+            and clone_file(src.fileno(), dst.fileno())
+        ):
+            size = os.fstat(dst.fileno()).st_size
+            self._viewer._update(size)
+            return size
+        end = os.fstat(src.fileno()).st_size
+        if length is not None:
+            end = min(end, offset + length)
+        position = offset
+        for start, stop in data_extents(src.fileno(), offset, end):
+            self._skip_hole(start - position, hasher)
+            position = start + self._copy_data(
+                src, dst, start, stop - start, hasher
+            )
+            if position < stop:
+                end = position
+                break
+        self._skip_hole(end - position, hasher)
+        if os.fstat(dst.fileno()).st_size < end:
+            os.ftruncate(dst.fileno(), end)
+        return end - offset
+
+    def _skip_hole(self, size: int, hasher: Any) -> None:
+        """
+        Account for a hole of the source that is not copied.
+
+        Args:
+            size: The size of the hole.
+            hasher: The `hashlib` object updated with the zeros of the hole, or `None`.
+        """
+
+        if hasher is not None:
+            zeros = memoryview(ZEROS)
+            for position in range(0, size, CHUNK_SIZE):
+                hasher.update(zeros[: min(CHUNK_SIZE, size - position)])
+        self._viewer._update(size)
+
+    def _copy_data(
+        self,
+        src: BinaryIO,
+        dst: BinaryIO,
+        offset: int,
+        length: int | None,
+        hasher: Any,
+    ) -> int:
+        """
+        Copy a range of bytes holding data to the same range of the destination.
+
+        Args:
+            src: The source file, opened for reading.
+            dst: The destination file, opened for writing.
+            offset: The position where the range starts, in both files.
+            length: The size of the range, or `None` to copy up to the end of the source.
+            hasher: The `hashlib` object updated with the copied bytes, or `None`.
+
+        Returns:
+            The number of bytes copied, which is less than `length` only at the end
+            of the source.
+
+        The range is first copied inside the kernel. When that is not possible, or when
+        the data has to be hashed, it is copied in userspace up to the size the source had
+        when the copy started, from memory mappings if `use_mmap` is set and the range is
+        at least `MMAP_MIN_SIZE` bytes, otherwise through the buffer of the thread.
+        """
+
+        copied, done = 0, False
+        if hasher is None:
+            copied, done = kernel_copy(
+                src.fileno(),
+                dst.fileno(),
+                self._transferred,
+                offset=offset,
+                length=length,
+            )
+        if not done:
+            position = offset + copied
+            remaining = max(0, os.fstat(src.fileno()).st_size - position)
+            if length is not None:
+                remaining = min(remaining, length - copied)
+            if self._options.use_mmap and remaining >= MMAP_MIN_SIZE:
+                copied += self._copy_mapped(
+                    src, dst, position, remaining, hasher
+                )
+            else:
+                copied += self._copy_buffered(
+                    src, dst, position, remaining, hasher
+                )
+        return copied
+
+    def _copy_buffered(
+        self,
+        src: BinaryIO,
+        dst: BinaryIO,
+        position: int,
+        remaining: int,
+        hasher: Any,
+    ) -> int:
+        """
+        Copy bytes in userspace through the buffer of the thread.
+
+        Args:
+            src: The source file, opened for reading.
+            dst: The destination file, opened for writing.
+            position: The position where the copy starts, in both files.
+            remaining: The number of bytes to copy.
+            hasher: The `hashlib` object updated with the copied bytes, or `None`.
+
+        Returns:
+            The number of bytes copied, which is less than `remaining` only if the
+            source shrank.
+
+        The chunks are read with `readinto` into a buffer allocated once per thread (see
+        `_thread_buffer`), so copying allocates no memory however large the file is. The
+        chunk size depends on the size of the file and the block size of both files (see
+        `chunk_size_for`). The time spent reading and writing is recorded as waits on the
+        source and the destination.
+        """
+
+        block_size = max(
+            getattr(os.fstat(src.fileno()), 'st_blksize', 0),
+            getattr(os.fstat(dst.fileno()), 'st_blksize', 0),
+        )
+        buffer = _thread_buffer(chunk_size_for(remaining, block_size))
+        src.seek(position)
+        dst.seek(position)
+        copied = 0
+        read_time = write_time = 0.0
+        while copied < remaining:
+            start = time.perf_counter()
+            count = src.readinto(
+                buffer[: min(len(buffer), remaining - copied)]
+            )
+            read_time += time.perf_counter() - start
+            if not count:
+                break
+            start = time.perf_counter()
+            dst.write(buffer[:count])
+            write_time += time.perf_counter() - start
+            if hasher is not None:
+                hasher.update(buffer[:count])
+            self._transferred(count)
+            copied += count
+        start = time.perf_counter()
+        dst.flush()
+        write_time += time.perf_counter() - start
+        self._metrics.add_wait('source', read_time)
+        self._metrics.add_wait('destination', write_time)
+        return copied
+
+    def _copy_mapped(
+        self,
+        src: BinaryIO,
+        dst: BinaryIO,
+        position: int,
+        remaining: int,
+        hasher: Any,
+    ) -> int:
+        """
+        Copy bytes in userspace from memory mappings of the source.
+
+        Args:
+            src: The source file, opened for reading.
+            dst: The destination file, opened for writing.
+            position: The position where the copy starts, in both files.
+            remaining: The number of bytes to copy.
+            hasher: The `hashlib` object updated with the copied bytes, or `None`.
+
+        Returns:
+            The number of bytes copied, which is less than `remaining` only if the
+            source shrank.
+
+        The source is mapped `MMAP_WINDOW` bytes at a time, and each window is hashed
+        and written without being copied into a buffer, so the memory used stays bounded
+        by the window. Reading the source happens while the window is first touched, by
+        the hasher if there is one, which is recorded as a wait on the source.
+
+        Notes:
+            - Truncating the source while it is mapped makes the process crash with
+              `SIGBUS`, which is why this path has to be enabled with `use_mmap`.
+        """
+
+        dst.seek(position)
+        copied = 0
+        read_time = write_time = 0.0
+        while copied < remaining:
+            start_position = position + copied
+            window_offset = start_position - (
+                start_position % mmap.ALLOCATIONGRANULARITY
+            )
+            size = min(
+                MMAP_WINDOW,
+                position + remaining - window_offset,
+                os.fstat(src.fileno()).st_size - window_offset,
+            )
+            if size <= start_position - window_offset:
+                break
+            with mmap.mmap(
+                src.fileno(),
+                size,
+                offset=window_offset,
+                access=mmap.ACCESS_READ,
+            ) as mapping, memoryview(mapping)[
+                start_position - window_offset :
+            ] as window:
+                if hasher is not None:
+                    start = time.perf_counter()
+                    hasher.update(window)
+                    read_time += time.perf_counter() - start
+                start = time.perf_counter()
+                dst.write(window)
+                write_time += time.perf_counter() - start
+                count = len(window)
+            self._transferred(count)
+            copied += count
+        start = time.perf_counter()
+        dst.flush()
+        write_time += time.perf_counter() - start
+        self._metrics.add_wait('source', read_time)
+        self._metrics.add_wait('destination', write_time)
+        return copied
+
+    def _tee_file(
+        self, src_file: str, dst_files: list[str], entry: Entry
+    ) -> str | None:
+        """
+        Copy a single file from the source to several destinations.
+
+        Args:
+            src_file: The path of the source file.
+            dst_files: The paths of the destination files.
+            entry: The scanned `Entry` of the source file.
+
+        Returns:
+            The hexadecimal digest of the file when `hash_algorithm` is set, otherwise `None`.
+
+        The source file is read once. Every chunk is handed to one writer thread per
+        destination through a queue holding at most `TEE_BUFFER_CHUNKS` chunks, so a slow
+        destination only stalls the others once its buffer is full. Progress is reported
+        once per chunk read, so the source is shown as a single progress stream. Files that
+        fit in a single chunk are written inline, without starting any thread.
+
+        In resumable mode, the destinations are written to temporary paths and renamed into
+        place once complete, but interrupted copies start over.
+
+        Raises:
+            Exception: The first error raised while writing any of the destinations.
+                A failed writer keeps draining its queue, so the reader always finishes.
+        """
+
+        hasher = self._new_hasher()
+        targets = dst_files
+        if self._options.resumable:
+            targets = [partial_path(dst_file) for dst_file in dst_files]
+        if entry.size <= CHUNK_SIZE:
+            with self._metrics.phase('copy'):
+                with open(src_file, 'rb') as src:
+                    chunk = src.read()
+                for target in targets:
+                    with open(target, 'wb') as dst:
+                        dst.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            self._transferred(len(chunk))
+            self._finish_targets(entry, targets, dst_files)
+            return hasher.hexdigest() if hasher is not None else None
+
+        queues: list[Queue] = [
+            Queue(maxsize=TEE_BUFFER_CHUNKS) for _ in dst_files
+        ]
+        errors: list[BaseException] = []
+
+        def write_chunks(dst_file: str, chunks: Queue) -> None:
+            write_time = 0.0
+            drained = False
+            try:
+                with open(dst_file, 'wb') as dst:
+                    while (chunk := chunks.get()) is not None:
+                        start = time.perf_counter()
+                        dst.write(chunk)
+                        write_time += time.perf_counter() - start
+                    drained = True
+                self._metrics.add_wait('destination', write_time)
+            except BaseException as error:
+                errors.append(error)
+                if not drained:
+                    while chunks.get() is not None:
+                        pass
+
+        writers = [
+            threading.Thread(target=write_chunks, args=(dst_file, chunks))
+            for dst_file, chunks in zip(targets, queues)
+        ]
+        copy_start = time.perf_counter()
+        read_time = stall_time = 0.0
+        for writer in writers:
+            writer.start()
+        try:
+            with open(src_file, 'rb') as src:
+                while True:
+                    start = time.perf_counter()
+                    chunk = src.read(CHUNK_SIZE)
+                    read_time += time.perf_counter() - start
+                    if not chunk or errors:
+                        break
+                    start = time.perf_counter()
+                    for chunks in queues:
+                        chunks.put(chunk)
+                    stall_time += time.perf_counter() - start
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    self._transferred(len(chunk))
+        finally:
+            for chunks in queues:
+                chunks.put(None)
+            for writer in writers:
+                writer.join()
+            self._metrics.add_wait('source', read_time)
+            self._metrics.add_wait('tee_stall', stall_time)
+            self._metrics.add_phase('copy', time.perf_counter() - copy_start)
+        if errors:
+            raise errors[0]
+        self._finish_targets(entry, targets, dst_files)
+        return hasher.hexdigest() if hasher is not None else None
+
+    def _dedup_file(
+        self,
+        src_file: str,
+        dst_roots: list[str],
+        dst_files: list[str],
+        entry: Entry,
+    ) -> str | None:
+        """
+        Link a file to the blob of its contents in every destination store.
+
+        Args:
+            src_file: The path of the source file.
+            dst_roots: The directories the source is copied into.
+            dst_files: The paths of the destination files.
+            entry: The scanned `Entry` of the source file.
+
+        Returns:
+            The hexadecimal digest of the file when `hash_algorithm` is set, otherwise `None`.
+
+        A source file whose size and modification time match a digest known by the store
+        is not read at all. Otherwise it is hashed first, and only copied into the store
+        if no blob has the same contents yet. The copy is hashed again while written, so
+        a file changed in the meantime is stored under the digest of what was copied.
+        Reflinked destination files get the source metadata; hardlinked ones share the
+        metadata of their blob.
+        """
+
+        digest = stored_blob = None
+        for dst_root, dst_file in zip(dst_roots, dst_files):
+            store = self._stores[dst_root]
+            known = store.known_digest(src_file, entry)
+            if known is None:
+                if digest is None:
+                    digest = file_digest(src_file, store.algorithm)
+                known = digest
+                if not store.blob_path(known).exists():
+                    temporary_path = store.temporary_path()
+                    if stored_blob is None:
+                        hasher = hashlib.new(store.algorithm)
+                        with self._metrics.phase('copy'), open(
+                            src_file, 'rb'
+                        ) as src, open(temporary_path, 'wb') as dst:
+                            self._copy_range(src, dst, 0, None, hasher)
+                        digest = known = hasher.hexdigest()
+                        store.add(temporary_path, known, entry)
+                        stored_blob = store.blob_path(known)
+                    else:
+                        with self._metrics.phase('copy'):
+                            shutil.copyfile(stored_blob, temporary_path)
+                        store.add(temporary_path, known, entry)
+                store.record(src_file, entry, known)
+            with self._metrics.phase('copy'):
+                reflinked = store.link(known, dst_file)
+            if reflinked:
+                self._restore_metadata(entry, [dst_file])
+            digest = known
+        if stored_blob is None:
+            self._viewer._update(entry.size)
+        return digest if self._options.hash_algorithm else None
+
+    def _link_unchanged(
+        self, src_file: str, entry: Entry, dst_root: str
+    ) -> bool:
+        """
+        Hardlink a file unchanged since the previous snapshot into the new one.
+
+        Args:
+            src_file: The path of the source file.
+            entry: The scanned `Entry` of the source file.
+            dst_root: The hidden directory the new snapshot is written to.
+
+        Returns:
+            `True` if the file was linked, `False` if it has to be copied.
+
+        The file is compared with the previous snapshot like in incremental mode. Its
+        digest is taken from the manifest of the previous snapshot, or computed from the
+        linked file if that manifest does not have it. A file that already has as many
+        links as the filesystem allows is copied instead.
+        """
+
+        base = self._link_bases.get(dst_root)
+        if base is None:
+            return False
+        base_file = self._dst_path(base, entry.relative_path)
+        if not self._is_unchanged(src_file, entry, base_file):
+            return False
+        dst_file = self._dst_path(dst_root, entry.relative_path)
+        self._make_parents([dst_file])
+        try:
+            os.link(base_file, dst_file)
+        except OSError as error:
+            if error.errno != errno.EMLINK:
+                raise
+            return False
+        if dst_root in self._manifests:
+            recorded = None
+            if dst_root in self._base_manifests:
+                recorded = self._base_manifests[dst_root].files.get(
+                    entry.relative_path
+                )
+            digest = (
+                recorded['digest']
+                if recorded is not None
+                else file_digest(dst_file, self._options.hash_algorithm)
+            )
+            self._manifests[dst_root].record(
+                entry.relative_path, digest, entry.size, entry.mtime_ns
+            )
+        return True
+
+    def _compress_file(
+        self, src_file: str, dst_files: list[str], entry: Entry
+    ) -> str | None:
+        """
+        Compress a single file from the source to one or more destinations.
+
+        Args:
+            src_file: The path of the source file.
+            dst_files: The paths of the destination files, with the `.bjz` suffix.
+            entry: The scanned `Entry` of the source file.
+
+        Returns:
+            The hexadecimal digest of the source file when `hash_algorithm` is set,
+            otherwise `None`.
+
+        The source is read once, and its blocks are compressed in parallel by the
+        compression pool (see `compression_manager.compress_stream`) while the compressed
+        stream is written to every destination. The digest is the one of the raw data, so
+        the manifest can be checked against the source.
+
+        In resumable mode, the destinations are written to temporary paths and renamed into
+        place once complete, but interrupted copies start over.
+        """
+
+        hasher = self._new_hasher()
+        targets = dst_files
+        if self._options.resumable:
+            targets = [partial_path(dst_file) for dst_file in dst_files]
+        executor = compression_pool(self._options.compression_workers)
+        with self._metrics.phase('copy'), open(
+            src_file, 'rb'
+        ) as src, ExitStack() as stack:
+            outputs = [
+                stack.enter_context(open(target, 'wb')) for target in targets
+            ]
+            compress_stream(
+                src,
+                outputs,
+                self._options.compression,
+                self._transferred,
+                hasher,
+                executor,
+            )
+        self._finish_targets(entry, targets, dst_files)
+        return hasher.hexdigest() if hasher is not None else None
+
+    def _delta_file(
+        self,
+        src_file: str,
+        dst_roots: list[str],
+        dst_files: list[str],
+        entry: Entry,
+    ) -> str | None:
+        """
+        Update destination files in place with the blocks of the source that changed.
+
+        Args:
+            src_file: The path of the source file.
+            dst_roots: The directories the source is copied into.
+            dst_files: The paths of the destination files.
+            entry: The scanned `Entry` of the source file.
+
+        Returns:
+            The hexadecimal digest of the file when `hash_algorithm` is set, otherwise `None`.
+
+        The block signature of every destination file is loaded from its cache next to
+        the backup (see `delta_manager.signature_path`), or computed by reading the file
+        when the cache is missing or the file changed since. The source is then read once
+        and only its blocks that differ are written (see `delta_manager.apply_delta`), and
+        the new signatures are cached for the next run.
+        """
+
+        hasher = self._new_hasher()
+        signature_paths = [
+            signature_path(dst_root, entry.relative_path)
+            for dst_root in dst_roots
+        ]
+        with self._metrics.phase('copy'), open(
+            src_file, 'rb'
+        ) as src, ExitStack() as stack:
+            outputs = [
+                stack.enter_context(
+                    open(
+                        dst_file, 'r+b' if os.path.exists(dst_file) else 'w+b'
+                    )
+                )
+                for dst_file in dst_files
+            ]
+            signatures = [
+                load_signature(path, os.fstat(dst.fileno()))
+                or compute_signature(dst)
+                for path, dst in zip(signature_paths, outputs)
+            ]
+            signatures, written = apply_delta(
+                src, outputs, signatures, self._transferred, hasher
+            )
+        self._restore_metadata(entry, dst_files)
+        for path, signature, dst_file in zip(
+            signature_paths, signatures, dst_files
+        ):
+            save_signature(path, signature, os.stat(dst_file))
+        with self._lock:
+            self._delta_bytes += entry.size * len(dst_files)
+            self._delta_written += written
+        return hasher.hexdigest() if hasher is not None else None
+
+    def _dst_path(self, dst_root: str, relative_path: str) -> str:
+        """
+        Get the path a scanned file is written to in a destination.
+
+        Args:
+            dst_root: The directory the source is copied into.
+            relative_path: The path of the file relative to the source.
+
+        Returns:
+            The path of the file in `dst_root`, with the `.bjz` suffix when it is
+            compressed.
+        """
+
+        dst_file = os.path.join(dst_root, relative_path)
+        if self._compresses(relative_path):
+            dst_file += COMPRESSED_SUFFIX
+        return dst_file
+
+    def _compresses(self, relative_path: str) -> bool:
+        """
+        Check if a scanned file is written compressed.
+
+        Args:
+            relative_path: The path of the file relative to the source.
+
+        Returns:
+            `True` if `compression` is set, without `dedup`, and the file is not in an
+            already compressed format. Its destination then always gets the `.bjz` suffix,
+            even if its name already ends with it.
+        """
+
+        return (
+            self._options.compression is not None
+            and not self._options.dedup
+            and not is_incompressible(relative_path)
+        )
+
+    def _finish_targets(
+        self, entry: Entry, targets: list[str], dst_files: list[str]
+    ) -> None:
+        """
+        Finalize written files, or queue them for the finalizer thread when streaming.
+
+        Args:
+            entry: The scanned `Entry` of the source file.
+            targets: The paths the data was written to.
+            dst_files: The final paths of the destination files.
+        """
+
+        if self._finalizer is not None:
+            self._finalizer.put((entry, targets, dst_files))
+        else:
+            self._finalize(entry, targets, dst_files)
+
+    def _finalize(
+        self, entry: Entry, targets: list[str], dst_files: list[str]
+    ) -> None:
+        """
+        Restore the metadata of written files and rename them into place.
+
+        Args:
+            entry: The scanned `Entry` of the source file.
+            targets: The paths the data was written to.
+            dst_files: The final paths of the destination files.
+        """
+
+        self._restore_metadata(entry, targets)
+        for target, dst_file in zip(targets, dst_files):
+            if target != dst_file:
+                os.replace(target, dst_file)
+
+    def _new_hasher(self) -> Any:
+        """
+        Create the hash object of a file to be copied.
+
+        Returns:
+            A new `hashlib` object for `hash_algorithm`, or `None` if hashing is disabled.
+        """
+
+        if not self._options.hash_algorithm:
+            return None
+        return hashlib.new(self._options.hash_algorithm)
+
+    def _is_unchanged(
+        self, src_file: str, entry: Entry, dst_file: str
+    ) -> bool:
+        """
+        Check if a destination file is an up to date copy of the source file.
+
+        Args:
+            src_file: The path of the source file.
+            entry: The scanned `Entry` of the source file.
+            dst_file: The path of the destination file.
+
+        Returns:
+            `True` if the destination has the same size and modification time as the
+            source, or the same size and BLAKE2 digest when `checksum` is enabled.
+
+        The size and contents of compressed destinations are the ones of the data they
+        hold.
+        """
+
+        compressed = self._compresses(entry.relative_path)
+        try:
+            dst_stat = os.stat(dst_file)
+            size = raw_size(dst_file) if compressed else dst_stat.st_size
+        except (FileNotFoundError, ValueError):
+            return False
+        if size != entry.size:
+            return False
+        if not self._options.checksum:
+            return dst_stat.st_mtime_ns == entry.mtime_ns
+        dst_reader = (
+            io.BufferedReader(CompressedReader(dst_file))
+            if compressed
+            else open(dst_file, 'rb')
         )
-        os.chmod(dst_file, src_file.stat().st_mode)
+        with open(src_file, 'rb') as src, dst_reader as dst:
+            return (
+                hashlib.file_digest(src, 'blake2b').digest()
+                == hashlib.file_digest(dst, 'blake2b').digest()
+            )
+
+    def _restore_metadata(self, entry: Entry, dst_files: list[str]) -> None:
+        """
+        Apply the source times and mode to the destination files.
+
+        Args:
+            entry: The scanned `Entry` of the source file.
+            dst_files: The paths of the destination files.
+        """
+
+        with self._metrics.phase('metadata'):
+            for dst_file in dst_files:
+                os.utime(dst_file, ns=(entry.atime_ns, entry.mtime_ns))
+                os.chmod(dst_file, entry.mode)
 
 
-def calculates_size(sources: list[Path]) -> None:
+def format_size(size: float) -> str:
+    """
+    Format a size in bytes using the most appropriate unit.
+
+    Args:
+        size: The size in bytes.
+
+    Returns:
+        The size with two decimals and its unit (B, KB, MB, GB, TB).
+
+    Examples:
+        >>> format_size(3 * 1024 * 1024)
+        '3.00 MB'
+    """
+
+    size_units = ['B', 'KB', 'MB', 'GB', 'TB']
+    unit_index = 0
+
+    while size >= 1024 and unit_index < len(size_units) - 1:
+        size /= 1024
+        unit_index += 1
+
+    return f'{size:.2f} {size_units[unit_index]}'
+
+
+def calculates_size(
+    sources: list[Path],
+    use_index: bool = False,
+    includes: list[str] = None,
+    excludes: list[str] = None,
+) -> None:
     """
     Calculate the total size of the given source directories.
 
     Args:
         sources: A list of source directories or file paths.
+        use_index: If `True`, source directories are sized through the persistent
+            `ScanIndex`, which only walks the directories changed since the last run.
+        includes: The glob patterns of the files to count. Defaults to every file.
+        excludes: The glob patterns of the files and directories not to count, to
+            which the `.bjignore` patterns of each source are added.
 
     This function calculates the total size of the given source directories or files.
     It iterates through the provided list of `Path` objects and sums up the sizes
@@ -111,31 +1658,41 @@ def calculates_size(sources: list[Path]) -> None:
     """
 
     sources_size = 0
+    index = ScanIndex() if use_index else None
     for source in sources:
         if not source.exists():
             raise FileNotFoundError(f'{source.name} does not exist.')
-        model = Paths(source)
+        path_filter = PathFilter.for_source(source, includes, excludes)
+        if index is not None and source.is_dir():
+            sources_size += index.total_size(source, path_filter)
+            continue
+        model = Paths(source, path_filter=path_filter)
         sources_size += model.total_size
 
-    size_units = ['B', 'KB', 'MB', 'GB', 'TB']
-    unit_index = 0
-
-    while sources_size >= 1024 and unit_index < len(size_units) - 1:
-        sources_size /= 1024
-        unit_index += 1
-
-    size_message = f'Total size: {sources_size:.2f} {size_units[unit_index]}'
+    size_message = f'Total size: {format_size(sources_size)}'
     panel = Panel(size_message, expand=False)
     console.print(panel)
 
 
-def backup(source: Path, destination: Path) -> None:
+def backup(
+    source: Path,
+    destination: Path | list[Path],
+    options: BackupOptions = None,
+    reporter: ProgressReporter = None,
+) -> BackupMetrics:
     """
     Perform a file backup operation from the source path to the destination path.
 
     Args:
         source: The source directory or file path.
-        destination: The destination directory.
+        destination: The destination directory, or a list of destination directories
+            that will be written from a single read of the source.
+        options: The `BackupOptions` of the backup. Defaults to `BackupOptions()`.
+        reporter: The `ProgressReporter` rendering the progress of the backup. Defaults
+            to a reporter of its own, in the `progress` mode of the options.
+
+    Returns:
+        The `BackupMetrics` of the backup.
 
     Initiates a file backup operation by creating instances of `Paths`, `ProgressViewer`,
     and `FileCopier` classes. The file copying is performed by calling the `do_copy` method
@@ -147,41 +1704,194 @@ def backup(source: Path, destination: Path) -> None:
 
     if not source.exists():
         raise FileNotFoundError(f'{source.name} does not exist.')
+    options = options or BackupOptions()
+    if reporter is None:
+        with ProgressReporter(options.progress) as reporter:
+            return backup(source, destination, options, reporter)
 
-    paths = Paths(source, destination)
+    destinations = (
+        [destination] if isinstance(destination, Path) else list(destination)
+    )
+    metrics = BackupMetrics(source, destinations)
+    path_filter = PathFilter.for_source(
+        source, options.includes, options.excludes
+    )
+    paths = Paths(
+        source, destinations, metrics, options.streaming, path_filter
+    )
     viewer = ProgressViewer(paths)
-    Copier = FileCopier(paths, viewer)
+    reporter.register(viewer)
+    Copier = FileCopier(paths, viewer, options, metrics)
     Copier._copy_to()
+    destination_names = ', '.join(dst.name for dst in paths.destinations)
     completed_message = (
-        f'Backup completed successfully: {source.name} -> {destination.name}'
+        f'Backup completed successfully: {source.name} -> {destination_names}'
     )
+    if Copier._options.incremental or Copier._link_bases:
+        completed_message += (
+            f'\nSkipped {Copier._skipped_files} unchanged file(s) '
+            f'({format_size(Copier._skipped_bytes)})'
+        )
+    if Copier._delta_bytes:
+        completed_message += (
+            f'\nDelta transfer wrote {format_size(Copier._delta_written)} '
+            f'of {format_size(Copier._delta_bytes)}'
+        )
     panel = Panel(completed_message, border_style='green')
     console.print(panel)
+    return metrics
 
 
-def parallel_backups(sources: list[Path], destinations: list[Path]) -> None:
+def verify_backups(
+    backups: list[Path], workers: int = None, changed_only: bool = False
+) -> bool:
+    """
+    Verify backup directories against the manifests written while copying them.
+
+    Args:
+        backups: A list of backup directories (`destination/<source.stem>`).
+        workers: The number of files hashed at the same time.
+        changed_only: If `True`, files that did not change since their last
+            verification are not read again.
+
+    Returns:
+        `True` if every recorded file exists and matches its digest.
+
+    Raises:
+        FileNotFoundError: If a backup directory or its manifest does not exist.
+
+    Examples:
+        >>> verify_backups([Path('path/to/destination/source')])
+    """
+
+    all_ok = True
+    for backup_dir in backups:
+        if not backup_dir.exists():
+            raise FileNotFoundError(f'{backup_dir.name} does not exist.')
+        report: VerifyReport = verify_backup(backup_dir, workers, changed_only)
+        ok = not report.mismatched and not report.missing
+        all_ok = all_ok and ok
+        lines = [
+            f'Verified {report.verified} file(s) of {backup_dir.name}, '
+            f'skipped {report.skipped} unchanged'
+        ]
+        lines += [f'Mismatched: {path}' for path in report.mismatched]
+        lines += [f'Missing: {path}' for path in report.missing]
+        panel = Panel('\n'.join(lines), border_style='green' if ok else 'red')
+        console.print(panel)
+    return all_ok
+
+
+def restore_backups(
+    backups: list[Path], target: Path, workers: int = None
+) -> None:
+    """
+    Restore backup directories, decompressing their compressed files and extracting
+    their packed ones.
+
+    Args:
+        backups: A list of backup directories (`destination/<source.stem>`).
+        target: The directory the backups are restored into, each one in a
+            subdirectory named after it.
+        workers: The number of processes decompressing blocks.
+
+    Raises:
+        FileNotFoundError: If a backup directory does not exist.
+
+    Examples:
+        >>> restore_backups([Path('path/to/destination/source')], Path('path/to/target'))
+    """
+
+    try:
+        for backup_dir in backups:
+            if not backup_dir.exists():
+                raise FileNotFoundError(f'{backup_dir.name} does not exist.')
+            restored = restore_backup(
+                backup_dir, target / backup_dir.name, workers
+            ) + restore_packed(backup_dir, target / backup_dir.name)
+            panel = Panel(
+                f'Restored {restored} file(s) of {backup_dir.name} '
+                f'to {target.name}',
+                border_style='green',
+            )
+            console.print(panel)
+    finally:
+        shutdown_pool()
+
+
+def parallel_backups(
+    sources: list[Path],
+    destinations: list[Path],
+    fan_out: bool = False,
+    options: BackupOptions = None,
+) -> None:
     """
     Perform multiple file backup operations in parallel.
 
     Args:
         sources: A list of source directories or file paths.
         destinations: A list of destination directories.
+        fan_out: If `True`, each source is read once and written to all the
+            destinations, instead of running one backup per source and destination.
+        options: The `BackupOptions` shared by all the backups.
 
     Examples:
         >>> sources = [Path('path/to/source1'), Path('path/to/source2')]
         >>> destinations = [Path('path/to/destination1'), Path('path/to/destination2')]
         >>> parallel_backups(sources, destinations)
 
-    Initiates multiple file backup operations in parallel using `ThreadPoolExecutor` from
-    the `concurrent.futures` module. The `backup` function is submitted as a task to the executor
-    for each combination of source and destination paths. The function waits for all tasks to complete
-    before returning.
+    Initiates multiple file backup operations in parallel through a `JobScheduler`. The
+    `backup` function is run for each combination of source and destination paths, or once
+    per source in fan-out mode, as soon as the devices of its source and destinations have
+    room for it: backups sharing a spinning disk run one after another, while backups on
+    flash devices run side by side. The function waits for all backups to complete before
+    returning.
+
+    The global byte and file rate limits of `options` are shared by every backup, and
+    the limits can be changed while the backups run through `options.control_file`.
+
+    The progress of all the backups is rendered together by a single `ProgressReporter`.
+
+    Once every backup completed, their metrics are written to `options.metrics_json`
+    and `options.metrics_textfile`, when set.
     """
-    with ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(backup, source, destination)
-            for source in sources
-            for destination in destinations
-        ]
-        for future in as_completed(futures):
-            future.result()
+    options = options or BackupOptions()
+    global_throttle.set_rates(
+        options.global_bytes_per_second, options.global_files_per_second
+    )
+    watcher = None
+    if options.control_file is not None:
+        watcher = ControlFileWatcher(options.control_file)
+        watcher.start()
+    try:
+        with ProgressReporter(options.progress) as reporter:
+            if fan_out:
+                scheduled = [
+                    (
+                        partial(
+                            backup, source, destinations, options, reporter
+                        ),
+                        [source, *destinations],
+                    )
+                    for source in sources
+                ]
+            else:
+                scheduled = [
+                    (
+                        partial(
+                            backup, source, destination, options, reporter
+                        ),
+                        [source, destination],
+                    )
+                    for source in sources
+                    for destination in destinations
+                ]
+            jobs = JobScheduler().run(scheduled)
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        shutdown_pool()
+    if options.metrics_json is not None:
+        write_json(jobs, options.metrics_json)
+    if options.metrics_textfile is not None:
+        write_prometheus(jobs, options.metrics_textfile)
@@ -0,0 +1,224 @@
+import os
+import re
+from pathlib import Path
+
+IGNORE_FILE = '.bjignore'
+
+
+def _translate(pattern: str) -> str:
+    """
+    Translate a glob pattern into a regular expression matching relative paths.
+
+    Args:
+        pattern: The pattern, without its trailing `/`.
+
+    Returns:
+        The regular expression, anchored at the root of the source when the pattern
+        contains a `/`, otherwise matching the name at any depth.
+    """
+
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    parts = []
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith('**/', index):
+            parts.append('(?:.*/)?')
+            index += 3
+        elif pattern.startswith('**', index):
+            parts.append('.*')
+            index += 2
+        elif pattern[index] == '*':
+            parts.append('[^/]*')
+            index += 1
+        elif pattern[index] == '?':
+            parts.append('[^/]')
+            index += 1
+        elif pattern[index] == '[' and ']' in pattern[index + 2 :]:
+            end = pattern.index(']', index + 2)
+            content = pattern[index + 1 : end]
+            if content.startswith('!'):
+                content = '^' + content[1:]
+            parts.append(f'[{content}]')
+            index = end + 1
+        else:
+            parts.append(re.escape(pattern[index]))
+            index += 1
+    regex = ''.join(parts)
+    return regex if anchored else f'(?:.*/)?{regex}'
+
+
+def _compile(patterns: list[str], directories: bool) -> re.Pattern | None:
+    """
+    Compile glob patterns into a single regular expression.
+
+    Args:
+        patterns: The patterns. A trailing `/` restricts a pattern to directories.
+        directories: If `True`, the expression matches the directories the patterns
+            select, otherwise the files they select, including the files inside the
+            selected directories.
+
+    Returns:
+        The compiled expression, to be used with `fullmatch`, or `None` if there is
+        no pattern.
+    """
+
+    alternatives = []
+    for pattern in patterns:
+        directory_only = pattern.endswith('/')
+        regex = _translate(pattern.rstrip('/'))
+        if directories or not directory_only:
+            alternatives.append(f'{regex}(?:/.*)?')
+        else:
+            alternatives.append(f'{regex}/.*')
+    if not alternatives:
+        return None
+    return re.compile('|'.join(f'(?:{regex})' for regex in alternatives))
+
+
+def read_ignore_file(source: Path) -> list[str]:
+    """
+    Read the exclude patterns of the `.bjignore` file of a source.
+
+    Args:
+        source: The source directory.
+
+    Returns:
+        The patterns of the file, one per line, without blank lines and comments
+        starting with `#`. Empty if the source has no `.bjignore` file.
+    """
+
+    try:
+        with open(os.path.join(source, IGNORE_FILE)) as file:
+            lines = file.read().splitlines()
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+    return [
+        line.strip()
+        for line in lines
+        if line.strip() and not line.lstrip().startswith('#')
+    ]
+
+
+class PathFilter:
+    """
+    Compiled include and exclude patterns selecting the files of a source.
+
+    Attributes:
+        _includes: The include patterns.
+        _excludes: The exclude patterns.
+        _include_files: The expression matching the included files, if any.
+        _exclude_files: The expression matching the excluded files, if any.
+        _exclude_directories: The expression matching the pruned directories, if any.
+
+    Methods:
+        - for_source: Build the filter of a source, adding its `.bjignore` patterns.
+        - key: Get a string identifying the patterns.
+        - prunes: Check if a directory is excluded, with everything inside it.
+        - selects: Check if a file is to be copied.
+
+    Notes:
+        - Patterns are globs matched against paths relative to the source: `*` and `?`
+          do not match `/`, `**` matches any number of directories, a pattern without `/`
+          matches names at any depth, one with a `/` is anchored at the source, and a
+          trailing `/` only matches directories.
+        - Excluded directories are pruned while walking, so nothing inside them is listed
+          or stat'ed. Include patterns only select files: when there are any, the other
+          files are skipped, but every directory that is not excluded is still walked.
+    """
+
+    def __init__(
+        self, includes: list[str] = None, excludes: list[str] = None
+    ) -> None:
+        """
+        Initialize a `PathFilter` instance, compiling the patterns.
+
+        Args:
+            includes: The include patterns. Defaults to every file.
+            excludes: The exclude patterns. Defaults to none.
+        """
+
+        self._includes: list[str] = list(includes or [])
+        self._excludes: list[str] = list(excludes or [])
+        self._include_files: re.Pattern | None = _compile(
+            self._includes, directories=False
+        )
+        self._exclude_files: re.Pattern | None = _compile(
+            self._excludes, directories=False
+        )
+        self._exclude_directories: re.Pattern | None = _compile(
+            self._excludes, directories=True
+        )
+
+    @classmethod
+    def for_source(
+        cls,
+        source: Path,
+        includes: list[str] = None,
+        excludes: list[str] = None,
+    ) -> 'PathFilter':
+        """
+        Build the filter of a source, adding the patterns of its `.bjignore` file.
+
+        Args:
+            source: The source directory or file path.
+            includes: The include patterns.
+            excludes: The exclude patterns, to which the `.bjignore` ones are added.
+
+        Returns:
+            The new `PathFilter`.
+        """
+
+        return cls(includes, [*(excludes or []), *read_ignore_file(source)])
+
+    @property
+    def key(self) -> str:
+        """
+        Get a string identifying the patterns.
+
+        Returns:
+            The patterns, or an empty string when the filter selects every file.
+        """
+
+        if not self._includes and not self._excludes:
+            return ''
+        return '\n'.join(
+            [*(f'+{pattern}' for pattern in self._includes)]
+            + [f'-{pattern}' for pattern in self._excludes]
+        )
+
+    def prunes(self, relative_path: str) -> bool:
+        """
+        Check if a directory is excluded, with everything inside it.
+
+        Args:
+            relative_path: The path of the directory relative to the source.
+
+        Returns:
+            `True` if the directory must not be walked.
+        """
+
+        return bool(
+            self._exclude_directories
+            and self._exclude_directories.fullmatch(relative_path)
+        )
+
+    def selects(self, relative_path: str) -> bool:
+        """
+        Check if a file is to be copied.
+
+        Args:
+            relative_path: The path of the file relative to the source.
+
+        Returns:
+            `True` if the file is not excluded and, when there are include patterns,
+            matches one of them.
+        """
+
+        if self._exclude_files and self._exclude_files.fullmatch(
+            relative_path
+        ):
+            return False
+        return not self._include_files or bool(
+            self._include_files.fullmatch(relative_path)
+        )
@@ -0,0 +1,236 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from backup_juggler.filter_manager import PathFilter
+from backup_juggler.scan_manager import list_directory
+
+DEFAULT_MAX_INDEX_SIZE = 256 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS directories (
+    source_id INTEGER NOT NULL REFERENCES sources (id) ON DELETE CASCADE,
+    relative_path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    files_size INTEGER NOT NULL,
+    subdirectories TEXT NOT NULL,
+    PRIMARY KEY (source_id, relative_path)
+) WITHOUT ROWID;
+"""
+
+
+def cache_directory() -> Path:
+    """
+    Get the directory where Backup Juggler keeps its cache.
+
+    Returns:
+        `$BJ_CACHE_DIR` if it is set, otherwise `backup-juggler` inside
+        `$XDG_CACHE_HOME` (or `~/.cache`).
+    """
+
+    if 'BJ_CACHE_DIR' in os.environ:
+        return Path(os.environ['BJ_CACHE_DIR'])
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'backup-juggler'
+
+
+class ScanIndex:
+    """
+    On-disk index of the directories of the scanned sources.
+
+    Attributes:
+        _path: The path of the SQLite database.
+        _max_size: The size above which the least recently used sources are evicted.
+        _lock: The lock serializing the use of the index inside the process.
+
+    Methods:
+        - total_size: Get the total size of a source, walking only the changed directories.
+        - invalidate: Forget one or all sources.
+        - _evict: Drop the least recently used sources until the index fits in `_max_size`.
+
+    Notes:
+        - Each directory is stored with its modification time, the total size of the files
+          directly inside it and the names of its subdirectories. A directory whose modification
+          time did not change is not listed again and none of its files are stat'ed.
+        - A directory modification time only changes when entries are added, removed or
+          renamed. A file rewritten in place keeps its old size in the index until its
+          directory changes or the index is invalidated.
+        - A source is indexed separately for every set of filter patterns, since the
+          selected files, and so the stored sizes and subdirectories, depend on them.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(
+        self, path: Path = None, max_size: int = DEFAULT_MAX_INDEX_SIZE
+    ) -> None:
+        """
+        Initialize a `ScanIndex` instance.
+
+        Args:
+            path: The path of the SQLite database. Defaults to `index.sqlite3` in
+                the `cache_directory()`.
+            max_size: The maximum size of the database in bytes.
+        """
+
+        self._path: Path = path or cache_directory() / 'index.sqlite3'
+        self._max_size: int = max_size
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open the index, creating it if needed, and commit when done.
+
+        Yields:
+            The open connection to the index.
+        """
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            connection = sqlite3.connect(self._path, timeout=30)
+            try:
+                connection.execute('PRAGMA foreign_keys = ON')
+                connection.executescript(_SCHEMA)
+                with connection:
+                    yield connection
+            finally:
+                connection.close()
+
+    def total_size(
+        self, source: Path, path_filter: PathFilter | None = None
+    ) -> int:
+        """
+        Get the total size of the files of a source directory.
+
+        Args:
+            source: The source directory.
+            path_filter: The `PathFilter` selecting the files. Defaults to every file.
+
+        Returns:
+            The total size in bytes, the same as
+            `Paths(source, path_filter=path_filter).total_size`.
+        """
+
+        source_key = os.fspath(source.resolve())
+        index_key = f'{source_key}\n{path_filter.key if path_filter else ""}'
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO sources (path, last_used) VALUES (?, ?) '
+                'ON CONFLICT (path) DO UPDATE SET last_used = excluded.last_used',
+                (index_key, time.time()),
+            )
+            (source_id,) = connection.execute(
+                'SELECT id FROM sources WHERE path = ?', (index_key,)
+            ).fetchone()
+            known = {
+                relative_path: (mtime_ns, files_size, subdirectories)
+                for relative_path, mtime_ns, files_size, subdirectories in (
+                    connection.execute(
+                        'SELECT relative_path, mtime_ns, files_size, '
+                        'subdirectories FROM directories WHERE source_id = ?',
+                        (source_id,),
+                    )
+                )
+            }
+
+            total_size = 0
+            changed = []
+            pending = ['']
+            while pending:
+                relative_path = pending.pop()
+                directory = os.path.join(source_key, relative_path)
+                mtime_ns = os.stat(directory).st_mtime_ns
+                row = known.pop(relative_path, None)
+                if row is not None and row[0] == mtime_ns:
+                    files_size, subdirectories = row[1], row[2]
+                else:
+                    files, subdirs = list_directory(
+                        directory,
+                        path_filter,
+                        f'{relative_path}/' if relative_path else '',
+                    )
+                    files_size = sum(file.stat().st_size for file in files)
+                    subdirectories = '\n'.join(
+                        subdir.name for subdir in subdirs
+                    )
+                    changed.append(
+                        (
+                            source_id,
+                            relative_path,
+                            mtime_ns,
+                            files_size,
+                            subdirectories,
+                        )
+                    )
+                total_size += files_size
+                if subdirectories:
+                    pending.extend(
+                        os.path.join(relative_path, name)
+                        for name in subdirectories.split('\n')
+                    )
+
+            connection.executemany(
+                'INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)',
+                changed,
+            )
+            connection.executemany(
+                'DELETE FROM directories '
+                'WHERE source_id = ? AND relative_path = ?',
+                ((source_id, relative_path) for relative_path in known),
+            )
+            self._evict(connection, source_id)
+        return total_size
+
+    def invalidate(self, source: Path = None) -> None:
+        """
+        Forget the directories of one source, whatever its filters, or of every source.
+
+        Args:
+            source: The source to forget. Defaults to `None`, which empties the index.
+        """
+
+        with self._connect() as connection:
+            if source is None:
+                connection.execute('DELETE FROM sources')
+            else:
+                prefix = f'{os.fspath(source.resolve())}\n'
+                connection.execute(
+                    'DELETE FROM sources WHERE substr(path, 1, ?) = ?',
+                    (len(prefix), prefix),
+                )
+
+    def _evict(self, connection: sqlite3.Connection, keep: int) -> None:
+        """
+        Drop the least recently used sources until the index fits in `_max_size`.
+
+        Args:
+            connection: The open connection to the index.
+            keep: The id of the source being scanned, which is never evicted.
+        """
+
+        def used_size() -> int:
+            (page_count,) = connection.execute('PRAGMA page_count').fetchone()
+            (free_pages,) = connection.execute(
+                'PRAGMA freelist_count'
+            ).fetchone()
+            (page_size,) = connection.execute('PRAGMA page_size').fetchone()
+            return (page_count - free_pages) * page_size
+
+        while used_size() > self._max_size:
+            oldest = connection.execute(
+                'SELECT id FROM sources WHERE id != ? '
+                'ORDER BY last_used LIMIT 1',
+                (keep,),
+            ).fetchone()
+            if oldest is None:
+                break
+            connection.execute('DELETE FROM sources WHERE id = ?', oldest)
@@ -0,0 +1,123 @@
+import json
+import os
+
+from backup_juggler.scan_manager import Entry
+
+JOURNAL_INTERVAL = 64 * 1024 * 1024
+RESUME_MIN_SIZE = 64 * 1024 * 1024
+VERIFY_SIZE = 1024 * 1024
+
+
+def partial_path(dst_file: str) -> str:
+    """
+    Get the temporary path a destination file is written to before being renamed.
+
+    Args:
+        dst_file: The path of the destination file.
+
+    Returns:
+        A hidden path in the same directory, so the final rename is atomic.
+    """
+
+    directory, name = os.path.split(dst_file)
+    return os.path.join(directory, f'.{name}.bj-partial')
+
+
+class Journal:
+    """
+    Checkpoint journal of an interrupted copy of a large file.
+
+    Attributes:
+        _path: The path of the journal file.
+        _partial_path: The path of the partially written destination file.
+
+    Methods:
+        - resume_offset: Get the offset where an interrupted copy can resume.
+        - commit: Record that the data up to an offset is safely on disk.
+        - remove: Delete the journal once the copy is complete.
+
+    Notes:
+        - The journal records the size and modification time of the source, so a copy
+          is only resumed if the source did not change in the meantime.
+        - An offset is only committed after the partial file was flushed to disk with
+          `os.fsync`, and the last `VERIFY_SIZE` bytes before it are compared with the
+          source before resuming.
+    """
+
+    def __init__(self, dst_file: str) -> None:
+        """
+        Initialize a `Journal` instance.
+
+        Args:
+            dst_file: The path of the destination file.
+        """
+
+        directory, name = os.path.split(dst_file)
+        self._path: str = os.path.join(directory, f'.{name}.bj-journal')
+        self._partial_path: str = partial_path(dst_file)
+
+    def resume_offset(self, src_file: str, entry: Entry) -> int:
+        """
+        Get the offset where an interrupted copy of the source file can resume.
+
+        Args:
+            src_file: The path of the source file.
+            entry: The scanned `Entry` of the source file.
+
+        Returns:
+            The last committed offset, or 0 if there is no usable journal.
+        """
+
+        try:
+            with open(self._path) as file:
+                journal = json.load(file)
+            partial_size = os.stat(self._partial_path).st_size
+        except (FileNotFoundError, ValueError):
+            return 0
+        offset = journal['offset']
+        if (
+            journal['size'] != entry.size
+            or journal['mtime_ns'] != entry.mtime_ns
+            or not 0 < offset <= min(partial_size, entry.size)
+        ):
+            return 0
+        start = max(0, offset - VERIFY_SIZE)
+        with open(src_file, 'rb') as src, open(
+            self._partial_path, 'rb'
+        ) as partial:
+            src.seek(start)
+            partial.seek(start)
+            if src.read(offset - start) != partial.read(offset - start):
+                return 0
+        return offset
+
+    def commit(self, offset: int, entry: Entry) -> None:
+        """
+        Record that the partial file holds the source data up to an offset.
+
+        Args:
+            offset: The number of bytes of the source safely written to disk.
+            entry: The scanned `Entry` of the source file.
+        """
+
+        temporary_path = f'{self._path}.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(
+                {
+                    'size': entry.size,
+                    'mtime_ns': entry.mtime_ns,
+                    'offset': offset,
+                },
+                file,
+            )
+        os.replace(temporary_path, self._path)
+
+    def remove(self) -> None:
+        """
+        Delete the journal once the copy is complete.
+        """
+
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
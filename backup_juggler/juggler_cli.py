@@ -1,36 +1,54 @@
 from pathlib import Path
 
-import toml
-from rich.console import Console
-from rich.panel import Panel
-from typer import Context, Exit, Option, Typer
+import click
+from typer import BadParameter, Context, Exit, Option, Typer
 from typing_extensions import Annotated
 
-from backup_juggler.files_manager import calculates_size, parallel_backups
+from backup_juggler.backup_options import (
+    COMPRESSION_CODECS,
+    COPY_ORDERS,
+    HASH_ALGORITHMS,
+    BackupOptions,
+)
+from backup_juggler.progress_viewer import PROGRESS_MODES
+from backup_juggler.throttle_manager import parse_size
+
+# The backup engine, rich and tqdm are imported by the subcommands that need
+# them, so `bj --version` and `bj --help` start without loading them.
 
 app = Typer(
     help='Multiple copies of files and directories simultaneously made easy.'
 )
-console = Console()
 
 
 def get_version():
-    root_dir = Path(__file__).resolve().parents[1]
-    pyproject_path = root_dir / 'pyproject.toml'
-    with open(pyproject_path) as f:
-        pyproject = toml.load(f)
-        version = pyproject['tool']['poetry']['version']
-        return version
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version('backup-juggler')
+    except PackageNotFoundError:
+        # Running from a source checkout that was never installed.
+        import tomllib
+
+        root_dir = Path(__file__).resolve().parents[1]
+        with open(root_dir / 'pyproject.toml', 'rb') as f:
+            return tomllib.load(f)['tool']['poetry']['version']
+
+
+def print_panel(message: str, **kwargs):
+    from rich.console import Console
+    from rich.panel import Panel
+
+    Console().print(Panel(message, **kwargs))
 
 
 def version_callback(value: bool):
     if value:
         version = get_version()
         version_message = f'Backup Juggler {version}'
-        panel = Panel(
+        print_panel(
             version_message, title='Version', title_align='left', expand=False
         )
-        console.print(panel)
         raise Exit(code=0)
 
 
@@ -71,8 +89,274 @@ def do_backups(
             help='Destination directory(s) for the backups.',
         ),
     ],
+    fan_out: Annotated[
+        bool,
+        Option(
+            '--fan-out',
+            help='Read each source once and write it to every destination.',
+        ),
+    ] = False,
+    incremental: Annotated[
+        bool,
+        Option(
+            '--incremental',
+            '-i',
+            help='Copy only new or changed files (by size and mtime).',
+        ),
+    ] = False,
+    checksum: Annotated[
+        bool,
+        Option(
+            '--checksum',
+            help='With --incremental, compare file contents instead of mtime.',
+        ),
+    ] = False,
+    workers: Annotated[
+        int,
+        Option(
+            '--workers',
+            '-w',
+            min=1,
+            help='Number of files of each backup copied at the same time.',
+        ),
+    ] = 1,
+    copy_order: Annotated[
+        str,
+        Option(
+            '--order',
+            click_type=click.Choice(COPY_ORDERS),
+            help='Order the files of each backup are copied in: as scanned, '
+            'by inode, by disk position (extent), or by size.',
+        ),
+    ] = 'scan',
+    streaming: Annotated[
+        bool,
+        Option(
+            '--stream',
+            help='Start copying while the source is still being scanned, '
+            'without keeping its list of files in memory.',
+        ),
+    ] = False,
+    includes: Annotated[
+        list[str],
+        Option(
+            '--include',
+            metavar='PATTERN',
+            help='Only copy the files matching a glob pattern (e.g. '
+            "'*.py', 'src/**'). Can be repeated.",
+        ),
+    ] = None,
+    excludes: Annotated[
+        list[str],
+        Option(
+            '--exclude',
+            metavar='PATTERN',
+            help='Skip the files and directories matching a glob pattern '
+            "(e.g. '*.tmp', 'build/'), added to the .bjignore ones. Can be "
+            'repeated.',
+        ),
+    ] = None,
+    device_workers: Annotated[
+        int,
+        Option(
+            '--device-workers',
+            min=1,
+            help='Maximum number of files copied at the same time to a '
+            'destination device.',
+        ),
+    ] = None,
+    hash_algorithm: Annotated[
+        str,
+        Option(
+            '--hash',
+            click_type=click.Choice(HASH_ALGORITHMS),
+            help='Checksum files while copying and write a manifest that '
+            '`bj verify` can check.',
+        ),
+    ] = None,
+    resumable: Annotated[
+        bool,
+        Option(
+            '--resume',
+            help='Write files atomically and resume interrupted copies of '
+            'large files.',
+        ),
+    ] = False,
+    snapshot: Annotated[
+        bool,
+        Option(
+            '--snapshot',
+            help='Write each run to a new timestamped snapshot, hardlinking '
+            'unchanged files to the previous one.',
+        ),
+    ] = False,
+    keep_snapshots: Annotated[
+        int,
+        Option(
+            '--keep-snapshots',
+            min=1,
+            help='With --snapshot, number of snapshots kept per source.',
+        ),
+    ] = None,
+    dedup: Annotated[
+        bool,
+        Option(
+            '--dedup',
+            help='Store identical files once per destination and link the '
+            'backups to them.',
+        ),
+    ] = False,
+    sparse: Annotated[
+        bool,
+        Option(
+            '--sparse',
+            help='Keep the holes of sparse files instead of writing zeros.',
+        ),
+    ] = False,
+    use_mmap: Annotated[
+        bool,
+        Option(
+            '--mmap',
+            help='Copy and hash files of 1 GB or more from memory mappings. '
+            'Do not use on sources that may be truncated while copied.',
+        ),
+    ] = False,
+    delta: Annotated[
+        bool,
+        Option(
+            '--delta',
+            help='Rewrite only the changed blocks of large files that are '
+            'already backed up.',
+        ),
+    ] = False,
+    pack_threshold: Annotated[
+        int,
+        Option(
+            '--pack-small',
+            parser=parse_size,
+            metavar='SIZE',
+            help='Pack files of at most SIZE bytes (e.g. 64K) into tar '
+            'segments instead of copying them one by one.',
+        ),
+    ] = None,
+    compression: Annotated[
+        str,
+        Option(
+            '--compress',
+            click_type=click.Choice(COMPRESSION_CODECS),
+            help='Compress files in blocks, in parallel, into .bjz files '
+            'that `bj restore` decompresses.',
+        ),
+    ] = None,
+    compression_workers: Annotated[
+        int,
+        Option(
+            '--compress-workers',
+            min=1,
+            help='Number of processes compressing blocks. One per CPU by '
+            'default.',
+        ),
+    ] = None,
+    bytes_per_second: Annotated[
+        int,
+        Option(
+            '--limit-rate',
+            parser=parse_size,
+            metavar='SIZE',
+            help='Maximum bytes per second of each backup (e.g. 50M).',
+        ),
+    ] = None,
+    files_per_second: Annotated[
+        float,
+        Option(
+            '--limit-files',
+            min=0,
+            help='Maximum files per second of each backup.',
+        ),
+    ] = None,
+    global_bytes_per_second: Annotated[
+        int,
+        Option(
+            '--global-limit-rate',
+            parser=parse_size,
+            metavar='SIZE',
+            help='Maximum bytes per second of all backups together.',
+        ),
+    ] = None,
+    global_files_per_second: Annotated[
+        float,
+        Option(
+            '--global-limit-files',
+            min=0,
+            help='Maximum files per second of all backups together.',
+        ),
+    ] = None,
+    control_file: Annotated[
+        Path,
+        Option(
+            '--control-file',
+            help='JSON file with rate limits, re-read while the backups run.',
+        ),
+    ] = None,
+    progress: Annotated[
+        str,
+        Option(
+            '--progress',
+            click_type=click.Choice(PROGRESS_MODES),
+            help='Progress display: a bar, JSON lines, or nothing. `auto` '
+            'shows a bar only on a terminal.',
+        ),
+    ] = 'auto',
+    metrics_json: Annotated[
+        Path,
+        Option(
+            '--metrics-json',
+            help='Write per-phase timings of every backup to a JSON file.',
+        ),
+    ] = None,
+    metrics_textfile: Annotated[
+        Path,
+        Option(
+            '--metrics-textfile',
+            help='Write per-phase timings of every backup to a Prometheus '
+            'textfile.',
+        ),
+    ] = None,
 ):
-    parallel_backups(sources, destinations)
+    if compression and dedup:
+        raise BadParameter('--compress cannot be used with --dedup.')
+    options = BackupOptions(
+        incremental=incremental,
+        checksum=checksum,
+        workers=workers,
+        copy_order=copy_order,
+        streaming=streaming,
+        includes=tuple(includes or ()),
+        excludes=tuple(excludes or ()),
+        device_workers=device_workers,
+        hash_algorithm=hash_algorithm,
+        resumable=resumable,
+        snapshot=snapshot,
+        keep_snapshots=keep_snapshots,
+        dedup=dedup,
+        sparse=sparse,
+        use_mmap=use_mmap,
+        delta=delta,
+        pack_threshold=pack_threshold,
+        compression=compression,
+        compression_workers=compression_workers,
+        bytes_per_second=bytes_per_second,
+        files_per_second=files_per_second,
+        global_bytes_per_second=global_bytes_per_second,
+        global_files_per_second=global_files_per_second,
+        control_file=control_file,
+        progress=progress,
+        metrics_json=metrics_json,
+        metrics_textfile=metrics_textfile,
+    )
+    from backup_juggler.files_manager import parallel_backups
+
+    parallel_backups(sources, destinations, fan_out=fan_out, options=options)
 
 
 @app.command(help='Calculate the total size of the specified source.')
@@ -85,6 +369,128 @@ def get_size(
             '-s',
             help='Source path(s) that will have their total sizes calculated.',
         ),
-    ]
+    ],
+    index: Annotated[
+        bool,
+        Option(
+            '--index',
+            help='Use the scan index to walk only the directories changed '
+            'since the last run.',
+        ),
+    ] = False,
+    includes: Annotated[
+        list[str],
+        Option(
+            '--include',
+            metavar='PATTERN',
+            help='Only count the files matching a glob pattern (e.g. '
+            "'*.py', 'src/**'). Can be repeated.",
+        ),
+    ] = None,
+    excludes: Annotated[
+        list[str],
+        Option(
+            '--exclude',
+            metavar='PATTERN',
+            help='Skip the files and directories matching a glob pattern '
+            "(e.g. '*.tmp', 'build/'), added to the .bjignore ones. Can be "
+            'repeated.',
+        ),
+    ] = None,
 ):
-    calculates_size(sources)
+    from backup_juggler.files_manager import calculates_size
+
+    calculates_size(
+        sources, use_index=index, includes=includes, excludes=excludes
+    )
+
+
+@app.command(help='Verify backups against their checksum manifests.')
+def verify(
+    backups: Annotated[
+        list[Path],
+        Option(
+            ...,
+            '--backup',
+            '-b',
+            help='Backup directory(s) to verify (destination/source).',
+        ),
+    ],
+    workers: Annotated[
+        int,
+        Option(
+            '--workers',
+            '-w',
+            min=1,
+            help='Number of files hashed at the same time.',
+        ),
+    ] = None,
+    changed_only: Annotated[
+        bool,
+        Option(
+            '--changed-only',
+            help='Skip files unchanged since their last verification.',
+        ),
+    ] = False,
+):
+    from backup_juggler.files_manager import verify_backups
+
+    if not verify_backups(backups, workers, changed_only):
+        raise Exit(code=1)
+
+
+@app.command(help='Restore backups, decompressing and unpacking their files.')
+def restore(
+    backups: Annotated[
+        list[Path],
+        Option(
+            ...,
+            '--backup',
+            '-b',
+            help='Backup directory(s) to restore (destination/source).',
+        ),
+    ],
+    target: Annotated[
+        Path,
+        Option(
+            ...,
+            '--target',
+            '-t',
+            help='Directory the backups are restored into.',
+        ),
+    ],
+    workers: Annotated[
+        int,
+        Option(
+            '--workers',
+            '-w',
+            min=1,
+            help='Number of processes decompressing blocks. One per CPU by '
+            'default.',
+        ),
+    ] = None,
+):
+    from backup_juggler.files_manager import restore_backups
+
+    restore_backups(backups, target, workers)
+
+
+@app.command(help='Forget the scan index of the specified source.')
+def invalidate_index(
+    sources: Annotated[
+        list[Path],
+        Option(
+            '--source',
+            '-s',
+            help='Source path(s) to forget. All sources if omitted.',
+        ),
+    ] = None,
+):
+    from backup_juggler.index_manager import ScanIndex
+
+    scan_index = ScanIndex()
+    if not sources:
+        scan_index.invalidate()
+    for source in sources or []:
+        scan_index.invalidate(source)
+    print_panel('Scan index invalidated', expand=False)
@@ -0,0 +1,286 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+PHASES = ['scan', 'mkdir', 'copy', 'metadata']
+WAITS = ['source', 'destination', 'tee_stall']
+LATENCY_BUCKETS = [0.001, 0.005, 0.025, 0.1, 0.5, 2.5, 10.0, 60.0]
+
+
+class BackupMetrics:
+    """
+    Timings of a backup job, collected while it runs.
+
+    Attributes:
+        _source: The source path of the job.
+        _destinations: The destination directories of the job.
+        _phases: The seconds spent in each phase (scan, mkdir, copy, metadata).
+        _waits: The seconds spent blocked on the source, on the destination, and
+            on full tee buffers.
+        _bucket_counts: The number of copied files per latency bucket.
+        _latency_sum: The total time spent copying files.
+        _files: The number of copied files.
+        _bytes: The number of copied bytes.
+        _started: The `time.perf_counter` time the job started.
+        _elapsed: The wall time of the job, once finished.
+        _lock: The lock protecting the counters.
+
+    Methods:
+        - phase: Time a block of code as part of a phase.
+        - add_phase: Add seconds to a phase.
+        - add_wait: Add seconds spent waiting.
+        - observe_file: Record the latency of a copied file.
+        - finish: Record the wall time of the job.
+        - to_dict: Get the metrics as a JSON serializable dictionary.
+
+    Notes:
+        - With several workers, the time of every worker is added up, so phases can
+          add up to more than the wall time of the job.
+        - Source and destination waits are only measured for copies done in userspace;
+          copies done inside the kernel count as `copy` time only.
+    """
+
+    def __init__(self, source: Path, destinations: list[Path]) -> None:
+        """
+        Initialize a `BackupMetrics` instance.
+
+        Args:
+            source: The source path of the job.
+            destinations: The destination directories of the job.
+        """
+
+        self._source: Path = source
+        self._destinations: list[Path] = destinations
+        self._phases: defaultdict[str, float] = defaultdict(float)
+        self._waits: defaultdict[str, float] = defaultdict(float)
+        self._bucket_counts: list[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._latency_sum: float = 0.0
+        self._files: int = 0
+        self._bytes: int = 0
+        self._started: float = time.perf_counter()
+        self._elapsed: float | None = None
+        self._lock: threading.Lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time a block of code as part of a phase.
+
+        Args:
+            name: One of the `PHASES`.
+
+        Examples:
+            >>> with metrics.phase('scan'):
+            ...     entries = list(scan_tree(source))
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        """
+        Add seconds to a phase.
+
+        Args:
+            name: One of the `PHASES`.
+            seconds: The time spent in the phase.
+        """
+
+        with self._lock:
+            self._phases[name] += seconds
+
+    def add_wait(self, name: str, seconds: float) -> None:
+        """
+        Add seconds spent waiting.
+
+        Args:
+            name: One of the `WAITS`.
+            seconds: The time spent waiting.
+        """
+
+        with self._lock:
+            self._waits[name] += seconds
+
+    def observe_file(self, seconds: float, size: int) -> None:
+        """
+        Record the latency of a copied file.
+
+        Args:
+            seconds: The time from the start of the copy to the restored metadata.
+            size: The size of the file in bytes.
+        """
+
+        bucket = len(LATENCY_BUCKETS)
+        for index, upper_bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= upper_bound:
+                bucket = index
+                break
+        with self._lock:
+            self._bucket_counts[bucket] += 1
+            self._latency_sum += seconds
+            self._files += 1
+            self._bytes += size
+
+    def finish(self) -> None:
+        """
+        Record the wall time of the job.
+        """
+
+        self._elapsed = time.perf_counter() - self._started
+
+    def to_dict(self) -> dict:
+        """
+        Get the metrics as a JSON serializable dictionary.
+
+        Returns:
+            The source, destinations, wall time, files and bytes copied, seconds per
+            phase and per wait, and the cumulative file latency histogram.
+        """
+
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for upper_bound, count in zip(
+                [*map(str, LATENCY_BUCKETS), '+Inf'], self._bucket_counts
+            ):
+                cumulative += count
+                buckets[upper_bound] = cumulative
+            return {
+                'source': os.fspath(self._source),
+                'destinations': [os.fspath(d) for d in self._destinations],
+                'seconds': self._elapsed,
+                'files': self._files,
+                'bytes': self._bytes,
+                'phases': {name: self._phases[name] for name in PHASES},
+                'waits': {name: self._waits[name] for name in WAITS},
+                'file_latency': {
+                    'buckets': buckets,
+                    'sum': self._latency_sum,
+                    'count': self._files,
+                },
+            }
+
+
+def write_json(jobs: list[BackupMetrics], path: Path) -> None:
+    """
+    Write the metrics of backup jobs to a JSON file.
+
+    Args:
+        jobs: The metrics of the jobs.
+        path: The path of the JSON file.
+    """
+
+    _write_atomically(
+        path, json.dumps({'jobs': [job.to_dict() for job in jobs]}, indent=2)
+    )
+
+
+def write_prometheus(jobs: list[BackupMetrics], path: Path) -> None:
+    """
+    Write the metrics of backup jobs to a Prometheus textfile.
+
+    Args:
+        jobs: The metrics of the jobs.
+        path: The path of the textfile, usually in the directory read by the
+            textfile collector of the node exporter.
+
+    Every metric is labelled with the `source` and `destination` of its job.
+    """
+
+    families = {
+        'bj_backup_duration_seconds': ('gauge', 'Wall time of the backup.'),
+        'bj_backup_files_total': ('counter', 'Files copied.'),
+        'bj_backup_bytes_total': ('counter', 'Bytes copied.'),
+        'bj_backup_phase_seconds_total': (
+            'counter',
+            'Time spent in each phase, summed over workers.',
+        ),
+        'bj_backup_wait_seconds_total': (
+            'counter',
+            'Time spent blocked on the source, the destination or the tee.',
+        ),
+        'bj_backup_file_latency_seconds': (
+            'histogram',
+            'Time to copy a file, including its metadata.',
+        ),
+    }
+    samples = {name: [] for name in families}
+    for job in jobs:
+        metrics = job.to_dict()
+        labels = {
+            'source': metrics['source'],
+            'destination': ','.join(metrics['destinations']),
+        }
+        samples['bj_backup_duration_seconds'].append(
+            ('', labels, metrics['seconds'] or 0.0)
+        )
+        samples['bj_backup_files_total'].append(('', labels, metrics['files']))
+        samples['bj_backup_bytes_total'].append(('', labels, metrics['bytes']))
+        for name, seconds in metrics['phases'].items():
+            samples['bj_backup_phase_seconds_total'].append(
+                ('', {**labels, 'phase': name}, seconds)
+            )
+        for name, seconds in metrics['waits'].items():
+            samples['bj_backup_wait_seconds_total'].append(
+                ('', {**labels, 'wait': name}, seconds)
+            )
+        latency = metrics['file_latency']
+        for upper_bound, count in latency['buckets'].items():
+            samples['bj_backup_file_latency_seconds'].append(
+                ('_bucket', {**labels, 'le': upper_bound}, count)
+            )
+        samples['bj_backup_file_latency_seconds'].append(
+            ('_sum', labels, latency['sum'])
+        )
+        samples['bj_backup_file_latency_seconds'].append(
+            ('_count', labels, latency['count'])
+        )
+
+    lines = []
+    for name, (kind, description) in families.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for suffix, labels, value in samples[name]:
+            label_text = ','.join(
+                f'{key}="{_escape_label(label)}"'
+                for key, label in labels.items()
+            )
+            lines.append(f'{name}{suffix}{{{label_text}}} {value}')
+    _write_atomically(path, '\n'.join(lines) + '\n')
+
+
+def _escape_label(value: str) -> str:
+    """
+    Escape a Prometheus label value.
+
+    Args:
+        value: The label value.
+
+    Returns:
+        The value with backslashes, double quotes and newlines escaped.
+    """
+
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomically(path: Path, text: str) -> None:
+    """
+    Write a file through a temporary file renamed into place.
+
+    Args:
+        path: The path of the file.
+        text: The contents of the file.
+
+    Collectors reading the file never see it half written.
+    """
+
+    temporary_path = path.with_name(f'{path.name}.tmp')
+    temporary_path.write_text(text)
+    os.replace(temporary_path, path)
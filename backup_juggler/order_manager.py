@@ -0,0 +1,65 @@
+import os
+from typing import Iterable
+
+from backup_juggler.backup_options import COPY_ORDERS
+from backup_juggler.copy_engine import physical_offset
+from backup_juggler.scan_manager import Entry
+
+
+def extent_key(src_root: str, entry: Entry) -> tuple[int, int]:
+    """
+    Get the sort key placing a file by where its data is stored.
+
+    Args:
+        src_root: The directory the relative path of the entry starts from.
+        entry: The scanned `Entry` of the file.
+
+    Returns:
+        The physical position of the first extent of the file, or after every located
+        file, by inode number, when it cannot be found (see `copy_engine.physical_offset`).
+    """
+
+    try:
+        fd = os.open(os.path.join(src_root, entry.relative_path), os.O_RDONLY)
+    except OSError:
+        return 1, entry.inode
+    try:
+        offset = physical_offset(fd)
+    finally:
+        os.close(fd)
+    return (1, entry.inode) if offset is None else (0, offset)
+
+
+def order_entries(
+    entries: Iterable[Entry], order: str, src_root: str
+) -> list[Entry]:
+    """
+    Order the files of a source for copying.
+
+    Args:
+        entries: The scanned entries of the source.
+        order: One of the `COPY_ORDERS`.
+        src_root: The directory the relative paths of the entries start from.
+
+    Returns:
+        The entries in the order they are copied.
+
+    The `scan` order keeps the order of the scan. `inode` sorts the files by inode
+    number, which most filesystems allocate close to the data, and `extent` by the
+    physical position of their first extent, so a spinning disk reads them in one sweep.
+    `largest` and `smallest` sort them by size, to start the long copies first and
+    balance the workers, or to get as many files done as early as possible.
+
+    Examples:
+        >>> order_entries(paths.entries, 'largest', '/path/to')
+    """
+
+    if order == 'inode':
+        return sorted(entries, key=lambda entry: entry.inode)
+    if order == 'extent':
+        return sorted(entries, key=lambda entry: extent_key(src_root, entry))
+    if order == 'largest':
+        return sorted(entries, key=lambda entry: entry.size, reverse=True)
+    if order == 'smallest':
+        return sorted(entries, key=lambda entry: entry.size)
+    return list(entries)
@@ -0,0 +1,249 @@
+import json
+import os
+import tarfile
+import threading
+from pathlib import Path
+from typing import BinaryIO
+
+from backup_juggler.scan_manager import Entry
+
+PACK_DIRECTORY = '.bj-packs'
+PACK_INDEX = 'index.json'
+PACK_SEGMENT_SIZE = 256 * 1024 * 1024
+
+
+class PackStore:
+    """
+    Tar segments holding the small files of a backup directory.
+
+    Attributes:
+        _root: The directory of the segments, `.bj-packs` inside the backup directory.
+        _segment_size: The size after which a new segment is started.
+        _files: The packed files, by relative path, with the segment and offset of
+            their data, their size, times and mode.
+        _segment: The segment being written, if any.
+        _segment_name: The name of the segment being written.
+        _offset: The size of the segment being written.
+        _lock: The lock serializing the writes when copying with several workers.
+
+    Methods:
+        - files: Get the packed files.
+        - is_unchanged: Check if a packed file is up to date.
+        - read: Read the contents of a packed file.
+        - add: Append a file to the current segment.
+        - discard: Forget a file that is no longer packed.
+        - save: Close the current segment and write the index to disk.
+        - _close_segment: Terminate and close the current segment.
+
+    Notes:
+        - Segments are plain tar archives (`segment-<number>.tar`) that `tar` can list and
+          extract, and the side index (`index.json`) gives the offset of the data of every
+          file, so a single file is read back with one seek.
+        - Files packed again by a later run are appended to new segments, and the segments
+          no longer referenced by the index are deleted when it is saved.
+    """
+
+    def __init__(
+        self, backup_dir: str | Path, segment_size: int = PACK_SEGMENT_SIZE
+    ) -> None:
+        """
+        Initialize a `PackStore` instance, loading the existing index if any.
+
+        Args:
+            backup_dir: The directory a source was copied into.
+            segment_size: The size after which a new segment is started.
+        """
+
+        self._root: Path = Path(backup_dir) / PACK_DIRECTORY
+        self._segment_size: int = segment_size
+        try:
+            with open(self._root / PACK_INDEX) as file:
+                self._files: dict[str, dict] = json.load(file)['files']
+        except FileNotFoundError:
+            self._files = {}
+        self._segment: BinaryIO | None = None
+        self._segment_name: str = ''
+        self._offset: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def files(self) -> dict[str, dict]:
+        """
+        Get the packed files.
+
+        Returns:
+            _files: The packed files, by relative path.
+        """
+
+        return self._files
+
+    def is_unchanged(self, entry: Entry) -> bool:
+        """
+        Check if a packed file has the same size and modification time as the source.
+
+        Args:
+            entry: The scanned `Entry` of the source file.
+
+        Returns:
+            `True` if the file is packed with the size and modification time of `entry`.
+        """
+
+        with self._lock:
+            record = self._files.get(entry.relative_path)
+        return (
+            record is not None
+            and record['size'] == entry.size
+            and record['mtime_ns'] == entry.mtime_ns
+        )
+
+    def read(self, relative_path: str) -> bytes:
+        """
+        Read the contents of a packed file.
+
+        Args:
+            relative_path: The path of the file relative to the backup directory.
+
+        Returns:
+            The contents of the file.
+
+        Raises:
+            KeyError: If the file is not packed.
+        """
+
+        with self._lock:
+            record = self._files[relative_path]
+            if record['segment'] == self._segment_name:
+                self._segment.flush()
+        with open(self._root / record['segment'], 'rb') as segment:
+            segment.seek(record['offset'])
+            return segment.read(record['size'])
+
+    def add(self, entry: Entry, data: bytes) -> None:
+        """
+        Append a file to the current segment, starting a new one when it is full.
+
+        Args:
+            entry: The scanned `Entry` of the source file.
+            data: The contents of the file.
+        """
+
+        info = tarfile.TarInfo(entry.relative_path)
+        info.size = len(data)
+        info.mtime = entry.mtime_ns / 1e9
+        info.mode = entry.mode & 0o7777
+        header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        padding = -len(data) % tarfile.BLOCKSIZE
+        with self._lock:
+            if (
+                self._segment is not None
+                and self._offset >= self._segment_size
+            ):
+                self._close_segment()
+            if self._segment is None:
+                self._root.mkdir(exist_ok=True)
+                numbers = [
+                    int(name[8:-4])
+                    for name in os.listdir(self._root)
+                    if name.startswith('segment-') and name.endswith('.tar')
+                ]
+                self._segment_name = (
+                    f'segment-{max(numbers, default=0) + 1:06d}.tar'
+                )
+                self._segment = open(self._root / self._segment_name, 'wb')
+                self._offset = 0
+            self._segment.write(header)
+            self._segment.write(data)
+            self._segment.write(bytes(padding))
+            self._files[entry.relative_path] = {
+                'segment': self._segment_name,
+                'offset': self._offset + len(header),
+                'size': len(data),
+                'mtime_ns': entry.mtime_ns,
+                'atime_ns': entry.atime_ns,
+                'mode': entry.mode,
+            }
+            self._offset += len(header) + len(data) + padding
+
+    def discard(self, relative_path: str) -> None:
+        """
+        Forget a file that is no longer packed, such as a file that grew past the
+        packing threshold and is now copied on its own.
+
+        Args:
+            relative_path: The path of the file relative to the backup directory.
+        """
+
+        with self._lock:
+            self._files.pop(relative_path, None)
+
+    def _close_segment(self) -> None:
+        """
+        Write the end-of-archive marker of the current segment and close it.
+        """
+
+        self._segment.write(bytes(2 * tarfile.BLOCKSIZE))
+        self._segment.close()
+        self._segment = None
+        self._segment_name = ''
+
+    def save(self) -> None:
+        """
+        Close the current segment, write the index and delete unreferenced segments.
+        """
+
+        with self._lock:
+            if self._segment is not None:
+                self._close_segment()
+            if not self._root.exists():
+                return
+            temporary_path = self._root / f'.{PACK_INDEX}.tmp'
+            with open(temporary_path, 'w') as file:
+                json.dump({'files': self._files}, file)
+            os.replace(temporary_path, self._root / PACK_INDEX)
+            referenced = {record['segment'] for record in self._files.values()}
+            for name in os.listdir(self._root):
+                if name.endswith('.tar') and name not in referenced:
+                    os.remove(self._root / name)
+
+
+def restore_packed(backup_dir: str | Path, target_dir: str | Path) -> int:
+    """
+    Extract the packed files of a backup directory.
+
+    Args:
+        backup_dir: The directory a source was copied into.
+        target_dir: The directory the files are restored into.
+
+    Returns:
+        The number of restored files.
+
+    The files are extracted in the order of the segments, each one opened once and read
+    sequentially, and get the times and mode they had in the source.
+    """
+
+    store = PackStore(backup_dir)
+    records = sorted(
+        store.files.items(),
+        key=lambda item: (item[1]['segment'], item[1]['offset']),
+    )
+    segment, segment_name = None, None
+    try:
+        for relative_path, record in records:
+            if record['segment'] != segment_name:
+                if segment is not None:
+                    segment.close()
+                segment_name = record['segment']
+                segment = open(
+                    Path(backup_dir, PACK_DIRECTORY, segment_name), 'rb'
+                )
+            segment.seek(record['offset'])
+            dst_file = os.path.join(target_dir, relative_path)
+            os.makedirs(os.path.dirname(dst_file), exist_ok=True)
+            with open(dst_file, 'wb') as dst:
+                dst.write(segment.read(record['size']))
+            os.utime(dst_file, ns=(record['atime_ns'], record['mtime_ns']))
+            os.chmod(dst_file, record['mode'])
+    finally:
+        if segment is not None:
+            segment.close()
+    return len(records)
@@ -1,4 +1,10 @@
+import time
 from pathlib import Path
+from typing import Iterator
+
+from backup_juggler.filter_manager import PathFilter
+from backup_juggler.metrics_manager import BackupMetrics
+from backup_juggler.scan_manager import Entry, scan_tree
 
 
 class Paths:
@@ -7,37 +13,94 @@ class Paths:
 
     Attributes:
         _source: The source directory or file path.
-        _destination: The destination directory.
-        _total_size: The total size of the files to be copied.
+        _destinations: The destination directories.
+        _entries: The files to be copied, as scanned from the source. Empty in
+            streaming mode.
+        _total_size: The total size of the files to be copied, or scanned so far in
+            streaming mode.
+        _metrics: The `BackupMetrics` the scan time is added to, if any.
+        _streaming: Whether the source is scanned while its files are copied.
+        _path_filter: The `PathFilter` selecting the files, if any.
+        _scanning: Whether the scan is still running.
 
     Methods:
         - source: Get the source path.
-        - destination: Get the destination directory.
+        - destination: Get the first destination directory.
+        - destinations: Get all the destination directories.
+        - entries: Get the scanned files to be copied.
+        - iter_entries: Iterate over the files to be copied, scanning them if streaming.
         - total_size: Get the total size of the files to be copied.
+        - scanning: Check if the source is still being scanned.
+        - _scan: Scan the source, counting the size and time of the scan.
 
     Notes:
         - The total size calculation includes subdirectories and files within the source directory.
-        - The total size is calculated only once during the initialization of the `Paths` instance.
+        - The source is scanned only once, during the initialization of the `Paths` instance,
+          and the same entries are used for sizing and copying.
+        - In streaming mode, the source is only scanned while `iter_entries` is consumed,
+          no entry is kept, and the total size grows as the scan goes.
     """
 
-    def __init__(self, source: Path, destination: Path = None) -> None:
+    def __init__(
+        self,
+        source: Path,
+        destination: Path | list[Path] = None,
+        metrics: BackupMetrics = None,
+        streaming: bool = False,
+        path_filter: PathFilter = None,
+    ) -> None:
         """
         Initialize a `Paths` instance.
 
         Args:
             source: The source directory or file path.
-            destination: The destination directory. Defaults to `None`.
+            destination: The destination directory, or a list of destination
+                directories that will all receive the same source (fan-out).
+                Defaults to `None`.
+            metrics: The `BackupMetrics` the scan time is added to. Defaults to `None`.
+            streaming: If `True`, the source is scanned by `iter_entries` instead of
+                here. Defaults to `False`.
+            path_filter: The `PathFilter` selecting the files. Defaults to `None`,
+                which selects every file.
         """
 
         self._source: Path = source
-        self._destination: Path = destination
-        if self.source.is_file():
-            self._total_size: int = self.source.stat().st_size
+        if destination is None:
+            self._destinations: list[Path] = []
+        elif isinstance(destination, Path):
+            self._destinations: list[Path] = [destination]
         else:
-            self._total_size: int = sum(
-                src_file.stat().st_size
-                for src_file in self.source.rglob('*.*')
-            )
+            self._destinations: list[Path] = list(destination)
+        self._metrics: BackupMetrics | None = metrics
+        self._streaming: bool = streaming
+        self._path_filter: PathFilter | None = path_filter
+        self._scanning: bool = True
+        self._total_size: int = 0
+        self._entries: list[Entry] = [] if streaming else list(self._scan())
+
+    def _scan(self) -> Iterator[Entry]:
+        """
+        Scan the source, adding up the size of its files and the time of the scan.
+
+        Yields:
+            The entries of the files, as found by `scan_manager.scan_tree`.
+        """
+
+        entries = scan_tree(self._source, self._path_filter)
+        scan_time = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                entry = next(entries, None)
+                scan_time += time.perf_counter() - start
+                if entry is None:
+                    break
+                self._total_size += entry.size
+                yield entry
+        finally:
+            self._scanning = False
+            if self._metrics is not None:
+                self._metrics.add_phase('scan', scan_time)
 
     @property
     def source(self) -> Path:
@@ -53,13 +116,46 @@ class Paths:
     @property
     def destination(self) -> Path:
         """
-        Get the destination directory.
+        Get the first destination directory.
+
+        Returns:
+            The first destination directory, or `None` if there is none.
+        """
+
+        return self._destinations[0] if self._destinations else None
+
+    @property
+    def destinations(self) -> list[Path]:
+        """
+        Get all the destination directories.
+
+        Returns:
+            _destinations: The destination directories.
+        """
+
+        return self._destinations
+
+    @property
+    def entries(self) -> list[Entry]:
+        """
+        Get the scanned files to be copied.
+
+        Returns:
+            _entries: The entries of the files, relative to the source directory.
+        """
+
+        return self._entries
+
+    def iter_entries(self) -> Iterator[Entry]:
+        """
+        Iterate over the files to be copied.
 
         Returns:
-            _destination: The destination directory.
+            An iterator over the scanned entries, or in streaming mode, an iterator
+            scanning the source as it is consumed, which can only be consumed once.
         """
 
-        return self._destination
+        return self._scan() if self._streaming else iter(self._entries)
 
     @property
     def total_size(self) -> int:
@@ -71,3 +167,14 @@ class Paths:
         """
 
         return self._total_size
+
+    @property
+    def scanning(self) -> bool:
+        """
+        Check if the source is still being scanned.
+
+        Returns:
+            _scanning: `True` until the scan is complete.
+        """
+
+        return self._scanning
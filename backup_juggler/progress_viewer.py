@@ -1,23 +1,33 @@
-from typing import Any
-
-from tqdm import tqdm
+import json
+import sys
+import threading
+import time
+from typing import Any, TextIO
 
 from backup_juggler.paths_manager import Paths
 
+PROGRESS_MODES = ['auto', 'bar', 'json', 'quiet']
+REFRESH_INTERVAL = 0.5
+
 
 class ProgressViewer:
     """
     View class for the Backup Juggler application.
 
     Attributes:
-        _pbar: The progress bar instance.
+        _paths: The `Paths` instance of the backup.
+        _counts: The number of bytes copied by each thread, keyed by thread id.
 
     Methods:
-        - _update: Update the progress bar with the given chunk size.
+        - _update: Add the given chunk size to the bytes copied.
+        - done: Get the number of bytes copied so far.
+        - total: Get the number of bytes to copy.
+        - description: Get the description of the backup.
 
     Notes:
-        - The progress bar is created using the `tqdm` library.
-        - The progress bar updates are performed in the `_update` method.
+        - Every thread only ever writes its own counter, so updates take no lock and
+          cost a dictionary lookup. The counters are summed by the `ProgressReporter`
+          the viewer is registered to, which does all the rendering.
     """
 
     def __init__(self, paths: Paths) -> None:
@@ -28,19 +38,210 @@ class ProgressViewer:
             paths: The `Paths` instance.
         """
 
-        self._pbar: Any = tqdm(
-            total=paths.total_size,
-            unit='B',
-            unit_scale=True,
-            desc=f'Copying {paths.source.name} to {paths.destination.name}',
-        )
+        self._paths: Paths = paths
+        self._counts: dict[int, int] = {}
 
     def _update(self, chunk_size: int) -> None:
         """
-        Update the progress bar with the given chunk size.
+        Add the given chunk size to the bytes copied.
 
         Args:
             chunk_size: The size of the chunk to update the progress.
         """
 
-        self._pbar.update(chunk_size)
+        ident = threading.get_ident()
+        self._counts[ident] = self._counts.get(ident, 0) + chunk_size
+
+    @property
+    def done(self) -> int:
+        """
+        Get the number of bytes copied so far.
+
+        Returns:
+            The sum of the counters of every thread.
+        """
+
+        return sum(list(self._counts.values()))
+
+    @property
+    def total(self) -> int:
+        """
+        Get the number of bytes to copy.
+
+        Returns:
+            The total size of the scanned source.
+        """
+
+        return self._paths.total_size
+
+    @property
+    def description(self) -> str:
+        """
+        Get the description of the backup.
+
+        Returns:
+            The source name and the destination names, and whether the source is still
+            being scanned.
+        """
+
+        description = f'Copying {self._paths.source.name} to ' + ', '.join(
+            dst.name for dst in self._paths.destinations
+        )
+        if self._paths.scanning:
+            description += ' (scanning)'
+        return description
+
+
+class ProgressReporter:
+    """
+    Thread rendering the combined progress of every registered backup.
+
+    Attributes:
+        _mode: `bar` for a `tqdm` progress bar, `json` for JSON lines, or `quiet`.
+        _interval: The number of seconds between two renders.
+        _stream: The stream the progress is written to.
+        _viewers: The registered `ProgressViewer` instances.
+        _pbar: The progress bar, in `bar` mode.
+        _started: The `time.monotonic` time the reporter started.
+        _stop: The event stopping the thread.
+        _thread: The rendering thread.
+
+    Methods:
+        - register: Add the progress of a backup to the combined view.
+        - start: Start rendering.
+        - stop: Render a last time and stop.
+        - _run: Render every `_interval` seconds until stopped.
+        - _render: Render the combined progress once.
+
+    Notes:
+        - In `auto` mode, the progress bar is shown only when the stream is a terminal,
+          so cron runs do not spend any time on it.
+        - The reporter is a context manager, started on enter and stopped on exit.
+    """
+
+    def __init__(
+        self,
+        mode: str = 'auto',
+        interval: float = REFRESH_INTERVAL,
+        stream: TextIO = None,
+    ) -> None:
+        """
+        Initialize a `ProgressReporter` instance.
+
+        Args:
+            mode: One of the `PROGRESS_MODES`. Defaults to `auto`.
+            interval: The number of seconds between two renders.
+            stream: The stream the progress is written to. Defaults to `sys.stderr`.
+        """
+
+        self._stream: TextIO = stream or sys.stderr
+        if mode == 'auto':
+            mode = 'bar' if self._stream.isatty() else 'quiet'
+        self._mode: str = mode
+        self._interval: float = interval
+        self._viewers: list[ProgressViewer] = []
+        self._pbar: Any = None
+        self._started: float = time.monotonic()
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread = threading.Thread(
+            target=self._run, daemon=True
+        )
+
+    def __enter__(self) -> 'ProgressReporter':
+        """
+        Start rendering.
+        """
+
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """
+        Render the final progress and stop rendering.
+        """
+
+        self.stop()
+
+    def register(self, viewer: ProgressViewer) -> None:
+        """
+        Add the progress of a backup to the combined view.
+
+        Args:
+            viewer: The `ProgressViewer` of the backup.
+        """
+
+        self._viewers.append(viewer)
+
+    def start(self) -> None:
+        """
+        Start rendering, unless the reporter is quiet.
+        """
+
+        if self._mode == 'bar':
+            from tqdm import tqdm
+
+            self._pbar = tqdm(
+                total=0, unit='B', unit_scale=True, file=self._stream
+            )
+        if self._mode != 'quiet':
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Render the final progress and stop rendering.
+        """
+
+        if self._mode == 'quiet':
+            return
+        self._stop.set()
+        self._thread.join()
+        self._render()
+        if self._pbar is not None:
+            self._pbar.close()
+
+    def _run(self) -> None:
+        """
+        Render the combined progress every `_interval` seconds until stopped.
+        """
+
+        while not self._stop.wait(self._interval):
+            self._render()
+
+    def _render(self) -> None:
+        """
+        Render the combined progress once.
+        """
+
+        viewers = list(self._viewers)
+        jobs = [(viewer, viewer.done, viewer.total) for viewer in viewers]
+        done = sum(job_done for _, job_done, _ in jobs)
+        total = sum(job_total for _, _, job_total in jobs)
+        if self._mode == 'bar':
+            if len(jobs) == 1:
+                description = jobs[0][0].description
+            else:
+                description = f'Copying {len(jobs)} backups'
+            self._pbar.set_description(description, refresh=False)
+            self._pbar.total = total
+            self._pbar.n = done
+            self._pbar.refresh()
+            return
+        line = {
+            'elapsed': round(time.monotonic() - self._started, 3),
+            'done': done,
+            'total': total,
+            'jobs': [
+                {
+                    'source': str(viewer._paths.source),
+                    'destinations': [
+                        str(dst) for dst in viewer._paths.destinations
+                    ],
+                    'done': job_done,
+                    'total': job_total,
+                    'scanning': viewer._paths.scanning,
+                }
+                for viewer, job_done, job_total in jobs
+            ],
+        }
+        self._stream.write(json.dumps(line) + '\n')
+        self._stream.flush()
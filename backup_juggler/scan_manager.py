@@ -0,0 +1,120 @@
+import os
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+from backup_juggler.filter_manager import PathFilter
+
+
+class Entry(NamedTuple):
+    """
+    A file found while scanning a source.
+
+    Attributes:
+        relative_path: The path of the file relative to the scanned directory.
+        size: The size of the file in bytes.
+        mtime_ns: The modification time of the file in nanoseconds.
+        atime_ns: The access time of the file in nanoseconds.
+        mode: The mode (type and permission bits) of the file.
+        inode: The inode number of the file.
+    """
+
+    relative_path: str
+    size: int
+    mtime_ns: int
+    atime_ns: int
+    mode: int
+    inode: int = 0
+
+    @classmethod
+    def from_stat(cls, relative_path: str, stat: os.stat_result) -> 'Entry':
+        """
+        Build an `Entry` from a `stat` result.
+
+        Args:
+            relative_path: The path of the file relative to the scanned directory.
+            stat: The `stat` result of the file.
+
+        Returns:
+            The new `Entry`.
+        """
+
+        return cls(
+            relative_path,
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_atime_ns,
+            stat.st_mode,
+            stat.st_ino,
+        )
+
+
+def scan_tree(
+    source: Path, path_filter: PathFilter | None = None
+) -> Iterator[Entry]:
+    """
+    Walk a source once and yield an `Entry` for every file to be copied.
+
+    Args:
+        source: The source directory or file path.
+        path_filter: The `PathFilter` selecting the files. Defaults to every file.
+
+    Yields:
+        The entries of the files, in the order they are found. A file source yields
+        a single entry whose relative path is the file name.
+
+    The walk uses `os.scandir` with an explicit stack, so every directory is listed
+    once and every file is stat'ed once, whatever the depth of the tree. Excluded
+    directories are pruned without being listed, and symbolic links to directories
+    are not followed. A file source is yielded whatever the filter.
+    """
+
+    if source.is_file():
+        yield Entry.from_stat(source.name, source.stat())
+        return
+
+    pending: list[tuple[str, str]] = [(os.fspath(source), '')]
+    while pending:
+        directory, prefix = pending.pop()
+        files, subdirectories = list_directory(directory, path_filter, prefix)
+        for subdirectory in subdirectories:
+            pending.append(
+                (subdirectory.path, f'{prefix}{subdirectory.name}/')
+            )
+        for file in files:
+            yield Entry.from_stat(f'{prefix}{file.name}', file.stat())
+
+
+def list_directory(
+    directory: str,
+    path_filter: PathFilter | None = None,
+    prefix: str = '',
+) -> tuple[list[os.DirEntry], list[os.DirEntry]]:
+    """
+    List the files to be copied and the subdirectories to be walked in a directory.
+
+    Args:
+        directory: The path of the directory.
+        path_filter: The `PathFilter` selecting the files. Defaults to every file.
+        prefix: The path of the directory relative to the source, ending with `/`
+            unless it is the source itself.
+
+    Returns:
+        The files selected by the filter, and the subdirectories that are neither
+        symbolic links nor excluded.
+    """
+
+    files: list[os.DirEntry] = []
+    subdirectories: list[os.DirEntry] = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if path_filter is None or not path_filter.prunes(
+                    f'{prefix}{entry.name}'
+                ):
+                    subdirectories.append(entry)
+            elif entry.is_file() and (
+                path_filter is None
+                or path_filter.selects(f'{prefix}{entry.name}')
+            ):
+                files.append(entry)
+    return files, subdirectories
@@ -0,0 +1,176 @@
+import os
+from collections import Counter
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from pathlib import Path
+from typing import Any, Callable
+
+SPINDLE_DEVICE_JOBS = 1
+FLASH_DEVICE_JOBS = 8
+
+
+def device_of(path: Path) -> int:
+    """
+    Get the device a path is stored on.
+
+    Args:
+        path: The path, which may not exist yet.
+
+    Returns:
+        The `st_dev` of the path, or of its closest existing parent.
+    """
+
+    path = Path(os.path.abspath(path))
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return os.stat(path).st_dev
+
+
+def is_rotational(device: int) -> bool:
+    """
+    Check if a device is a spinning disk.
+
+    Args:
+        device: The `st_dev` of the device.
+
+    Returns:
+        `True` if the kernel reports the block device, or the disk a partition belongs
+        to, as rotational. Devices without such information, such as network or memory
+        filesystems, are not.
+    """
+
+    block = os.path.realpath(
+        f'/sys/dev/block/{os.major(device)}:{os.minor(device)}'
+    )
+    for queue in (block, os.path.dirname(block)):
+        try:
+            with open(os.path.join(queue, 'queue', 'rotational')) as file:
+                return file.read().strip() == '1'
+        except OSError:
+            continue
+    return False
+
+
+def device_limit(device: int) -> int:
+    """
+    Get the number of backups allowed to use a device at the same time.
+
+    Args:
+        device: The `st_dev` of the device.
+
+    Returns:
+        `SPINDLE_DEVICE_JOBS` for spinning disks, whose throughput collapses when
+        several backups make them seek, otherwise `FLASH_DEVICE_JOBS`.
+    """
+
+    return SPINDLE_DEVICE_JOBS if is_rotational(device) else FLASH_DEVICE_JOBS
+
+
+class JobScheduler:
+    """
+    Scheduler running backups in parallel within the limits of their devices.
+
+    Attributes:
+        _limits: The number of backups allowed at the same time, by device.
+        _device_limit: The function giving the limit of a device not in `_limits`.
+
+    Methods:
+        - run: Run jobs, each one once the devices it uses have room for it.
+        - _limit: Get the limit of a device.
+
+    Notes:
+        - Every job holds a slot on each distinct device it reads or writes, so backups
+          sharing a spinning disk run one after another, while backups on flash devices
+          run side by side.
+        - Jobs are started as soon as all their devices have a free slot, the ones using
+          the busiest devices first, so every device is kept busy while jobs remain.
+    """
+
+    def __init__(
+        self,
+        limits: dict[int, int] = None,
+        device_limit: Callable[[int], int] = device_limit,
+    ) -> None:
+        """
+        Initialize a `JobScheduler` instance.
+
+        Args:
+            limits: The number of backups allowed at the same time, by device. Defaults
+                to an empty dictionary.
+            device_limit: The function giving the limit of the other devices. Defaults
+                to `device_limit`.
+        """
+
+        self._limits: dict[int, int] = dict(limits or {})
+        self._device_limit: Callable[[int], int] = device_limit
+
+    def _limit(self, device: int) -> int:
+        """
+        Get the number of backups allowed to use a device at the same time.
+
+        Args:
+            device: The `st_dev` of the device.
+
+        Returns:
+            The limit of the device, looked up once.
+        """
+
+        if device not in self._limits:
+            self._limits[device] = max(1, self._device_limit(device))
+        return self._limits[device]
+
+    def run(
+        self, jobs: list[tuple[Callable[[], Any], list[Path]]]
+    ) -> list[Any]:
+        """
+        Run jobs, each one once the devices it uses have room for it.
+
+        Args:
+            jobs: The jobs, as a function to call and the paths it reads or writes.
+
+        Returns:
+            The results of the jobs, in the order they completed.
+
+        Raises:
+            Exception: The first error raised by a job, once the running jobs
+                completed. No job is started after an error.
+        """
+
+        pending = [
+            (function, {device_of(path) for path in paths})
+            for function, paths in jobs
+        ]
+        demand = Counter(
+            device for _, devices in pending for device in devices
+        )
+        pending.sort(key=lambda job: -max(demand[device] for device in job[1]))
+        busy: Counter = Counter()
+        running: dict[Future, set[int]] = {}
+        results = []
+        error = None
+        with ThreadPoolExecutor(max(len(pending), 1)) as executor:
+            while running or (pending and error is None):
+                if error is None:
+                    for job in list(pending):
+                        function, devices = job
+                        if all(
+                            busy[device] < self._limit(device)
+                            for device in devices
+                        ):
+                            pending.remove(job)
+                            busy.update(devices)
+                            running[executor.submit(function)] = devices
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    busy.subtract(running.pop(future))
+                    try:
+                        results.append(future.result())
+                    except Exception as exception:
+                        error = error or exception
+        if error is not None:
+            raise error
+        return results
@@ -0,0 +1,209 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from stat import S_IWUSR
+from typing import Any, Callable
+
+from backup_juggler.checksum_manager import manifest_path
+
+SNAPSHOT_FORMAT = '%Y-%m-%dT%H-%M-%S.%fZ'
+STALE_SUFFIXES = ('.bj-partial', '.bj-pruning')
+
+
+def snapshot_name(now: datetime = None) -> str:
+    """
+    Get the name of a new snapshot.
+
+    Args:
+        now: The time of the snapshot. Defaults to the current UTC time.
+
+    Returns:
+        The time formatted with `SNAPSHOT_FORMAT`, so that names sort by age.
+
+    Examples:
+        >>> snapshot_name(datetime(2024, 5, 1, 3, 0, tzinfo=timezone.utc))
+        '2024-05-01T03-00-00.000000Z'
+    """
+
+    return (now or datetime.now(timezone.utc)).strftime(SNAPSHOT_FORMAT)
+
+
+def list_snapshots(directory: str | Path) -> list[Path]:
+    """
+    List the complete snapshots of a source.
+
+    Args:
+        directory: The directory holding the snapshots (`destination/<source.stem>`).
+
+    Returns:
+        The snapshot directories, oldest first. Snapshots still being written or
+        pruned are hidden and not listed.
+    """
+
+    snapshots = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        try:
+            datetime.strptime(name, SNAPSHOT_FORMAT)
+        except ValueError:
+            continue
+        if os.path.isdir(os.path.join(directory, name)):
+            snapshots.append(Path(directory, name))
+    return sorted(snapshots)
+
+
+def list_stale_snapshots(directory: str | Path) -> list[Path]:
+    """
+    List the hidden snapshots left behind by interrupted runs and prunings.
+
+    Args:
+        directory: The directory holding the snapshots (`destination/<source.stem>`).
+
+    Returns:
+        The `.<name>.bj-partial` directories of snapshots that were never completed and
+        the `.<name>.bj-pruning` directories of snapshots whose deletion was interrupted.
+    """
+
+    stale = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        for suffix in STALE_SUFFIXES:
+            if not (name.startswith('.') and name.endswith(suffix)):
+                continue
+            try:
+                datetime.strptime(name[1 : -len(suffix)], SNAPSHOT_FORMAT)
+            except ValueError:
+                continue
+            if os.path.isdir(os.path.join(directory, name)):
+                stale.append(Path(directory, name))
+    return sorted(stale)
+
+
+def remove_stale_snapshots(
+    directory: str | Path, workers: int = None
+) -> list[Path]:
+    """
+    Delete the hidden snapshots left behind by interrupted runs and prunings.
+
+    Args:
+        directory: The directory holding the snapshots (`destination/<source.stem>`).
+        workers: The number of threads deleting files at the same time.
+
+    Returns:
+        The deleted directories (see `list_stale_snapshots`).
+
+    Only one run may write the snapshots of a source at a time: the snapshot being
+    written by another run would be deleted as well.
+    """
+
+    stale = list_stale_snapshots(directory)
+    for path in stale:
+        snapshot = path.with_name(path.name[1:].rsplit('.', 1)[0])
+        manifest_path(snapshot).unlink(missing_ok=True)
+    _delete_directories(stale, workers)
+    return stale
+
+
+def _make_writable(path: str | Path) -> None:
+    """
+    Give the owner of a directory the permission to delete its entries.
+
+    Args:
+        path: The path of the directory.
+    """
+
+    mode = os.stat(path).st_mode
+    if not mode & S_IWUSR:
+        os.chmod(path, mode | S_IWUSR)
+
+
+def _retry_writable(
+    function: Callable[[str], Any], path: str, exc_info: tuple
+) -> None:
+    """
+    Retry a failed deletion of `shutil.rmtree` once its parent directory is writable.
+
+    Args:
+        function: The function that failed.
+        path: The path it failed on.
+        exc_info: The exception it raised, as returned by `sys.exc_info`.
+
+    Raises:
+        Exception: The exception, if it is not a `PermissionError`.
+    """
+
+    if not isinstance(exc_info[1], PermissionError):
+        raise exc_info[1]
+    _make_writable(os.path.dirname(path))
+    function(path)
+
+
+def prune_snapshots(
+    directory: str | Path, keep: int, workers: int = None
+) -> list[Path]:
+    """
+    Delete the oldest snapshots of a source, keeping the most recent ones.
+
+    Args:
+        directory: The directory holding the snapshots (`destination/<source.stem>`).
+        keep: The number of snapshots to keep.
+        workers: The number of threads deleting files at the same time.
+
+    Returns:
+        The deleted snapshots.
+
+    Each snapshot is first renamed to a hidden name, so an interrupted pruning never
+    leaves a partial snapshot that looks complete, and its manifest is removed. The
+    pruned snapshots are then deleted along with the ones left behind by interrupted
+    runs and prunings (see `remove_stale_snapshots`).
+    """
+
+    remove_stale_snapshots(directory, workers)
+    snapshots = list_snapshots(directory)
+    pruned = snapshots[: max(len(snapshots) - keep, 0)]
+    hidden = []
+    for snapshot in pruned:
+        hidden_path = snapshot.with_name(f'.{snapshot.name}.bj-pruning')
+        os.replace(snapshot, hidden_path)
+        hidden.append(hidden_path)
+        manifest_path(snapshot).unlink(missing_ok=True)
+    _delete_directories(hidden, workers)
+    return pruned
+
+
+def _delete_directories(paths: list[Path], workers: int = None) -> None:
+    """
+    Delete directory trees, their top level entries in parallel.
+
+    Args:
+        paths: The directories to delete.
+        workers: The number of threads deleting files at the same time.
+
+    Snapshot directories keep the modes of the source directories, so the read-only
+    ones are made writable by their owner before their entries are deleted.
+    """
+
+    def remove(path: Path) -> None:
+        if path.is_dir() and not path.is_symlink():
+            shutil.rmtree(path, onerror=_retry_writable)
+        else:
+            path.unlink()
+
+    for path in paths:
+        _make_writable(path)
+    with ThreadPoolExecutor(workers) as executor:
+        list(
+            executor.map(
+                remove, [child for path in paths for child in path.iterdir()]
+            )
+        )
+    for path in paths:
+        path.rmdir()
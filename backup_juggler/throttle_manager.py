@@ -0,0 +1,307 @@
+import json
+import threading
+import time
+import weakref
+from pathlib import Path
+
+SIZE_SUFFIXES = {
+    '': 1,
+    'K': 1024,
+    'M': 1024**2,
+    'G': 1024**3,
+    'T': 1024**4,
+}
+
+
+def parse_size(text: str) -> int:
+    """
+    Parse a size such as `500K`, `50M` or `1G` into bytes.
+
+    Args:
+        text: The size, as a number optionally followed by K, M, G or T.
+
+    Returns:
+        The size in bytes.
+
+    Raises:
+        ValueError: If the size cannot be parsed.
+
+    Examples:
+        >>> parse_size('50M')
+        52428800
+    """
+
+    text = text.strip().upper().removesuffix('B')
+    suffix = text[-1:] if text[-1:] in SIZE_SUFFIXES else ''
+    number = text[: len(text) - len(suffix)]
+    return int(float(number) * SIZE_SUFFIXES[suffix])
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the rate of an amount (bytes or files).
+
+    Attributes:
+        _rate: The number of tokens added per second, or `None` for no limit.
+        _tokens: The tokens available; negative when callers are in debt.
+        _updated: The `time.monotonic` time of the last refill.
+        _lock: The lock protecting the bucket.
+
+    Methods:
+        - rate: Get the current rate.
+        - set_rate: Change the rate, taking effect immediately.
+        - consume: Take tokens, sleeping as long as needed to respect the rate.
+
+    Notes:
+        - The bucket holds at most one second worth of tokens, so bursts stay short.
+        - Tokens are taken after the work is done. A caller that takes more than is
+          available sleeps until the debt is paid, so the average rate is respected
+          across all the threads sharing the bucket.
+    """
+
+    def __init__(self, rate: float = None) -> None:
+        """
+        Initialize a `TokenBucket` instance.
+
+        Args:
+            rate: The number of tokens added per second. Defaults to `None`, no limit.
+        """
+
+        self._rate: float | None = rate or None
+        self._tokens: float = rate or 0
+        self._updated: float = time.monotonic()
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def rate(self) -> float | None:
+        """
+        Get the current rate.
+
+        Returns:
+            _rate: The number of tokens added per second, or `None` for no limit.
+        """
+
+        return self._rate
+
+    def set_rate(self, rate: float | None) -> None:
+        """
+        Change the rate, taking effect immediately.
+
+        Args:
+            rate: The number of tokens added per second, or `None` for no limit.
+        """
+
+        with self._lock:
+            self._rate = rate or None
+            self._tokens = min(self._tokens, rate or 0)
+            self._updated = time.monotonic()
+
+    def consume(self, amount: float) -> None:
+        """
+        Take tokens, sleeping as long as needed to respect the rate.
+
+        Args:
+            amount: The number of tokens to take.
+        """
+
+        with self._lock:
+            if self._rate is None:
+                return
+            now = time.monotonic()
+            self._tokens = min(
+                self._rate, self._tokens + (now - self._updated) * self._rate
+            )
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class Throttle:
+    """
+    Byte and file rate limits of a backup job, chained to the global limits.
+
+    Attributes:
+        _bytes: The `TokenBucket` of the bytes copied.
+        _files: The `TokenBucket` of the files copied.
+        _parent: The `Throttle` also charged for everything charged to this one.
+
+    Methods:
+        - set_rates: Change the limits.
+        - transferred: Charge copied bytes.
+        - file_started: Charge a file about to be copied.
+    """
+
+    def __init__(
+        self,
+        bytes_per_second: float = None,
+        files_per_second: float = None,
+        parent: 'Throttle' = None,
+    ) -> None:
+        """
+        Initialize a `Throttle` instance.
+
+        Args:
+            bytes_per_second: The maximum number of bytes copied per second.
+            files_per_second: The maximum number of files copied per second.
+            parent: The `Throttle` also charged, usually `global_throttle`.
+
+        A job throttle, one with a parent, created while a `ControlFileWatcher` is
+        running gets the job limits of the control file instead of the given ones.
+        """
+
+        self._parent: Throttle | None = parent
+        with _job_lock:
+            if parent is not None and _job_rates is not None:
+                bytes_per_second, files_per_second = _job_rates
+            self._bytes: TokenBucket = TokenBucket(bytes_per_second)
+            self._files: TokenBucket = TokenBucket(files_per_second)
+            if parent is not None:
+                _job_throttles.add(self)
+
+    def set_rates(
+        self, bytes_per_second: float = None, files_per_second: float = None
+    ) -> None:
+        """
+        Change the limits. `None` removes a limit.
+
+        Args:
+            bytes_per_second: The maximum number of bytes copied per second.
+            files_per_second: The maximum number of files copied per second.
+        """
+
+        self._bytes.set_rate(bytes_per_second)
+        self._files.set_rate(files_per_second)
+
+    def transferred(self, size: int) -> None:
+        """
+        Charge copied bytes, sleeping if a limit is exceeded.
+
+        Args:
+            size: The number of bytes copied.
+        """
+
+        self._bytes.consume(size)
+        if self._parent is not None:
+            self._parent.transferred(size)
+
+    def file_started(self) -> None:
+        """
+        Charge a file about to be copied, sleeping if a limit is exceeded.
+        """
+
+        self._files.consume(1)
+        if self._parent is not None:
+            self._parent.file_started()
+
+
+_job_lock = threading.Lock()
+_job_rates: tuple[float | None, float | None] | None = None
+_job_throttles: 'weakref.WeakSet[Throttle]' = weakref.WeakSet()
+global_throttle = Throttle()
+
+
+class ControlFileWatcher:
+    """
+    Thread applying the limits written to a control file while backups run.
+
+    Attributes:
+        _path: The path of the JSON control file.
+        _interval: The number of seconds between two checks of the file.
+        _stop: The event stopping the thread.
+        _thread: The polling thread.
+
+    Methods:
+        - start: Start watching the control file.
+        - stop: Stop watching the control file.
+        - apply: Apply the limits of the control file.
+
+    Notes:
+        - The control file is a JSON object with any of the keys `bytes_per_second` and
+          `files_per_second` (global limits) and `job_bytes_per_second` and
+          `job_files_per_second` (limits of every running job). Missing keys or `null`
+          remove the limit. Sizes may be given as strings such as `"50M"`.
+        - The file is read again whenever its modification time changes.
+        - The job limits of the file apply to the running jobs and to the jobs started
+          later, until the watcher is stopped.
+    """
+
+    def __init__(self, path: Path, interval: float = 1.0) -> None:
+        """
+        Initialize a `ControlFileWatcher` instance.
+
+        Args:
+            path: The path of the JSON control file.
+            interval: The number of seconds between two checks of the file.
+        """
+
+        self._path: Path = path
+        self._interval: float = interval
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread = threading.Thread(
+            target=self._watch, daemon=True
+        )
+
+    def start(self) -> None:
+        """
+        Apply the control file and start watching it for changes.
+        """
+
+        self.apply()
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop watching the control file.
+        """
+
+        global _job_rates
+
+        self._stop.set()
+        self._thread.join()
+        with _job_lock:
+            _job_rates = None
+
+    def apply(self) -> None:
+        """
+        Apply the limits of the control file, if it exists and is valid.
+        """
+
+        global _job_rates
+
+        try:
+            with open(self._path) as file:
+                limits = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        def rate(key: str) -> float | None:
+            value = limits.get(key)
+            return parse_size(value) if isinstance(value, str) else value
+
+        global_throttle.set_rates(
+            rate('bytes_per_second'), rate('files_per_second')
+        )
+        with _job_lock:
+            _job_rates = (
+                rate('job_bytes_per_second'),
+                rate('job_files_per_second'),
+            )
+            for throttle in list(_job_throttles):
+                throttle.set_rates(*_job_rates)
+
+    def _watch(self) -> None:
+        """
+        Poll the modification time of the control file until stopped.
+        """
+
+        last_mtime = None
+        while not self._stop.wait(self._interval):
+            try:
+                mtime = self._path.stat().st_mtime_ns
+            except OSError:
+                continue
+            if mtime != last_mtime:
+                last_mtime = mtime
+                self.apply()
@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from backup_juggler.order_manager import COPY_ORDERS
+from benchmarks.tree_generator import PROFILES, generate_tree
+
+BJ_COMMAND = [sys.executable, '-m', 'backup_juggler']
+
+
+def measure(command: list[str], syscalls: bool = False) -> dict:
+    """
+    Run a command in a child process and measure it.
+
+    Args:
+        command: The command and its arguments.
+        syscalls: If `True`, run the command under `strace -c -f` to count its
+            system calls.
+
+    Returns:
+        The wall time in seconds, the user and system CPU time, the peak RSS of the
+        child in KiB, and the number of system calls (or `None`).
+
+    Raises:
+        subprocess.CalledProcessError: If the command fails.
+    """
+
+    summary_path = None
+    if syscalls:
+        with tempfile.NamedTemporaryFile(suffix='.strace', delete=False) as f:
+            summary_path = f.name
+        command = ['strace', '-c', '-f', '-o', summary_path, *command]
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            command, stdout=subprocess.DEVNULL, stderr=stderr
+        )
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(
+                process.returncode, command, stderr=stderr.read()
+            )
+
+    syscall_count = None
+    if summary_path is not None:
+        with open(summary_path) as summary:
+            for line in summary:
+                fields = line.split()
+                if fields and fields[-1] == 'total':
+                    syscall_count = int(fields[3])
+        os.remove(summary_path)
+    return {
+        'seconds': seconds,
+        'user_seconds': usage.ru_utime,
+        'system_seconds': usage.ru_stime,
+        'peak_rss_kb': usage.ru_maxrss,
+        'syscalls': syscall_count,
+    }
+
+
+def measure_startup(runs: int = 10) -> dict:
+    """
+    Measure how long `bj` takes to start, before doing any work.
+
+    Args:
+        runs: The number of times each command is run.
+
+    Returns:
+        The median wall time in seconds of `bj --version` and `bj --help`.
+    """
+
+    commands = {
+        'version': [*BJ_COMMAND, '--version'],
+        'help': [*BJ_COMMAND, '--help'],
+    }
+    return {
+        name: statistics.median(
+            measure(command)['seconds'] for _ in range(runs)
+        )
+        for name, command in commands.items()
+    }
+
+
+def run_profile(
+    profile: str,
+    work_dir: Path,
+    scale: float,
+    seed: int,
+    backup_args: list[str],
+    syscalls: bool,
+    orders: list[str] = None,
+) -> dict:
+    """
+    Generate the tree of a profile and benchmark `get-size` and `do-backups` on it.
+
+    Args:
+        profile: The name of one of the `PROFILES`.
+        work_dir: The directory holding the generated trees and the backups.
+        scale: The factor applied to the number of files of the profile.
+        seed: The seed of the generated tree.
+        backup_args: Extra arguments given to `bj do-backups`.
+        syscalls: If `True`, count the system calls of each command.
+        orders: Copy orders `do-backups` is also measured with, each one reported
+            as `do-backups[<order>]`.
+
+    Returns:
+        The description of the tree and the measurements of every command, with
+        their throughput in files and MiB per second.
+    """
+
+    source = work_dir / profile
+    tree = generate_tree(source, profile, scale, seed)
+    destination = work_dir / f'{profile}-backup'
+    commands = {
+        'get-size': [*BJ_COMMAND, 'get-size', '-s', str(source)],
+        'do-backups': [
+            *BJ_COMMAND,
+            'do-backups',
+            '-s',
+            str(source),
+            '-d',
+            str(destination),
+            *backup_args,
+        ],
+    }
+    for order in orders or []:
+        commands[f'do-backups[{order}]'] = [
+            *commands['do-backups'],
+            '--order',
+            order,
+        ]
+
+    results = {}
+    for name, command in commands.items():
+        shutil.rmtree(destination, ignore_errors=True)
+        destination.mkdir()
+        result = measure(command, syscalls)
+        result['files_per_second'] = tree['files'] / result['seconds']
+        result['mib_per_second'] = (
+            tree['bytes'] / 1024**2 / result['seconds']
+        )
+        results[name] = result
+    shutil.rmtree(destination, ignore_errors=True)
+    return {**tree, 'backup_args': backup_args, 'commands': results}
+
+
+def main(argv: list[str] = None) -> None:
+    """
+    Run the benchmarks from the command line and write a JSON report.
+
+    Args:
+        argv: The command line arguments. Defaults to `sys.argv[1:]`.
+
+    Examples:
+        python -m benchmarks.run --profile mixed --scale 0.01 --output report.json
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark get-size and do-backups on synthetic trees.'
+    )
+    parser.add_argument(
+        '--profile',
+        action='append',
+        choices=sorted(PROFILES),
+        help='Profile to run, may be repeated. Defaults to all profiles.',
+    )
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--work-dir',
+        type=Path,
+        default=Path(tempfile.gettempdir()) / 'bj-benchmarks',
+        help='Directory for the generated trees, which are reused between runs.',
+    )
+    parser.add_argument(
+        '--backup-arg',
+        action='append',
+        default=[],
+        help='Extra argument for do-backups, e.g. --backup-arg=--workers=8.',
+    )
+    parser.add_argument(
+        '--order',
+        action='append',
+        default=[],
+        choices=COPY_ORDERS,
+        help='Also measure do-backups with this copy order, may be repeated.',
+    )
+    parser.add_argument(
+        '--syscalls',
+        action='store_true',
+        help='Count system calls with strace.',
+    )
+    parser.add_argument(
+        '--startup-runs',
+        type=int,
+        default=10,
+        help='Number of runs of the startup benchmark, 0 to skip it.',
+    )
+    parser.add_argument('--output', type=Path, default=Path('benchmark.json'))
+    args = parser.parse_args(argv)
+    if args.syscalls and shutil.which('strace') is None:
+        parser.error('--syscalls needs strace to be installed')
+
+    args.work_dir.mkdir(parents=True, exist_ok=True)
+    report = {
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'startup': (
+            measure_startup(args.startup_runs) if args.startup_runs else None
+        ),
+        'profiles': {
+            profile: run_profile(
+                profile,
+                args.work_dir,
+                args.scale,
+                args.seed,
+                args.backup_arg,
+                args.syscalls,
+                args.order,
+            )
+            for profile in args.profile or sorted(PROFILES)
+        },
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import json
+import random
+import shutil
+from pathlib import Path
+from typing import NamedTuple
+
+
+class FileSet(NamedTuple):
+    """
+    A group of generated files sharing the same shape.
+
+    Attributes:
+        count: The number of files.
+        min_size: The minimum size of a file in bytes.
+        max_size: The maximum size of a file in bytes.
+        files_per_dir: The number of files per directory.
+        depth: The number of nested directories above the files.
+    """
+
+    count: int
+    min_size: int
+    max_size: int
+    files_per_dir: int
+    depth: int = 1
+
+
+PROFILES: dict[str, list[FileSet]] = {
+    'tiny': [FileSet(1_000_000, 0, 4096, 1000)],
+    'huge': [FileSet(4, 1024**3, 1024**3, 4)],
+    'deep': [FileSet(20_000, 1024, 65536, 10, depth=64)],
+    'mixed': [
+        FileSet(200_000, 0, 4096, 500),
+        FileSet(20_000, 64 * 1024, 4 * 1024**2, 100, depth=4),
+        FileSet(2, 1024**3, 1024**3, 2),
+    ],
+}
+BLOCK_SIZE = 1024 * 1024
+
+
+def generate_tree(
+    root: Path, profile: str, scale: float = 1.0, seed: int = 0
+) -> dict:
+    """
+    Generate a reproducible synthetic source tree.
+
+    Args:
+        root: The directory the tree is generated in. It is emptied first, unless
+            it already holds the same profile, scale and seed, as recorded in the
+            `<root>.json` file next to it.
+        profile: The name of one of the `PROFILES`.
+        scale: The factor applied to the number of files of the profile, so that
+            CI can run small versions of the same shapes.
+        seed: The seed of the random sizes and contents.
+
+    Returns:
+        The description of the tree: profile, scale, seed, files and bytes.
+
+    The same arguments always produce the same names, sizes and contents. The contents
+    are slices of a random block, so large trees are generated at disk speed.
+    """
+
+    marker = root.with_name(f'{root.name}.json')
+    wanted = {'profile': profile, 'scale': scale, 'seed': seed}
+    if marker.is_file() and root.is_dir():
+        description = json.loads(marker.read_text())
+        if {key: description[key] for key in wanted} == wanted:
+            return description
+    marker.unlink(missing_ok=True)
+    if root.exists():
+        shutil.rmtree(root)
+
+    generator = random.Random(seed)
+    block = generator.randbytes(BLOCK_SIZE)
+    blocks = memoryview(block + block)
+    files = total_size = 0
+    for set_index, file_set in enumerate(PROFILES[profile]):
+        count = max(1, round(file_set.count * scale))
+        for index in range(count):
+            directory = root.joinpath(
+                f'set{set_index}',
+                *(
+                    f'level{level}'
+                    for level in range(
+                        index // file_set.files_per_dir % file_set.depth
+                    )
+                ),
+                f'dir{index // file_set.files_per_dir}',
+            )
+            if index % file_set.files_per_dir == 0:
+                directory.mkdir(parents=True, exist_ok=True)
+            size = generator.randint(file_set.min_size, file_set.max_size)
+            start = generator.randrange(BLOCK_SIZE)
+            with open(directory / f'file{index}.bin', 'wb') as file:
+                written = 0
+                while written < size:
+                    length = min(size - written, BLOCK_SIZE)
+                    file.write(blocks[start : start + length])
+                    written += length
+            files += 1
+            total_size += size
+
+    description = {**wanted, 'files': files, 'bytes': total_size}
+    marker.write_text(json.dumps(description))
+    return description
@@ -0,0 +1,49 @@
+import json
+
+from benchmarks.run import main
+from benchmarks.tree_generator import generate_tree
+
+
+def test_if_generate_tree_is_reproducible(tmp_path):
+    first = generate_tree(tmp_path / 'first', 'deep', scale=0.001, seed=7)
+    second = generate_tree(tmp_path / 'second', 'deep', scale=0.001, seed=7)
+
+    first_files = {
+        path.relative_to(tmp_path / 'first'): path.read_bytes()
+        for path in (tmp_path / 'first').rglob('*.bin')
+    }
+    second_files = {
+        path.relative_to(tmp_path / 'second'): path.read_bytes()
+        for path in (tmp_path / 'second').rglob('*.bin')
+    }
+
+    assert first == second
+    assert first['files'] == len(first_files) == 20
+    assert first_files == second_files
+
+
+def test_if_benchmarks_write_a_machine_readable_report(tmp_path):
+    output = tmp_path / 'report.json'
+
+    main(
+        [
+            '--profile',
+            'deep',
+            '--scale',
+            '0.001',
+            '--work-dir',
+            str(tmp_path / 'trees'),
+            '--startup-runs',
+            '1',
+            '--output',
+            str(output),
+        ]
+    )
+
+    report = json.loads(output.read_text())
+    commands = report['profiles']['deep']['commands']
+
+    assert set(commands) == {'get-size', 'do-backups'}
+    assert commands['do-backups']['files_per_second'] > 0
+    assert commands['do-backups']['peak_rss_kb'] > 0
+    assert report['startup']['version'] > 0
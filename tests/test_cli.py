@@ -1,8 +1,10 @@
 import subprocess
+import sys
 
 import pytest
+from typer.testing import CliRunner
 
-from backup_juggler.juggler_cli import get_version
+from backup_juggler.juggler_cli import app, get_version
 from tests.fixtures_cli import run_backup_juggler
 from tests.fixtures_temp import (
     create_directories,
@@ -24,6 +26,31 @@ def test_print_successfully_app_version_message(run_backup_juggler):
     assert app_version in result.stdout
 
 
+def test_if_the_cli_starts_without_importing_the_backup_engine():
+    heavy_modules = [
+        'backup_juggler.checksum_manager',
+        'backup_juggler.compression_manager',
+        'backup_juggler.files_manager',
+        'backup_juggler.pack_manager',
+        'sqlite3',
+        'toml',
+        'tqdm',
+    ]
+    result = subprocess.run(
+        [
+            sys.executable,
+            '-c',
+            'import sys, backup_juggler.juggler_cli; '
+            f'print([m for m in {heavy_modules} if m in sys.modules])',
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == '[]'
+
+
 def test_print_successfully_app_help_message(run_backup_juggler):
     result = run_backup_juggler(options='--help')
     app_help = (
@@ -116,3 +143,39 @@ def test_runs_cli_get_size_single_or_multi_source_files_and_directories(
     result = run_backup_juggler(subcommand='get-size', sources=source_paths)
 
     assert result.exit_code == 0
+
+
+def test_runs_cli_invalidate_index_successfully(
+    monkeypatch, tmp_path, run_backup_juggler
+):
+    monkeypatch.setenv('BJ_CACHE_DIR', str(tmp_path))
+    result = run_backup_juggler(subcommand='invalidate-index')
+
+    assert result.exit_code == 0
+    assert 'Scan index invalidated' in result.stdout
+
+
+def test_runs_cli_verify_after_do_backups_with_hash(
+    create_files, create_directories
+):
+    (source_path,) = create_files(['source.txt'])
+    (destination_path,) = create_directories(['destination'])
+    runner = CliRunner()
+    runner.invoke(
+        app,
+        [
+            'do-backups',
+            '-s',
+            str(source_path),
+            '-d',
+            str(destination_path),
+            '--hash',
+            'sha256',
+        ],
+    )
+    result = runner.invoke(
+        app, ['verify', '-b', str(destination_path / source_path.stem)]
+    )
+
+    assert result.exit_code == 0
+    assert 'Verified 1 file(s) of source' in result.stdout
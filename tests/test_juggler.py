@@ -1,11 +1,54 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+
 import pytest
 
+from backup_juggler import (
+    copy_engine,
+    delta_manager,
+    files_manager,
+    throttle_manager,
+)
+from backup_juggler.backup_options import BackupOptions
+from backup_juggler.checksum_manager import Manifest, manifest_path
+from backup_juggler.compression_manager import (
+    BLOCK_SIZE,
+    COMPRESSED_SUFFIX,
+    COMPRESSION_CODECS,
+    CompressedReader,
+    compress_stream,
+    raw_size,
+)
+from backup_juggler.dedup_manager import STORE_DIRECTORY
+from backup_juggler.delta_manager import signature_path
 from backup_juggler.files_manager import (
     backup,
     calculates_size,
     parallel_backups,
+    restore_backups,
+    verify_backups,
 )
+from backup_juggler.filter_manager import PathFilter
+from backup_juggler.index_manager import ScanIndex
+from backup_juggler.journal_manager import Journal, partial_path
+from backup_juggler.metrics_manager import PHASES
+from backup_juggler.order_manager import COPY_ORDERS, order_entries
+from backup_juggler.pack_manager import PACK_DIRECTORY, PackStore
 from backup_juggler.paths_manager import Paths
+from backup_juggler.scan_manager import Entry, scan_tree
+from backup_juggler.scheduler_manager import JobScheduler
+from backup_juggler.snapshot_manager import list_snapshots, prune_snapshots
+from backup_juggler.throttle_manager import (
+    ControlFileWatcher,
+    Throttle,
+    TokenBucket,
+    global_throttle,
+    parse_size,
+)
 from tests.fixtures_temp import (
     create_directories,
     create_files,
@@ -196,3 +239,1203 @@ def test_calculates_size_method_return_filenotfounderror_exception(tmp_path):
     error_message = f'{source_path.name} does not exist.'
 
     assert error_message == error.value.args[0]
+
+
+@pytest.mark.parametrize(
+    'source_dirnames, destination_dirnames',
+    [
+        (['source1'], ['destination1', 'destination2']),
+        (['source1', 'source2'], ['destination1', 'destination2']),
+    ],
+)
+def test_if_fan_out_backups_write_identical_copies_to_every_destination(
+    create_directories,
+    create_subdirectories_recursively,
+    source_dirnames,
+    destination_dirnames,
+):
+    source_paths = create_directories(source_dirnames)
+    destination_paths = create_directories(destination_dirnames)
+    source_structure = {
+        'subdir1': {'file1.txt': b'\x01' * (3 * 1024 * 1024 + 7)},
+        'file2.txt': b'\x02' * 1024,
+    }
+    for source_path in source_paths:
+        create_subdirectories_recursively(
+            directory_structure=source_structure, parent_path=source_path
+        )
+
+    parallel_backups(
+        sources=source_paths, destinations=destination_paths, fan_out=True
+    )
+
+    for source_path in source_paths:
+        for destination_path in destination_paths:
+            destination_dir = destination_path / source_path.name
+            for src_file in source_path.rglob('*.*'):
+                dst_file = destination_dir / src_file.relative_to(source_path)
+
+                assert dst_file.read_bytes() == src_file.read_bytes()
+
+
+def test_if_fan_out_raises_instead_of_hanging_when_a_writer_fails(
+    monkeypatch, tmp_path, create_directories
+):
+    source_path = tmp_path / 'source.bin'
+    source_path.write_bytes(b'\x01' * (4 * 1024 * 1024))
+    destination_paths = create_directories(['destination1', 'destination2'])
+    failing_file = destination_paths[1] / 'source' / 'source.bin'
+
+    class FailingFile(io.BytesIO):
+        def write(self, data):
+            raise RuntimeError('writer failed')
+
+    def fake_open(file, mode='r', *args, **kwargs):
+        if os.fspath(file) == os.fspath(failing_file):
+            return FailingFile()
+        return open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr(files_manager, 'TEE_BUFFER_CHUNKS', 1)
+    monkeypatch.setattr(files_manager, 'open', fake_open, raising=False)
+
+    with pytest.raises(RuntimeError, match='writer failed'):
+        backup(source_path, destination_paths)
+
+
+@pytest.mark.parametrize('kernel_copy_supported', [True, False])
+def test_if_backup_copies_the_exact_contents_with_or_without_kernel_copy(
+    monkeypatch, tmp_path, kernel_copy_supported
+):
+    source_path = tmp_path / 'source.bin'
+    source_path.write_bytes(os.urandom(256 * 1024) * 41)
+    destination_path = tmp_path / 'destination'
+    destination_path.mkdir()
+    if not kernel_copy_supported:
+        monkeypatch.setattr(
+            files_manager,
+            'kernel_copy',
+            lambda src, dst, progress, **kwargs: (0, False),
+        )
+
+    backup(source=source_path, destination=destination_path)
+
+    destination_file = destination_path / source_path.stem / source_path.name
+
+    assert destination_file.read_bytes() == source_path.read_bytes()
+
+
+@pytest.mark.parametrize('copied_before_zero', [0, 256 * 1024])
+def test_if_kernel_copy_returning_zero_early_falls_back_to_userspace(
+    monkeypatch, tmp_path, copied_before_zero
+):
+    source_path = tmp_path / 'source.bin'
+    source_path.write_bytes(os.urandom(1024 * 1024))
+    destination_path = tmp_path / 'destination'
+    destination_path.mkdir()
+    copy_file_range = os.copy_file_range
+
+    def short_copy_file_range(
+        src, dst, count, offset_src=None, offset_dst=None
+    ):
+        if offset_src >= copied_before_zero:
+            return 0
+        count = min(count, copied_before_zero - offset_src)
+        return copy_file_range(src, dst, count, offset_src, offset_dst)
+
+    monkeypatch.setattr(copy_engine, '_clone', lambda src, dst: False)
+    monkeypatch.setattr(os, 'copy_file_range', short_copy_file_range)
+    monkeypatch.setattr(os, 'sendfile', lambda *args: 0)
+
+    backup(source=source_path, destination=destination_path)
+
+    destination_file = destination_path / source_path.stem / source_path.name
+
+    assert destination_file.read_bytes() == source_path.read_bytes()
+
+
+@pytest.mark.parametrize('checksum', [False, True])
+def test_if_incremental_backups_copy_only_new_or_changed_files(
+    capfd,
+    create_directories,
+    create_subdirectories_recursively,
+    checksum,
+):
+    source_path, destination_path = create_directories(
+        ['source', 'destination']
+    )
+    create_subdirectories_recursively(
+        directory_structure={
+            'subdir1': {'file1.txt': b'\x01' * 1024},
+            'file2.txt': b'\x02' * 2048,
+        },
+        parent_path=source_path,
+    )
+    options = BackupOptions(incremental=True, checksum=checksum)
+    backup(source_path, destination_path, options)
+    capfd.readouterr()
+
+    (source_path / 'file2.txt').write_bytes(b'\x03' * 4096)
+    (source_path / 'file3.txt').write_bytes(b'\x04' * 10)
+    backup(source_path, destination_path, options)
+    captured = capfd.readouterr()
+
+    destination_dir = destination_path / source_path.name
+
+    assert 'Skipped 1 unchanged file(s) (1.00 KB)' in captured.out
+    assert (destination_dir / 'file2.txt').read_bytes() == b'\x03' * 4096
+    assert (destination_dir / 'file3.txt').read_bytes() == b'\x04' * 10
+
+
+def test_if_scan_tree_lists_every_file_once_with_its_metadata(
+    create_directories, create_subdirectories_recursively
+):
+    (source_path,) = create_directories(['source'])
+    create_subdirectories_recursively(
+        directory_structure={
+            'subdir1': {'subdir2': {'file1.txt': b'\x00' * 10}},
+            'file2.txt': b'\x00' * 20,
+        },
+        parent_path=source_path,
+    )
+
+    entries = {entry.relative_path: entry for entry in scan_tree(source_path)}
+    file1_stat = (source_path / 'subdir1/subdir2/file1.txt').stat()
+
+    assert sorted(entries) == ['file2.txt', 'subdir1/subdir2/file1.txt']
+    assert entries['subdir1/subdir2/file1.txt'].size == 10
+    assert entries['subdir1/subdir2/file1.txt'].mtime_ns == (
+        file1_stat.st_mtime_ns
+    )
+    assert Paths(source_path).total_size == 30
+
+
+def test_if_backup_restores_the_source_times_and_mode(tmp_path):
+    source_path = tmp_path / 'source.sh'
+    source_path.write_bytes(b'#!/bin/sh\n')
+    os.chmod(source_path, 0o750)
+    os.utime(source_path, ns=(1_600_000_000_123_456_789,) * 2)
+    destination_path = tmp_path / 'destination'
+
+    backup(source=source_path, destination=destination_path)
+
+    source_stat = source_path.stat()
+    destination_stat = (
+        destination_path / source_path.stem / source_path.name
+    ).stat()
+
+    assert destination_stat.st_mtime_ns == source_stat.st_mtime_ns
+    assert destination_stat.st_mode == source_stat.st_mode
+
+
+@pytest.mark.parametrize('workers, device_workers', [(4, None), (4, 2)])
+def test_if_backups_with_several_workers_copy_every_file(
+    create_directories, workers, device_workers
+):
+    source_path, destination_path = create_directories(
+        ['source', 'destination']
+    )
+    for index in range(50):
+        file_path = source_path / f'subdir{index % 5}' / f'file{index}.txt'
+        file_path.parent.mkdir(exist_ok=True)
+        file_path.write_bytes(bytes([index]) * (index * 1000))
+    options = BackupOptions(workers=workers, device_workers=device_workers)
+
+    parallel_backups([source_path], [destination_path], options=options)
+
+    for src_file in source_path.rglob('*.*'):
+        dst_file = (
+            destination_path
+            / source_path.name
+            / src_file.relative_to(source_path)
+        )
+
+        assert dst_file.read_bytes() == src_file.read_bytes()
+
+
+def test_if_scan_index_tracks_changes_of_the_source_directories(
+    tmp_path, create_directories, create_subdirectories_recursively
+):
+    (source_path,) = create_directories(['source'])
+    create_subdirectories_recursively(
+        directory_structure={
+            'subdir1': {'subdir2': {'file1.txt': b'\x00' * 10}},
+            'file2.txt': b'\x00' * 20,
+        },
+        parent_path=source_path,
+    )
+    scan_index = ScanIndex(tmp_path / 'index.sqlite3')
+
+    assert scan_index.total_size(source_path) == 30
+
+    (source_path / 'subdir1' / 'subdir2' / 'file3.txt').write_bytes(b'\x00')
+    (source_path / 'file2.txt').unlink()
+
+    assert scan_index.total_size(source_path) == 11
+    assert scan_index.total_size(source_path) == Paths(source_path).total_size
+
+    (source_path / 'subdir1' / 'subdir2' / 'file1.txt').write_bytes(b'')
+    scan_index.invalidate(source_path)
+
+    assert scan_index.total_size(source_path) == 1
+
+
+def test_calculates_size_with_index_return_the_expected_size(
+    capfd,
+    monkeypatch,
+    tmp_path,
+    create_directories,
+    create_subdirectories_recursively,
+):
+    monkeypatch.setenv('BJ_CACHE_DIR', str(tmp_path / 'cache'))
+    source_paths = create_directories(['source1', 'source2'])
+    for source_path in source_paths:
+        create_subdirectories_recursively(
+            directory_structure={
+                'subdir1': {'file1.txt': b'\x00' * (1024 * 1024)},
+                'file2.txt': b'\x00' * (1024 * 1024),
+            },
+            parent_path=source_path,
+        )
+
+    calculates_size(source_paths, use_index=True)
+    calculates_size(source_paths, use_index=True)
+    captured = capfd.readouterr()
+
+    assert captured.out.count('Total size: 4.00 MB') == 2
+    assert (tmp_path / 'cache' / 'index.sqlite3').is_file()
+
+
+@pytest.mark.parametrize('fan_out', [False, True])
+def test_if_backups_with_hashing_write_a_manifest_that_can_be_verified(
+    create_directories, create_subdirectories_recursively, fan_out
+):
+    source_path, *destination_paths = create_directories(
+        ['source', 'destination1', 'destination2']
+    )
+    create_subdirectories_recursively(
+        directory_structure={
+            'subdir1': {'file1.txt': b'\x01' * (3 * 1024 * 1024)},
+            'file2.txt': b'\x02' * 100,
+        },
+        parent_path=source_path,
+    )
+    options = BackupOptions(hash_algorithm='sha256')
+
+    parallel_backups(
+        [source_path], destination_paths, fan_out=fan_out, options=options
+    )
+
+    backup_dirs = [
+        destination_path / source_path.name
+        for destination_path in destination_paths
+    ]
+    for backup_dir in backup_dirs:
+        manifest = Manifest(manifest_path(backup_dir))
+
+        assert manifest.algorithm == 'sha256'
+        assert manifest.files['file2.txt']['digest'] == (
+            hashlib.sha256(b'\x02' * 100).hexdigest()
+        )
+    assert verify_backups(backup_dirs)
+
+    (backup_dirs[0] / 'file2.txt').write_bytes(b'\x03' * 100)
+
+    assert not verify_backups(backup_dirs)
+
+
+def test_if_verify_with_changed_only_skips_files_unchanged_since_verified(
+    capfd, create_files, create_directories
+):
+    (source_path,) = create_files(['source.txt'])
+    (destination_path,) = create_directories(['destination'])
+    backup(
+        source_path, destination_path, BackupOptions(hash_algorithm='blake2b')
+    )
+    capfd.readouterr()
+
+    assert verify_backups(
+        [destination_path / source_path.stem], changed_only=True
+    )
+    assert 'Verified 0 file(s) of source, skipped 1 unchanged' in (
+        capfd.readouterr().out
+    )
+
+
+@pytest.mark.parametrize('hash_algorithm', [None, 'sha256'])
+def test_if_resumable_backups_resume_from_the_last_committed_offset(
+    monkeypatch, tmp_path, hash_algorithm
+):
+    monkeypatch.setattr(files_manager, 'RESUME_MIN_SIZE', 1024 * 1024)
+    monkeypatch.setattr(files_manager, 'JOURNAL_INTERVAL', 1024 * 1024)
+    source_path = tmp_path / 'source.bin'
+    contents = os.urandom(5 * 1024 * 1024 + 3)
+    source_path.write_bytes(contents)
+    destination_path = tmp_path / 'destination'
+    destination_file = destination_path / source_path.stem / source_path.name
+    destination_file.parent.mkdir(parents=True)
+    committed = 2 * 1024 * 1024
+    with open(partial_path(str(destination_file)), 'wb') as partial:
+        partial.write(contents[: committed + 1000])
+    Journal(str(destination_file)).commit(
+        committed, Entry.from_stat(source_path.name, source_path.stat())
+    )
+    offsets = []
+    kernel_copy = files_manager.kernel_copy
+
+    def recording_kernel_copy(*args, offset=0, **kwargs):
+        offsets.append(offset)
+        return kernel_copy(*args, offset=offset, **kwargs)
+
+    monkeypatch.setattr(files_manager, 'kernel_copy', recording_kernel_copy)
+
+    backup(
+        source_path,
+        destination_path,
+        BackupOptions(resumable=True, hash_algorithm=hash_algorithm),
+    )
+
+    assert destination_file.read_bytes() == contents
+    assert sorted(os.listdir(destination_file.parent)) == [source_path.name]
+    if hash_algorithm is None:
+        assert offsets[0] == committed
+    else:
+        manifest = Manifest(manifest_path(destination_file.parent))
+
+        assert manifest.files[source_path.name]['digest'] == (
+            hashlib.sha256(contents).hexdigest()
+        )
+
+
+def test_if_token_bucket_sleeps_to_respect_its_rate():
+    bucket = TokenBucket(rate=100)
+    start = time.monotonic()
+    bucket.consume(100)
+    bucket.consume(20)
+
+    assert time.monotonic() - start >= 0.15
+
+
+def test_if_control_file_changes_the_global_rate_limits(monkeypatch, tmp_path):
+    monkeypatch.setattr(throttle_manager, '_job_rates', None)
+    control_file = tmp_path / 'limits.json'
+    control_file.write_text(
+        json.dumps({'bytes_per_second': '50M', 'files_per_second': 10})
+    )
+
+    ControlFileWatcher(control_file).apply()
+
+    assert global_throttle._bytes.rate == parse_size('50M') == 50 * 1024**2
+    assert global_throttle._files.rate == 10
+
+    control_file.write_text('{}')
+    ControlFileWatcher(control_file).apply()
+
+    assert global_throttle._bytes.rate is None
+
+
+def test_if_jobs_started_after_the_control_file_get_its_job_limits(
+    monkeypatch, tmp_path, create_files, create_directories
+):
+    source_path = create_files(['source.txt'])[0]
+    destination_path = create_directories(['destination'])[0]
+    control_file = tmp_path / 'limits.json'
+    control_file.write_text(
+        json.dumps(
+            {'job_bytes_per_second': '1G', 'job_files_per_second': 1000}
+        )
+    )
+    throttles = []
+    copier_init = files_manager.FileCopier.__init__
+
+    def recording_init(self, *args, **kwargs):
+        copier_init(self, *args, **kwargs)
+        throttles.append(self._throttle)
+
+    monkeypatch.setattr(files_manager.FileCopier, '__init__', recording_init)
+    watcher = ControlFileWatcher(control_file, interval=0.01)
+    watcher.start()
+    try:
+        options = BackupOptions(
+            bytes_per_second=10**12, files_per_second=10**6
+        )
+        backup(source_path, destination_path, options)
+    finally:
+        watcher.stop()
+
+    assert throttles[0]._bytes.rate == 1024**3
+    assert throttles[0]._files.rate == 1000
+    assert Throttle(1, 2, parent=global_throttle)._files.rate == 2
+
+
+def test_if_parallel_backups_exports_the_metrics_of_every_job(
+    tmp_path, create_files, create_directories
+):
+    source_path = create_files(['source1.txt', 'source2.txt'])
+    destination_path = create_directories(['destination'])
+    json_path = tmp_path / 'metrics.json'
+    textfile_path = tmp_path / 'metrics.prom'
+
+    parallel_backups(
+        source_path,
+        destination_path,
+        options=BackupOptions(
+            metrics_json=json_path, metrics_textfile=textfile_path
+        ),
+    )
+
+    jobs = json.loads(json_path.read_text())['jobs']
+    assert len(jobs) == 2
+    for job in jobs:
+        assert job['files'] == 1
+        assert job['bytes'] == 1024 * 1024
+        assert set(job['phases']) == set(PHASES)
+        assert job['phases']['copy'] > 0
+        assert job['file_latency']['buckets']['+Inf'] == 1
+    textfile = textfile_path.read_text()
+    assert '# TYPE bj_backup_file_latency_seconds histogram' in textfile
+    assert (
+        f'bj_backup_files_total{{source="{source_path[0]}",'
+        f'destination="{destination_path[0]}"}} 1'
+    ) in textfile
+
+
+def test_if_json_progress_reports_the_bytes_of_every_backup(
+    capfd, create_files, create_directories
+):
+    source_paths = create_files(['source1.txt', 'source2.txt'])
+    destination_paths = create_directories(['destination'])
+
+    parallel_backups(
+        source_paths,
+        destination_paths,
+        options=BackupOptions(progress='json', workers=2),
+    )
+
+    last_line = json.loads(capfd.readouterr().err.splitlines()[-1])
+    assert last_line['done'] == last_line['total'] == 2 * 1024 * 1024
+    assert sorted(job['source'] for job in last_line['jobs']) == [
+        str(path) for path in source_paths
+    ]
+
+
+@pytest.mark.parametrize(
+    'options',
+    [
+        BackupOptions(sparse=True),
+        BackupOptions(sparse=True, hash_algorithm='sha256'),
+        BackupOptions(sparse=True, resumable=True),
+    ],
+)
+def test_if_sparse_backup_keeps_the_holes_of_the_source(
+    tmp_path, create_directories, options
+):
+    source_path = tmp_path / 'disk.img'
+    with open(source_path, 'wb') as source:
+        source.seek(16 * 1024 * 1024)
+        source.write(b'data' * 1024)
+        source.truncate(80 * 1024 * 1024)
+    destination_path = create_directories(['destination'])[0]
+
+    backup(source_path, destination_path, options)
+
+    destination_file = destination_path / 'disk' / source_path.name
+    assert destination_file.read_bytes() == source_path.read_bytes()
+    assert destination_file.stat().st_blocks * 512 < 1024 * 1024
+    if options.hash_algorithm:
+        manifest = Manifest(manifest_path(destination_file.parent))
+
+        assert manifest.files[source_path.name]['digest'] == (
+            hashlib.sha256(source_path.read_bytes()).hexdigest()
+        )
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_if_userspace_copy_of_a_large_file_keeps_its_contents(
+    monkeypatch, tmp_path, create_directories, use_mmap
+):
+    monkeypatch.setattr(files_manager, 'MMAP_MIN_SIZE', 1024 * 1024)
+    monkeypatch.setattr(files_manager, 'MMAP_WINDOW', 1024 * 1024)
+    source_path = tmp_path / 'large.bin'
+    contents = os.urandom(5 * 1024 * 1024 + 123)
+    source_path.write_bytes(contents)
+    destination_path = create_directories(['destination'])[0]
+
+    backup(
+        source_path,
+        destination_path,
+        BackupOptions(hash_algorithm='sha256', use_mmap=use_mmap),
+    )
+
+    destination_file = destination_path / 'large' / source_path.name
+    manifest = Manifest(manifest_path(destination_file.parent))
+    assert destination_file.read_bytes() == contents
+    assert manifest.files[source_path.name]['digest'] == (
+        hashlib.sha256(contents).hexdigest()
+    )
+
+
+def test_if_chunk_size_follows_the_file_and_block_sizes():
+    assert files_manager.chunk_size_for(1000, 4096) == 128 * 1024
+    assert files_manager.chunk_size_for(32 * 1024**2, 4096) == 2 * 1024**2
+    assert files_manager.chunk_size_for(100 * 1024**3, 4096) == 8 * 1024**2
+    assert files_manager.chunk_size_for(32 * 1024**2, 3 * 1024**2) == (
+        3 * 1024**2
+    )
+
+
+def test_if_dedup_stores_identical_files_once_and_skips_known_ones(
+    monkeypatch, tmp_path, create_directories
+):
+    source_paths = create_directories(['source1', 'source2'])
+    for source_path in source_paths:
+        (source_path / 'same.txt').write_bytes(b'same contents' * 1000)
+    (source_paths[1] / 'other.txt').write_bytes(b'other contents')
+    destination_path = create_directories(['destination'])[0]
+    options = BackupOptions(dedup=True)
+
+    parallel_backups(source_paths, [destination_path], options=options)
+
+    blobs = [
+        path
+        for path in (destination_path / STORE_DIRECTORY / 'objects').rglob('*')
+        if path.is_file()
+    ]
+    first = destination_path / 'source1' / 'same.txt'
+    second = destination_path / 'source2' / 'same.txt'
+    assert len(blobs) == 2
+    assert first.read_bytes() == second.read_bytes()
+    assert (destination_path / 'source2' / 'other.txt').read_bytes() == (
+        b'other contents'
+    )
+
+    def fail(*args):
+        raise AssertionError('a known file was read again')
+
+    monkeypatch.setattr(files_manager, 'file_digest', fail)
+    first.unlink()
+
+    parallel_backups(source_paths, [destination_path], options=options)
+
+    assert first.read_bytes() == b'same contents' * 1000
+
+
+@pytest.mark.parametrize(
+    'options',
+    [
+        BackupOptions(),
+        BackupOptions(incremental=True),
+        BackupOptions(incremental=True, delta=True),
+    ],
+)
+def test_if_backups_after_dedup_never_write_through_shared_blobs(
+    monkeypatch, create_directories, options
+):
+    source_path, destination_path = create_directories(
+        ['source', 'destination']
+    )
+    contents = b'same contents' * 1000
+    (source_path / 'a.txt').write_bytes(contents)
+    (source_path / 'b.txt').write_bytes(contents)
+    backup(source_path, destination_path, BackupOptions(dedup=True))
+    changed = source_path / 'a.txt'
+    changed.write_bytes(b'CHANGED' + contents[7:])
+    os.utime(changed, ns=(0, changed.stat().st_mtime_ns + 10**9))
+    monkeypatch.setattr(files_manager, 'DELTA_MIN_SIZE', 1)
+
+    backup(source_path, destination_path, options)
+
+    blobs = [
+        path
+        for path in (destination_path / STORE_DIRECTORY / 'objects').rglob('*')
+        if path.is_file()
+    ]
+    assert [blob.read_bytes() for blob in blobs] == [contents]
+    assert (destination_path / 'source' / 'a.txt').read_bytes() == (
+        changed.read_bytes()
+    )
+    assert (destination_path / 'source' / 'b.txt').read_bytes() == contents
+
+
+def test_if_snapshots_link_unchanged_files_and_prune_old_ones(
+    tmp_path, create_directories, create_subdirectories_recursively
+):
+    source_path = create_directories(['source'])[0]
+    create_subdirectories_recursively(
+        directory_structure={
+            'subdir': {'unchanged.txt': b'unchanged'},
+            'changed.txt': b'first',
+        },
+        parent_path=source_path,
+    )
+    destination_path = create_directories(['destination'])[0]
+    options = BackupOptions(
+        snapshot=True, keep_snapshots=2, hash_algorithm='sha256'
+    )
+
+    backup(source_path, destination_path, options)
+    changed = source_path / 'changed.txt'
+    changed.write_bytes(b'second')
+    os.utime(changed, ns=(0, changed.stat().st_mtime_ns + 10**9))
+    backup(source_path, destination_path, options)
+
+    first, second = list_snapshots(destination_path / 'source')
+    assert (first / 'changed.txt').read_bytes() == b'first'
+    assert (second / 'changed.txt').read_bytes() == b'second'
+    assert (first / 'subdir' / 'unchanged.txt').stat().st_ino == (
+        second / 'subdir' / 'unchanged.txt'
+    ).stat().st_ino
+    assert verify_backups([second])
+
+    backup(source_path, destination_path, options)
+
+    snapshots = list_snapshots(destination_path / 'source')
+    assert len(snapshots) == 2
+    assert first not in snapshots
+    assert not manifest_path(first).exists()
+    assert sorted(os.listdir(destination_path / 'source')) == sorted(
+        [path.name for path in snapshots]
+        + [manifest_path(path).name for path in snapshots]
+    )
+
+
+@pytest.mark.parametrize('codec', COMPRESSION_CODECS)
+def test_if_compressed_blocks_can_be_read_from_any_position(tmp_path, codec):
+    data = b''.join(
+        b'line %d of a compressible file\n' % index
+        for index in range(BLOCK_SIZE // 16)
+    )
+    source = tmp_path / 'data.txt'
+    compressed = tmp_path / f'data.txt{COMPRESSED_SUFFIX}'
+    source.write_bytes(data)
+
+    with open(source, 'rb') as src, open(compressed, 'wb') as dst:
+        size = compress_stream(src, [dst], codec, lambda count: None)
+
+    assert size == len(data) == raw_size(compressed)
+    assert compressed.stat().st_size < len(data)
+    with CompressedReader(compressed) as reader:
+        reader.seek(BLOCK_SIZE - 10)
+        assert reader.read(20) == data[BLOCK_SIZE - 10 : BLOCK_SIZE + 10]
+        reader.seek(0)
+        assert reader.readall() == data
+
+
+def test_if_compressed_backups_can_be_verified_and_restored(
+    tmp_path, create_directories
+):
+    source_path = create_directories(['source'])[0]
+    text = b'compressible contents\n' * (BLOCK_SIZE // 8)
+    noise = os.urandom(BLOCK_SIZE + 1000)
+    (source_path / 'text.txt').write_bytes(text)
+    (source_path / 'noise.bin').write_bytes(noise)
+    (source_path / 'photo.jpg').write_bytes(b'jpeg data')
+    destination_path = create_directories(['destination'])[0]
+    options = BackupOptions(
+        compression='gzip',
+        compression_workers=2,
+        hash_algorithm='sha256',
+        incremental=True,
+    )
+
+    parallel_backups([source_path], [destination_path], options=options)
+
+    backup_dir = destination_path / 'source'
+    assert sorted(os.listdir(backup_dir)) == [
+        f'noise.bin{COMPRESSED_SUFFIX}',
+        'photo.jpg',
+        f'text.txt{COMPRESSED_SUFFIX}',
+    ]
+    compressed_text = backup_dir / f'text.txt{COMPRESSED_SUFFIX}'
+    assert compressed_text.stat().st_size < len(text) // 10
+    assert (backup_dir / f'noise.bin{COMPRESSED_SUFFIX}').stat().st_size < (
+        len(noise) + 1024
+    )
+    assert verify_backups([backup_dir])
+
+    mtime_ns = compressed_text.stat().st_mtime_ns
+    parallel_backups([source_path], [destination_path], options=options)
+    assert compressed_text.stat().st_mtime_ns == mtime_ns
+
+    restore_backups([backup_dir], tmp_path / 'restored')
+
+    restored = tmp_path / 'restored' / 'source'
+    assert (restored / 'text.txt').read_bytes() == text
+    assert (restored / 'noise.bin').read_bytes() == noise
+    assert (restored / 'photo.jpg').read_bytes() == b'jpeg data'
+    assert (restored / 'text.txt').stat().st_mtime_ns == (
+        (source_path / 'text.txt').stat().st_mtime_ns
+    )
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_if_source_files_named_like_compressed_files_are_backed_up(
+    tmp_path, create_directories, compression
+):
+    source_path, destination_path = create_directories(
+        ['source', 'destination']
+    )
+    (source_path / 'old.bjz').write_bytes(b'not a compressed file')
+    (source_path / 'data.txt').write_bytes(b'data')
+    options = BackupOptions(
+        compression=compression, hash_algorithm='sha256', incremental=True
+    )
+
+    parallel_backups([source_path], [destination_path], options=options)
+
+    backup_dir = destination_path / 'source'
+    suffix = COMPRESSED_SUFFIX if compression else ''
+    assert sorted(os.listdir(backup_dir)) == [
+        f'data.txt{suffix}',
+        f'old.bjz{suffix}',
+    ]
+    assert verify_backups([backup_dir])
+
+    stored = backup_dir / f'old.bjz{suffix}'
+    mtime_ns = stored.stat().st_mtime_ns
+    parallel_backups([source_path], [destination_path], options=options)
+    assert stored.stat().st_mtime_ns == mtime_ns
+
+    restore_backups([backup_dir], tmp_path / 'restored')
+
+    restored = tmp_path / 'restored' / 'source'
+    assert sorted(os.listdir(restored)) == ['data.txt', 'old.bjz']
+    assert (restored / 'old.bjz').read_bytes() == b'not a compressed file'
+
+
+def test_if_small_files_are_packed_into_segments_and_restored(
+    tmp_path, create_directories, create_subdirectories_recursively
+):
+    source_path = create_directories(['source'])[0]
+    create_subdirectories_recursively(
+        directory_structure={
+            'mail': {
+                f'message{index}.eml': b'x' * index for index in range(50)
+            },
+            'large.bin': b'large' * 1000,
+        },
+        parent_path=source_path,
+    )
+    destination_path = create_directories(['destination'])[0]
+    options = BackupOptions(
+        pack_threshold=1024, hash_algorithm='sha256', incremental=True
+    )
+
+    backup(source_path, destination_path, options)
+
+    backup_dir = destination_path / 'source'
+    assert sorted(os.listdir(backup_dir)) == [PACK_DIRECTORY, 'large.bin']
+    segments = list((backup_dir / PACK_DIRECTORY).glob('*.tar'))
+    assert len(segments) == 1
+    with tarfile.open(segments[0]) as archive:
+        assert len(archive.getnames()) == 50
+    assert PackStore(backup_dir).read('mail/message7.eml') == b'x' * 7
+    assert verify_backups([backup_dir])
+
+    backup(source_path, destination_path, options)
+    assert list((backup_dir / PACK_DIRECTORY).glob('*.tar')) == segments
+
+    restore_backups([backup_dir], tmp_path / 'restored')
+
+    restored = tmp_path / 'restored' / 'source'
+    assert (restored / 'mail' / 'message49.eml').read_bytes() == b'x' * 49
+    assert (restored / 'large.bin').read_bytes() == b'large' * 1000
+    assert (restored / 'mail' / 'message3.eml').stat().st_mtime_ns == (
+        (source_path / 'mail' / 'message3.eml').stat().st_mtime_ns
+    )
+
+
+def test_if_files_shrinking_into_packs_lose_their_standalone_copy(
+    tmp_path, create_directories
+):
+    source_path = create_directories(['source'])[0]
+    (source_path / 'a.bin').write_bytes(b'a' * 5000)
+    destination_path = create_directories(['destination'])[0]
+    options = BackupOptions(
+        pack_threshold=1000, hash_algorithm='sha256', incremental=True
+    )
+
+    backup(source_path, destination_path, options)
+
+    backup_dir = destination_path / 'source'
+    assert (backup_dir / 'a.bin').exists()
+    (source_path / 'a.bin').write_bytes(b'small')
+
+    backup(source_path, destination_path, options)
+
+    assert os.listdir(backup_dir) == [PACK_DIRECTORY]
+    assert verify_backups([backup_dir])
+
+    restore_backups([backup_dir], tmp_path / 'restored')
+
+    restored = tmp_path / 'restored' / 'source'
+    assert (restored / 'a.bin').read_bytes() == b'small'
+
+
+def test_if_delta_backups_rewrite_only_the_changed_blocks(
+    monkeypatch, tmp_path, create_directories
+):
+    monkeypatch.setattr(files_manager, 'DELTA_MIN_SIZE', 0)
+    monkeypatch.setattr(delta_manager, 'DELTA_BLOCK_SIZE', 4096)
+    source_path = create_directories(['source'])[0]
+    image = source_path / 'disk.img'
+    data = bytearray(os.urandom(64 * 4096))
+    image.write_bytes(data)
+    destination_path = create_directories(['destination'])[0]
+    options = BackupOptions(delta=True, hash_algorithm='sha256')
+
+    backup(source_path, destination_path, options)
+
+    backup_dir = destination_path / 'source'
+    assert signature_path(backup_dir, 'disk.img').exists()
+    data[10 * 4096 + 5 : 10 * 4096 + 9] = b'edit'
+    data += b'appended'
+    image.write_bytes(data)
+    writes = []
+    real_apply_delta = files_manager.apply_delta
+
+    def apply_delta(*args, **kwargs):
+        signatures, written = real_apply_delta(*args, **kwargs)
+        writes.append(written)
+        return signatures, written
+
+    monkeypatch.setattr(files_manager, 'apply_delta', apply_delta)
+    monkeypatch.setattr(files_manager, 'compute_signature', None)
+
+    backup(source_path, destination_path, options)
+
+    assert (backup_dir / 'disk.img').read_bytes() == bytes(data)
+    assert writes == [4096 + len(b'appended')]
+    assert verify_backups([backup_dir])
+
+
+@pytest.mark.parametrize('workers, resumable', [(1, False), (4, True)])
+def test_if_streaming_backups_copy_while_scanning(
+    monkeypatch,
+    create_directories,
+    create_subdirectories_recursively,
+    workers,
+    resumable,
+):
+    monkeypatch.setattr(files_manager, 'STREAM_QUEUE_SIZE', 2)
+    source_path = create_directories(['source'])[0]
+    create_subdirectories_recursively(
+        directory_structure={
+            f'dir{index}': {f'file{index}.txt': b'data' * index}
+            for index in range(20)
+        },
+        parent_path=source_path,
+    )
+    destination_path = create_directories(['destination'])[0]
+    options = BackupOptions(
+        streaming=True, workers=workers, resumable=resumable
+    )
+    paths = Paths(source_path, destination_path, streaming=True)
+
+    assert paths.entries == []
+    assert paths.total_size == 0
+    assert paths.scanning
+
+    backup(source_path, destination_path, options)
+
+    for index in range(20):
+        source_file = source_path / f'dir{index}' / f'file{index}.txt'
+        destination_file = (
+            destination_path / 'source' / f'dir{index}' / f'file{index}.txt'
+        )
+        assert destination_file.read_bytes() == b'data' * index
+        assert destination_file.stat().st_mtime_ns == (
+            source_file.stat().st_mtime_ns
+        )
+    assert sum(1 for _ in paths.iter_entries()) == 20
+    assert paths.total_size == sum(4 * index for index in range(20))
+    assert not paths.scanning
+
+
+@pytest.mark.parametrize('limit, expected_concurrency', [(1, 1), (8, 4)])
+def test_if_scheduler_caps_the_concurrent_jobs_of_each_device(
+    create_directories, limit, expected_concurrency
+):
+    paths = create_directories(['source1', 'source2', 'source3', 'source4'])
+    running = []
+    concurrency = []
+
+    def job(index):
+        running.append(index)
+        concurrency.append(len(running))
+        time.sleep(0.05)
+        running.remove(index)
+        return index
+
+    scheduler = JobScheduler(device_limit=lambda device: limit)
+    results = scheduler.run(
+        [
+            (lambda index=index: job(index), [path])
+            for index, path in enumerate(paths)
+        ]
+    )
+
+    assert sorted(results) == [0, 1, 2, 3]
+    assert max(concurrency) == expected_concurrency
+
+
+@pytest.mark.parametrize('order', COPY_ORDERS)
+def test_if_copy_orders_sort_the_scanned_files(
+    create_directories, create_subdirectories_recursively, order
+):
+    source_path = create_directories(['source'])[0]
+    create_subdirectories_recursively(
+        directory_structure={
+            f'file{index}.txt': b'x' * (index * 7 % 10) for index in range(10)
+        },
+        parent_path=source_path,
+    )
+    destination_path = create_directories(['destination'])[0]
+    entries = Paths(source_path).entries
+
+    ordered = order_entries(entries, order, str(source_path))
+
+    assert sorted(ordered) == sorted(entries)
+    if order == 'inode':
+        assert [entry.inode for entry in ordered] == sorted(
+            entry.inode for entry in entries
+        )
+    elif order == 'largest':
+        assert [entry.size for entry in ordered] == sorted(
+            (entry.size for entry in entries), reverse=True
+        )
+    elif order == 'smallest':
+        assert [entry.size for entry in ordered] == sorted(
+            entry.size for entry in entries
+        )
+
+    backup(source_path, destination_path, BackupOptions(copy_order=order))
+
+    assert len(os.listdir(destination_path / 'source')) == 10
+
+
+def test_if_directories_are_created_once_and_get_the_source_metadata(
+    monkeypatch, create_directories, create_subdirectories_recursively
+):
+    source_path = create_directories(['source'])[0]
+    create_subdirectories_recursively(
+        directory_structure={
+            'outer': {
+                'inner': {f'file{index}.txt': b'data' for index in range(20)},
+                'file.txt': b'data',
+            },
+        },
+        parent_path=source_path,
+    )
+    inner = source_path / 'outer' / 'inner'
+    inner.chmod(0o750)
+    os.utime(inner, ns=(10**18, 10**18))
+    os.utime(source_path / 'outer', ns=(2 * 10**18, 2 * 10**18))
+    destination_path = create_directories(['destination'])[0]
+    created = []
+    real_mkdir = os.mkdir
+
+    def mkdir(path, *args, **kwargs):
+        created.append(os.fspath(path))
+        return real_mkdir(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'mkdir', mkdir)
+
+    backup(source_path, destination_path, BackupOptions(workers=4))
+
+    backup_dir = destination_path / 'source'
+    assert sorted(created) == [
+        str(backup_dir),
+        str(backup_dir / 'outer'),
+        str(backup_dir / 'outer' / 'inner'),
+    ]
+    assert (backup_dir / 'outer' / 'inner').stat().st_mode & 0o777 == 0o750
+    assert (backup_dir / 'outer' / 'inner').stat().st_mtime_ns == 10**18
+    assert (backup_dir / 'outer').stat().st_mtime_ns == 2 * 10**18
+
+
+def test_if_filters_select_the_files_and_prune_excluded_directories(
+    monkeypatch,
+    tmp_path,
+    create_directories,
+    create_subdirectories_recursively,
+):
+    source_path, destination_path = create_directories(
+        ['source', 'destination']
+    )
+    create_subdirectories_recursively(
+        directory_structure={
+            '.bjignore': b'# generated files\n*.log\nnode_modules/\n',
+            'Makefile': b'\x00' * 1,
+            'app.py': b'\x00' * 2,
+            'debug.log': b'\x00' * 4,
+            'notes.tmp': b'\x00' * 8,
+            'build': {'out.py': b'\x00' * 16},
+            'src': {
+                'main.py': b'\x00' * 32,
+                'build': {'gen.py': b'\x00' * 64},
+                'node_modules': {'lib.py': b'\x00' * 128},
+            },
+        },
+        parent_path=source_path,
+    )
+    scanned = []
+    real_scandir = os.scandir
+
+    def scandir(path, *args, **kwargs):
+        scanned.append(os.path.relpath(path, source_path))
+        return real_scandir(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'scandir', scandir)
+    path_filter = PathFilter.for_source(
+        source_path, excludes=['*.tmp', '/build/']
+    )
+
+    entries = sorted(
+        entry.relative_path for entry in scan_tree(source_path, path_filter)
+    )
+
+    assert entries == [
+        '.bjignore',
+        'Makefile',
+        'app.py',
+        'src/build/gen.py',
+        'src/main.py',
+    ]
+    assert sorted(scanned) == ['.', 'src', 'src/build']
+
+    options = BackupOptions(includes=('*.py',), excludes=('build/',))
+    backup(source_path, destination_path, options)
+
+    backup_dir = destination_path / 'source'
+    assert sorted(
+        str(path.relative_to(backup_dir))
+        for path in backup_dir.rglob('*')
+        if path.is_file()
+    ) == ['app.py', 'src/main.py']
+
+    scan_index = ScanIndex(tmp_path / 'index.sqlite3')
+    sizes = [
+        scan_index.total_size(source_path, path_filter),
+        scan_index.total_size(source_path),
+        scan_index.total_size(source_path, path_filter),
+    ]
+
+    assert (
+        sizes[0]
+        == sizes[2]
+        == Paths(source_path, path_filter=path_filter).total_size
+    )
+    assert sizes[1] == Paths(source_path).total_size
+    assert sizes[1] > sizes[0]
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_if_read_only_directories_are_writable_while_files_are_copied(
+    monkeypatch,
+    create_directories,
+    create_subdirectories_recursively,
+    streaming,
+):
+    source_path, destination_path = create_directories(
+        ['source', 'destination']
+    )
+    create_subdirectories_recursively(
+        directory_structure={'ro': {'first.txt': b'first'}},
+        parent_path=source_path,
+    )
+    (source_path / 'ro').chmod(0o555)
+    options = BackupOptions(
+        incremental=True, resumable=True, streaming=streaming
+    )
+    backup(source_path, destination_path, options)
+
+    backup_dir = destination_path / 'source' / 'ro'
+    assert backup_dir.stat().st_mode & 0o777 == 0o555
+
+    (source_path / 'ro').chmod(0o755)
+    (source_path / 'ro' / 'second.txt').write_bytes(b'second')
+    (source_path / 'ro').chmod(0o555)
+    modes = []
+    copy_entry = files_manager.FileCopier._copy_entry
+
+    def recording_copy_entry(self, entry):
+        copy_entry(self, entry)
+        if entry.relative_path == 'ro/second.txt':
+            modes.append(backup_dir.stat().st_mode & 0o777)
+
+    monkeypatch.setattr(
+        files_manager.FileCopier, '_copy_entry', recording_copy_entry
+    )
+    backup(source_path, destination_path, options)
+
+    assert modes == [0o755]
+    assert (backup_dir / 'second.txt').read_bytes() == b'second'
+    assert backup_dir.stat().st_mode & 0o777 == 0o555
+
+
+def test_if_snapshots_with_read_only_directories_are_pruned(
+    create_directories, create_subdirectories_recursively
+):
+    source_path, destination_path = create_directories(
+        ['source', 'destination']
+    )
+    create_subdirectories_recursively(
+        directory_structure={'ro': {'file.txt': b'data'}},
+        parent_path=source_path,
+    )
+    (source_path / 'ro').chmod(0o555)
+    source_path.chmod(0o555)
+    options = BackupOptions(snapshot=True, keep_snapshots=1)
+
+    backup(source_path, destination_path, options)
+    backup(source_path, destination_path, options)
+
+    source_path.chmod(0o755)
+    (snapshot,) = list_snapshots(destination_path / 'source')
+    assert (snapshot / 'ro' / 'file.txt').read_bytes() == b'data'
+    assert os.listdir(destination_path / 'source') == [snapshot.name]
+
+
+def test_if_snapshot_runs_and_prunings_delete_interrupted_snapshots(
+    create_directories, create_subdirectories_recursively
+):
+    source_path, destination_path = create_directories(
+        ['source', 'destination']
+    )
+    create_subdirectories_recursively(
+        directory_structure={'file.txt': b'data'}, parent_path=source_path
+    )
+    snapshots_dir = destination_path / 'source'
+    create_subdirectories_recursively(
+        directory_structure={
+            '.2024-05-01T03-00-00.000000Z.bj-partial': {
+                'ro': {'file.txt': b'partial'}
+            },
+            '.2024-05-02T03-00-00.000000Z.bj-pruning': {'file.txt': b'old'},
+            '.notes.bj-partial': {'file.txt': b'kept'},
+        },
+        parent_path=snapshots_dir,
+    )
+    (snapshots_dir / '.2024-05-01T03-00-00.000000Z.bj-partial' / 'ro').chmod(
+        0o555
+    )
+    partial_manifest = manifest_path(
+        snapshots_dir / '2024-05-01T03-00-00.000000Z'
+    )
+    partial_manifest.write_text('{}')
+
+    backup(source_path, destination_path, BackupOptions(snapshot=True))
+
+    (snapshot,) = list_snapshots(snapshots_dir)
+    assert sorted(os.listdir(snapshots_dir)) == [
+        '.notes.bj-partial',
+        snapshot.name,
+    ]
+
+    (snapshots_dir / '.2024-05-03T03-00-00.000000Z.bj-pruning').mkdir()
+
+    assert prune_snapshots(snapshots_dir, keep=1) == []
+    assert sorted(os.listdir(snapshots_dir)) == [
+        '.notes.bj-partial',
+        snapshot.name,
+    ]